@@ -0,0 +1,6 @@
+"""
+TGV Max Trip Planner - Benchmarks
+
+Synthetic exports (synthetic.py), the benchmark runner (run.py) and the
+comparison of result files (compare.py).
+"""
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files written by benchmarks/run.py.
+
+A benchmark regresses when its median is more than THRESHOLD slower than
+in the baseline (and by more than MIN_DELTA_SECONDS, so sub-millisecond
+noise is not reported). Different result sizes are listed too: the code or
+the data behaves differently, and the timings may not be comparable.
+"""
+
+import argparse
+import json
+import sys
+
+THRESHOLD = 0.2
+MIN_DELTA_SECONDS = 0.002
+
+
+def _index(run):
+    return {(scale_run['scale'], entry['name'], entry['case']): entry
+            for scale_run in run['scales'] for entry in scale_run['benchmarks']}
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """(regressions, improvements, changed results), each a list of (key, baseline entry, current entry)."""
+    before = _index(baseline)
+    regressions, improvements, changed = [], [], []
+    for key, entry in _index(current).items():
+        previous = before.get(key)
+        if previous is None:
+            continue
+        delta = entry['median'] - previous['median']
+        if delta > MIN_DELTA_SECONDS and entry['median'] > previous['median'] * (1 + threshold):
+            regressions.append((key, previous, entry))
+        elif -delta > MIN_DELTA_SECONDS and previous['median'] > entry['median'] * (1 + threshold):
+            improvements.append((key, previous, entry))
+        if entry['result'] != previous['result']:
+            changed.append((key, previous, entry))
+    return regressions, improvements, changed
+
+
+def report(baseline, current, threshold=THRESHOLD):
+    """Print the comparison; returns the regressions."""
+    regressions, improvements, changed = compare(baseline, current, threshold)
+    print(f"Baseline {(baseline.get('environment') or {}).get('commit') or '?'} "
+          f"({baseline.get('started_at')}), threshold {threshold:.0%}")
+    for title, items in (('❌ Regressions', regressions), ('🚀 Improvements', improvements)):
+        print(f"{title}: {len(items)}")
+        for (scale, name, case), previous, entry in items:
+            print(f"   {scale}x {name} {case}: {previous['median'] * 1000:.1f} ms -> {entry['median'] * 1000:.1f} ms "
+                  f"({entry['median'] / previous['median']:.2f}x)")
+    if changed:
+        print(f"⚠️ Different results: {len(changed)}")
+        for (scale, name, case), previous, entry in changed:
+            print(f"   {scale}x {name} {case}: {json.dumps(previous['result'])} -> {json.dumps(entry['result'])}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="Slowdown of the median counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+    return 1 if report(baseline, current, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
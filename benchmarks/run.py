@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for TGV Max Planner.
+
+For each scale, a synthetic export (benchmarks/synthetic.py) is generated
+once into the work directory, then a fresh process runs every stage on it
+in that scale's own directory:
+
+- ingest: ingest_export of the CSV into an empty database;
+- remove_past_trips, optimize_database_complete and day_trips.materialize
+  on a copy of the ingested database, as update_db runs them;
+- timetable loading (mapped snapshot and SQLite build);
+- find_optimal_destinations (same-day lookups and two-day searches, single
+  stations and a station group) and get_trip_connections at 0 to 3
+  connections, with the result cache emptied before every call.
+
+Results are written as JSON (timings of every run with min/median/mean,
+the result size of each call, the dataset and the environment);
+benchmarks/compare.py compares two result files.
+
+    python benchmarks/run.py --scale 1 --scale 10 --output results.json
+    python benchmarks/run.py --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+# Add the project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks import compare, synthetic
+
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'tgvmax-benchmarks')
+FORMAT_VERSION = 1
+
+DESTINATION_STATIONS = ['PARIS (intramuros)', 'LYON (intramuros)', 'RENNES', 'ILE DE FRANCE (toutes gares)']
+CONNECTION_PAIRS = [
+    ('PARIS (intramuros)', 'MARSEILLE ST CHARLES'),
+    ('RENNES', 'STRASBOURG'),
+    ('BREST', 'NICE VILLE'),
+    ('LILLE (intramuros)', 'TOULOUSE MATABIAU'),
+]
+CONNECTION_DAYS = 3
+
+# Benchmarks --skip accepts: ingest is needed by every other one
+SKIPPABLE = ('remove_past_trips', 'optimize_database_complete', 'day_trips.materialize', 'timetable.from_engine',
+             'find_optimal_destinations', 'get_trip_connections')
+
+
+class Results:
+    """
+    Timings grouped by (benchmark, case), in the order they were first taken.
+
+    They are saved to `path` after every run, so a worker killed part way
+    (out of memory on a large scale) still reports what it measured.
+    """
+
+    def __init__(self, path, skip=()):
+        self.path = path
+        self.skip = set(skip)
+        self.info = {}
+        self._entries = {}
+
+    def time(self, name, call, case='', **params):
+        """Run `call` once and record its duration and what _summary keeps of its result."""
+        if name in self.skip:
+            return None
+        start = time.perf_counter()
+        value = call()
+        elapsed = time.perf_counter() - start
+        entry = self._entries.setdefault((name, case), {'name': name, 'case': case, 'params': params,
+                                                         'times': [], 'result': None})
+        entry['times'].append(round(elapsed, 6))
+        entry['result'] = _summary(value)
+        self.save()
+        return value
+
+    def entries(self):
+        entries = []
+        for entry in self._entries.values():
+            times = entry['times']
+            entries.append(dict(entry, runs=len(times), min=min(times), median=statistics.median(times),
+                                mean=statistics.fmean(times), stdev=statistics.stdev(times) if len(times) > 1 else 0.0))
+        return entries
+
+    def save(self):
+        with open(self.path, 'w') as handle:
+            json.dump(dict(self.info, peak_rss_mb=_peak_rss_mb(), benchmarks=self.entries()), handle)
+
+
+def _summary(value):
+    """Size of a search result, or the counters of a maintenance step."""
+    if isinstance(value, dict):
+        return {key: item for key, item in value.items() if isinstance(item, (int, float)) and not isinstance(item, bool)
+                and 'time' not in key and 'elapsed' not in key and 'seconds' not in key}
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    return None
+
+
+def _peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _remove_database(path):
+    for suffix in ('', '-wal', '-shm', '.timetable'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def run_scale(args):
+    """Run every benchmark on one generated export; called in a fresh process inside the scale directory."""
+    # Every search is computed: no disk tier, and the memory tier is emptied before each call
+    os.environ['TGVMAX_CACHE_PATH'] = ''
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from src.logging_config import LOGS_DIR, setup_logging
+    setup_logging(os.path.join(LOGS_DIR, 'tgvmax_benchmarks.log'))
+    from src import cache, day_trips, db, ingest, timetable, timetable_file, utils
+
+    os.makedirs('data', exist_ok=True)
+    results = Results(args.worker, args.skip or ())
+    ingested = os.path.join('data', 'ingested.db')
+    work = os.path.join('data', 'work.db')
+    live = os.path.abspath(utils.DATABASE_PATH)
+
+    for _ in range(args.stage_repeat):
+        _remove_database(ingested)
+        engine = db.create_engine(ingested)
+        results.time('ingest', lambda: ingest.ingest_export(engine, args.csv))
+        engine.dispose()
+
+    for _ in range(args.stage_repeat):
+        _remove_database(work)
+        shutil.copyfile(ingested, work)
+        engine = db.create_engine(work)
+        results.time('remove_past_trips', lambda: utils.remove_past_trips(engine))
+        results.time('optimize_database_complete', lambda: utils.optimize_database_complete(engine))
+        results.time('day_trips.materialize', lambda: day_trips.materialize(engine))
+        engine.dispose()
+
+    # The last optimized copy is served, with its binary timetable as update_db writes it
+    _remove_database(live)
+    os.replace(work, live)
+    engine = db.create_engine(live)
+    timetable_file.export(engine)
+    results.info['trips'] = utils.run_query("SELECT COUNT(*) FROM TGVMAX", engine=engine, fetch='tuples')[0][0]
+    results.info['database_bytes'] = os.path.getsize(live)
+    engine.dispose()
+
+    results.time('timetable.load', lambda: timetable.get_timetable(utils.read_engine))
+    for _ in range(args.repeat):
+        results.time('timetable.from_engine', lambda: timetable.Timetable.from_engine(utils.read_engine))
+
+    day = date.fromisoformat(args.search_day)
+    for _ in range(args.repeat):
+        for station in DESTINATION_STATIONS:
+            for nights in (0, 1):
+                dates = [day.isoformat(), (day + timedelta(days=nights)).isoformat()]
+                cache.result_cache.clear()
+                results.time('find_optimal_destinations',
+                             lambda: utils.find_optimal_destinations(station, dates),
+                             case=f"{station} {'same day' if nights == 0 else 'next day'}",
+                             station=station, dates=dates)
+        for origin, destination in CONNECTION_PAIRS:
+            dates = [(day + timedelta(days=offset)).isoformat() for offset in range(CONNECTION_DAYS)]
+            for max_connections in range(4):
+                cache.result_cache.clear()
+                results.time('get_trip_connections',
+                             lambda: utils.get_trip_connections(dates, [origin], [destination],
+                                                                max_connections=max_connections),
+                             case=f"{origin} -> {destination} max_connections={max_connections}",
+                             origin=origin, destination=destination, dates=dates, max_connections=max_connections)
+    results.save()
+
+
+def _git(*command):
+    try:
+        return subprocess.run(['git', *command], cwd=project_root, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment():
+    import numpy
+    import pandas
+    import sqlalchemy
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'sqlalchemy': sqlalchemy.__version__,
+    }
+
+
+def _dataset(args, scale):
+    """Generate the export of `scale`, or reuse the one generated with the same parameters."""
+    path = os.path.join(args.workdir, f"tgvmax-{scale}x-{args.start}-{args.days}d-seed{args.seed}.csv")
+    manifest = path + '.json'
+    if os.path.exists(path) and os.path.exists(manifest):
+        with open(manifest) as handle:
+            return dict(json.load(handle), generate_seconds=None)
+    print(f"🏭 Generating the {scale}x export...", flush=True)
+    start_time = time.perf_counter()
+    dataset = synthetic.generate(path, scale, args.days, date.fromisoformat(args.start), args.seed)
+    dataset.update(scale=scale, days=args.days, start=args.start, seed=args.seed)
+    with open(manifest, 'w') as handle:
+        json.dump(dataset, handle)
+    return dict(dataset, generate_seconds=round(time.perf_counter() - start_time, 3))
+
+
+def _print_summary(run):
+    print(f"{'scale':>5}  {'benchmark':<28} {'case':<62} {'median ms':>10} {'min ms':>10}  result")
+    for scale_run in run['scales']:
+        for entry in scale_run['benchmarks']:
+            print(f"{scale_run['scale']:>4}x  {entry['name']:<28} {entry['case'][:62]:<62} "
+                  f"{entry['median'] * 1000:>10.1f} {entry['min'] * 1000:>10.1f}  {json.dumps(entry['result'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TGV Max Planner benchmarks on synthetic exports")
+    parser.add_argument('--scale', type=int, action='append',
+                        help="Multiple of the SNCF export size (repeatable; default 1)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of each search and timetable benchmark")
+    parser.add_argument('--stage-repeat', type=int, default=1,
+                        help="Runs of ingest, remove_past_trips, optimize and materialize")
+    parser.add_argument('--days', type=int, default=synthetic.DAYS)
+    parser.add_argument('--start', default=(date.today() - timedelta(days=1)).isoformat(),
+                        help="First day of the export (default: yesterday, so there are past trips to remove)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip', action='append', choices=SKIPPABLE,
+                        help="Benchmark to leave out (repeatable); without day_trips.materialize, "
+                             "same-day destination searches use the timetable")
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help="Generated exports and databases")
+    parser.add_argument('--output', help="Result file (default: <workdir>/results-<timestamp>.json)")
+    parser.add_argument('--baseline', help="Compare with this result file; exit 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=compare.THRESHOLD,
+                        help="Slowdown of the median counted as a regression")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--csv', help=argparse.SUPPRESS)
+    parser.add_argument('--search-day', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_scale(args)
+        return 0
+
+    args.workdir = os.path.abspath(args.workdir)
+    os.makedirs(args.workdir, exist_ok=True)
+    # Searched days are in the future of the export, away from its first (partly removed) day
+    search_day = (max(date.fromisoformat(args.start), date.today()) + timedelta(days=2)).isoformat()
+    run = {
+        'format_version': FORMAT_VERSION,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': _environment(),
+        'parameters': {'repeat': args.repeat, 'stage_repeat': args.stage_repeat, 'days': args.days,
+                       'start': args.start, 'seed': args.seed, 'search_day': search_day, 'skip': args.skip or []},
+        'scales': [],
+    }
+    for scale in args.scale or [1]:
+        dataset = _dataset(args, scale)
+        print(f"⏱️ Running the {scale}x benchmarks ({dataset['rows']:,} rows)...", flush=True)
+        scale_dir = os.path.join(args.workdir, f"{scale}x")
+        os.makedirs(scale_dir, exist_ok=True)
+        result_path = os.path.join(scale_dir, 'result.json')
+        if os.path.exists(result_path):
+            os.remove(result_path)
+        command = [sys.executable, os.path.abspath(__file__), '--worker', result_path, '--csv', dataset['path'],
+                   '--repeat', str(args.repeat), '--stage-repeat', str(args.stage_repeat), '--search-day', search_day]
+        for name in args.skip or ():
+            command += ['--skip', name]
+        returncode = subprocess.run(command, cwd=scale_dir).returncode
+        result = {'benchmarks': []}
+        if os.path.exists(result_path):
+            with open(result_path) as handle:
+                result = json.load(handle)
+        if returncode != 0:
+            # Negative: killed by a signal, usually SIGKILL from the OOM killer
+            result['error'] = (f"worker killed by {signal.Signals(-returncode).name}" if returncode < 0
+                               else f"worker exited with status {returncode}")
+            print(f"❌ {scale}x: {result['error']}, keeping the {len(result['benchmarks'])} benchmarks it finished")
+        run['scales'].append(dict(result, scale=scale, dataset=dataset))
+
+    output = args.output or os.path.join(
+        args.workdir, f"results-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as handle:
+        json.dump(run, handle, indent=2, ensure_ascii=False)
+    _print_summary(run)
+    print(f"✅ Results written to {output}")
+
+    failed = any('error' in scale_run for scale_run in run['scales'])
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        failed = bool(compare.report(baseline, run, args.threshold)) or failed
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic TGVMAX exports for the benchmarks.
+
+The CSV has the columns and formats of the SNCF export, so it goes through
+the real ingest. Trains run along French high-speed corridors (station
+names match config/station_groups.json, so group searches find them) and
+stop at a random subset of the corridor's stations; every origin/destination
+pair of a train is listed, as in the export. A pair is sold when every leg
+it spans has TGVmax seats left, then a share of sold pairs is marked NON
+again: these are the coupure/soudure non autorisée cases the fare-rule
+normalization repairs.
+
+At scale 1 the export is about the size of the real one (30 days, about
+200k rows). Scale N runs N times as many services on the same network, so
+rows, departures per station and connection candidates all grow N-fold.
+The same (scale, days, start, seed) always produces the same file.
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+COLUMNS = ['date', 'train_no', 'entity', 'axe', 'origine_iata', 'destination_iata',
+           'origine', 'destination', 'heure_depart', 'heure_arrivee', 'od_happy_card']
+
+# (axe, stations in route order, services a day at scale 1)
+CORRIDORS = [
+    ('SUD EST', ['PARIS (intramuros)', 'MARNE LA VALLEE CHESSY', 'LE CREUSOT MONTCEAU MONTCHANIN',
+                 'MACON LOCHE TGV', 'LYON ST EXUPERY TGV.', 'LYON (intramuros)', 'VALENCE TGV', 'AVIGNON TGV',
+                 'AIX EN PROVENCE TGV', 'MARSEILLE ST CHARLES', 'TOULON', 'LES ARCS DRAGUIGNAN', 'CANNES',
+                 'ANTIBES', 'NICE VILLE'], 80),
+    ('SUD EST', ['PARIS (intramuros)', 'LYON (intramuros)', 'VALENCE VILLE', 'AVIGNON CENTRE',
+                 'MARSEILLE BLANCARDE', 'MARSEILLE ST CHARLES'], 16),
+    ('SUD EST', ['PARIS (intramuros)', 'LYON (intramuros)', 'VALENCE TGV', 'NIMES PONT DU GARD',
+                 'MONTPELLIER SUD DE FRANCE', 'BEZIERS', 'NARBONNE', 'PERPIGNAN'], 28),
+    ('SUD EST', ['PARIS (intramuros)', 'VALENCE TGV', 'NIMES CENTRE', 'MONTPELLIER SAINT ROCH', 'SETE',
+                 'AGDE'], 16),
+    ('SUD EST', ['PARIS (intramuros)', 'DIJON VILLE', 'BESANCON FRANCHE COMTE TGV', 'BELFORT MONTBELIARD TGV',
+                 'MULHOUSE VILLE'], 20),
+    ('SUD EST', ['PARIS (intramuros)', 'LYON ST EXUPERY TGV.', 'CHAMBERY CHALLES LES EAUX', 'AIX LES BAINS LE REVARD',
+                 'ANNECY'], 16),
+    ('SUD EST', ['PARIS (intramuros)', 'LYON ST EXUPERY TGV.', 'GRENOBLE'], 16),
+    ('ATLANTIQUE', ['PARIS (intramuros)', 'MASSY TGV', 'ST PIERRE DES CORPS', 'POITIERS', 'ANGOULEME',
+                    'BORDEAUX ST JEAN', 'DAX', 'BAYONNE', 'BIARRITZ', 'HENDAYE'], 60),
+    ('ATLANTIQUE', ['PARIS (intramuros)', 'BORDEAUX ST JEAN', 'AGEN', 'MONTAUBAN VILLE BOURBON',
+                    'TOULOUSE MATABIAU'], 24),
+    ('ATLANTIQUE', ['PARIS (intramuros)', 'MASSY TGV', 'LE MANS', 'LAVAL', 'RENNES', 'ST BRIEUC', 'GUINGAMP',
+                    'MORLAIX', 'BREST'], 48),
+    ('ATLANTIQUE', ['PARIS (intramuros)', 'VERSAILLES CHANTIERS', 'LE MANS', 'ANGERS SAINT LAUD', 'NANTES',
+                    'ST NAZAIRE', 'LA BAULE ESCOUBLAC'], 44),
+    ('ATLANTIQUE', ['PARIS (intramuros)', 'MASSY PALAISEAU', 'RENNES', 'VANNES', 'LORIENT', 'QUIMPER'], 20),
+    ('NORD', ['PARIS (intramuros)', 'AEROPORT ROISSY CDG 2 TGV', 'ARRAS', 'DOUAI', 'LILLE (intramuros)',
+              'DUNKERQUE'], 56),
+    ('EST', ['PARIS (intramuros)', 'CHAMPAGNE ARDENNE TGV', 'MEUSE TGV', 'LORRAINE TGV', 'STRASBOURG'], 40),
+    ('EST', ['PARIS (intramuros)', 'LORRAINE TGV', 'METZ VILLE', 'THIONVILLE'], 16),
+    ('EST', ['PARIS (intramuros)', 'NANCY', 'EPINAL'], 12),
+    ('INTERNATIONAL', ['PARIS (intramuros)', 'MARNE LA VALLEE CHESSY', 'LILLE (intramuros)',
+                       'BRUXELLES MIDI'], 12),
+    ('SUD EST', ['LILLE (intramuros)', 'AEROPORT ROISSY CDG 2 TGV', 'MARNE LA VALLEE CHESSY', 'LYON ST EXUPERY TGV.',
+                 'VALENCE TGV', 'AVIGNON TGV', 'AIX EN PROVENCE TGV', 'MARSEILLE ST CHARLES'], 24),
+    ('SUD EST', ['STRASBOURG', 'MULHOUSE VILLE', 'BESANCON FRANCHE COMTE TGV', 'DIJON VILLE', 'LYON (intramuros)',
+                 'NIMES CENTRE', 'MONTPELLIER SAINT ROCH'], 16),
+    ('ATLANTIQUE', ['RENNES', 'LE MANS', 'MASSY TGV', 'MARNE LA VALLEE CHESSY', 'AEROPORT ROISSY CDG 2 TGV',
+                    'LILLE (intramuros)'], 20),
+    ('ATLANTIQUE', ['BORDEAUX ST JEAN', 'ST PIERRE DES CORPS', 'MASSY TGV', 'MARNE LA VALLEE CHESSY',
+                    'AEROPORT ROISSY CDG 2 TGV', 'LILLE (intramuros)'], 16),
+    ('IC NUIT', ['PARIS (intramuros)', 'JUVISY', 'LIMOGES BENEDICTINS', 'CAHORS', 'MONTAUBAN VILLE BOURBON',
+                 'TOULOUSE MATABIAU', 'NARBONNE', 'PERPIGNAN'], 4),
+    ('IC NUIT', ['PARIS (intramuros)', 'MANTES LA JOLIE', 'AVIGNON CENTRE', 'MARSEILLE BLANCARDE', 'TOULON',
+                 'NICE VILLE'], 4),
+]
+
+DAYS = 30
+# Share of sold pairs published as NON anyway (coupure/soudure cases)
+ANOMALY_RATE = 0.03
+# Chance that a service runs on a given day
+RUNS_ON_DAY = 0.92
+
+
+def iata(station):
+    letters = ''.join(character for character in station.upper() if character.isalpha())
+    return 'FR' + letters[:3]
+
+
+def _hhmm(minutes):
+    return f"{(minutes // 60) % 24:02d}:{minutes % 60:02d}"
+
+
+def _leg_minutes(rng, stations):
+    """Running time of each leg of a corridor, fixed for every service on it."""
+    return [rng.randint(15, 50) for _ in stations[1:]]
+
+
+def services(scale=1, seed=0):
+    """
+    The timetable of every service: (train_no, axe, stops, first departure),
+    stops being (station, arrival, departure) in minutes from the first departure.
+    """
+    rng = random.Random(seed)
+    train_no = 6000
+    timetable = []
+    for axe, stations, per_day in CORRIDORS:
+        legs = _leg_minutes(rng, stations)
+        for n in range(per_day * scale):
+            train_no += 1
+            # Half the services run the other way, with the same running times
+            route, route_legs = (stations, legs) if n % 2 == 0 else (stations[::-1], legs[::-1])
+            # Some services only cover part of the corridor
+            first, last = 0, len(route) - 1
+            if len(route) > 3 and rng.random() < 0.3:
+                if rng.random() < 0.5:
+                    first = rng.randint(0, len(route) - 3)
+                else:
+                    last = rng.randint(2, len(route) - 1)
+            if axe == 'IC NUIT':
+                start = rng.randint(20 * 60, 23 * 60)
+            else:
+                # Day services are due at their terminus before midnight
+                running = sum(route_legs[first:last]) + 3 * (last - first)
+                start = rng.randint(5 * 60 + 30, max(5 * 60 + 30, 23 * 60 + 30 - running))
+            stops = []
+            clock = start
+            for index in range(first, last + 1):
+                if index > first:
+                    clock += route_legs[index - 1]
+                terminal = index in (first, last)
+                # Each service skips a different subset of the intermediate stations
+                if terminal or rng.random() < 0.55:
+                    dwell = 0 if terminal else rng.randint(2, 4)
+                    stops.append((route[index], clock, clock + dwell))
+                    clock += dwell
+            timetable.append((train_no, axe, [(station, arrival - start, departure - start)
+                                              for station, arrival, departure in stops], start))
+    return timetable
+
+
+def iter_rows(scale=1, days=DAYS, start=None, seed=0):
+    """Export rows (lists of strings, in COLUMNS order) day by day."""
+    start = start or date.today()
+    timetable = services(scale, seed)
+    rng = random.Random(seed + 1)
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        day_text = day.isoformat()
+        # Two busy days a week with fewer TGVmax seats, whatever the start weekday
+        open_rate = 0.75 if offset % 7 in (4, 6) else 0.9
+        for train_no, axe, stops, departure in timetable:
+            if rng.random() > RUNS_ON_DAY:
+                continue
+            entity = 'INTERCITES' if axe == 'IC NUIT' else 'TGV INOUI'
+            leg_open = [rng.random() < open_rate for _ in stops[1:]]
+            for i, (origin, _, leaves) in enumerate(stops):
+                sold = True
+                for j in range(i + 1, len(stops)):
+                    destination, arrives, _ = stops[j]
+                    sold = sold and leg_open[j - 1]
+                    dispo = 'OUI' if sold and rng.random() >= ANOMALY_RATE else 'NON'
+                    yield [day_text, str(train_no), entity, axe, iata(origin), iata(destination),
+                           origin, destination, _hhmm(departure + leaves), _hhmm(departure + arrives), dispo]
+
+
+def generate(path, scale=1, days=DAYS, start=None, seed=0):
+    """Write the export to `path`; returns its row count, size and SHA-256."""
+    digest = hashlib.sha256()
+    rows = 0
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle, delimiter=';', lineterminator='\n')
+        writer.writerow(COLUMNS)
+        for row in iter_rows(scale, days, start, seed):
+            writer.writerow(row)
+            rows += 1
+    os.replace(temporary, path)
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return {'path': path, 'rows': rows, 'bytes': os.path.getsize(path), 'sha256': digest.hexdigest()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic TGVMAX export")
+    parser.add_argument('output', help="CSV file to write")
+    parser.add_argument('--scale', type=int, default=1, help="Multiple of the SNCF export size")
+    parser.add_argument('--days', type=int, default=DAYS)
+    parser.add_argument('--start', type=date.fromisoformat, default=None, help="First day (default: today)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    result = generate(args.output, args.scale, args.days, args.start, args.seed)
+    print(f"✅ {result['rows']:,} rows, {result['bytes'] / 1e6:.1f} MB written to {result['path']} "
+          f"(sha256 {result['sha256'][:16]})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
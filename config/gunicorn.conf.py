@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the production server.
+
+    gunicorn -c config/gunicorn.conf.py main:app
+
+The application is imported once in the master and forked into the
+workers, which share one copy of the timetable through shared memory
+(src/shared_timetable.py) and pick up new snapshots without a restart.
+"""
+
+import os
+
+# Read by src.timetable, inherited by every worker
+os.environ.setdefault('TGVMAX_SHARED_TIMETABLE', '1')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5163')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Threads keep streamed connection searches from blocking a whole worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = 120
+preload_app = True
+
+
+def post_fork(server, worker):
+    # SQLite connections opened by the master must not be shared across processes
+    from src import cache, utils
+    utils.engine.dispose(close=False)
+    utils.read_engine.dispose(close=False)
+    cache.result_cache.dispose_after_fork()
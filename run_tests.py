@@ -53,7 +53,11 @@ def main():
         "tests/test_connection.py",
         "tests/test_trip_connection.py",
         "tests/test_trip.py",
-        "tests/test_day_trips.py"
+        "tests/test_day_trips.py",
+        "tests/test_dataset_version.py",
+        "tests/test_day_trip_equivalence.py",
+        "tests/test_router.py",
+        "tests/test_fare_rules_equivalence.py"
     ]
     
     # Track results
@@ -7,7 +7,7 @@ engine = create_engine('sqlite:///tgvmax.db')
 with engine.connect() as conn:
     result = conn.execute(text("""
         SELECT COUNT(*) 
-        FROM TGVMAX 
+        FROM TGVMAX_TEXT
         WHERE date = '2025-07-12' 
         AND origine = 'PARIS (intramuros)' 
         AND destination = 'LYON (intramuros)' 
@@ -20,7 +20,7 @@ with engine.connect() as conn:
 with engine.connect() as conn:
     result = conn.execute(text("""
         SELECT COUNT(*) 
-        FROM TGVMAX 
+        FROM TGVMAX_TEXT
         WHERE date = '2025-07-12' 
         AND destination = 'LYON (intramuros)' 
         AND DISPO = 'OUI'
@@ -32,7 +32,7 @@ with engine.connect() as conn:
 with engine.connect() as conn:
     result = conn.execute(text("""
         SELECT COUNT(*) 
-        FROM TGVMAX 
+        FROM TGVMAX_TEXT
         WHERE date = '2025-07-12' 
         AND origine = 'PARIS (intramuros)' 
         AND DISPO = 'OUI'
@@ -44,7 +44,7 @@ with engine.connect() as conn:
 with engine.connect() as conn:
     result = conn.execute(text("""
         SELECT origine, destination, heure_depart, heure_arrivee, DISPO
-        FROM TGVMAX 
+        FROM TGVMAX_TEXT
         WHERE date = '2025-07-12' 
         AND origine = 'PARIS (intramuros)' 
         AND DISPO = 'OUI'
@@ -23,7 +23,7 @@ def check_data():
     # Check total data for these dates
     query = """
     SELECT date, COUNT(*) as total_trips
-    FROM TGVMAX 
+    FROM TGVMAX_TEXT
     WHERE date IN ('2025-08-07', '2025-08-08', '2025-08-09')
     GROUP BY date
     ORDER BY date
@@ -37,7 +37,7 @@ def check_data():
     origin_placeholders = ', '.join([f"'{origin}'" for origin in expanded_origins])
     query = f"""
     SELECT date, origine, COUNT(*) as trips_from_origin
-    FROM TGVMAX 
+    FROM TGVMAX_TEXT
     WHERE date IN ('2025-08-07', '2025-08-08', '2025-08-09')
     AND origine IN ({origin_placeholders})
     AND DISPO = 'OUI'
@@ -52,7 +52,7 @@ def check_data():
     # Check data for destination
     query = """
     SELECT date, destination, COUNT(*) as trips_to_destination
-    FROM TGVMAX 
+    FROM TGVMAX_TEXT
     WHERE date IN ('2025-08-07', '2025-08-08', '2025-08-09')
     AND destination = 'ORANGE'
     AND DISPO = 'OUI'
@@ -67,7 +67,7 @@ def check_data():
     # Check direct connections from Île-de-France to ORANGE
     query = f"""
     SELECT date, origine, destination, heure_depart, heure_arrivee, DISPO
-    FROM TGVMAX 
+    FROM TGVMAX_TEXT
     WHERE date IN ('2025-08-07', '2025-08-08', '2025-08-09')
     AND origine IN ({origin_placeholders})
     AND destination = 'ORANGE'
@@ -86,7 +86,7 @@ def check_data():
     # Check what destinations are available from Île-de-France
     query = f"""
     SELECT DISTINCT destination, COUNT(*) as trip_count
-    FROM TGVMAX 
+    FROM TGVMAX_TEXT
     WHERE date IN ('2025-08-07', '2025-08-08', '2025-08-09')
     AND origine IN ({origin_placeholders})
     AND DISPO = 'OUI'
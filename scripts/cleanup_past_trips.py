@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Script to clean up past trips from the TGVMAX database.
-This script is designed to be run by cron every 3 minutes.
+This script is designed to be run by cron every 30 minutes.
 """
 
 import sys
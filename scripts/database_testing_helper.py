@@ -13,9 +13,9 @@ import argparse
 from datetime import datetime
 from sqlalchemy import create_engine, text
 
-# Add src to path for imports
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
-from utils import update_db
+# Add the project root to the path so the src package can be imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.utils import update_db
 
 # Database paths
 ORIGINAL_DB = 'data/tgvmax.db'
@@ -14,8 +14,8 @@ echo "🚄 Déploiement du Planificateur TGV Max..."
 echo "📁 Création des répertoires..."
 mkdir -p data logs
 
-# Create empty database file if it doesn't exist
-if [ ! -f "data/tgvmax.db" ]; then
+# Create empty database file if it doesn't exist (tgvmax.db may be a symlink to a snapshot)
+if [ ! -e "data/tgvmax.db" ]; then
     touch data/tgvmax.db
     echo "📄 Fichier de base de données créé"
 fi
@@ -33,7 +33,7 @@ if [ $? -eq 0 ]; then
     sleep 5
     
     # Initialize database if empty
-    DB_SIZE=$(stat -f%z "data/tgvmax.db" 2>/dev/null || stat -c%s "data/tgvmax.db" 2>/dev/null || echo "0")
+    DB_SIZE=$(stat -L -f%z "data/tgvmax.db" 2>/dev/null || stat -L -c%s "data/tgvmax.db" 2>/dev/null || echo "0")
     if [ "$DB_SIZE" -lt 1000 ]; then
         echo "📥 Initialisation de la base de données..."
         docker exec tgvmax-planner python -c "from src.utils import update_db, engine; update_db(engine)"
@@ -13,6 +13,7 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.utils import optimize_database_complete, engine
+from src import snapshots
 from src.logging_config import setup_logging
 
 setup_logging(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs', 'tgvmax_optimization.log'))
@@ -37,6 +38,10 @@ def main():
         
         # Run the optimization
         result = optimize_database_complete(engine)
+
+        # The live dataset changed in place: give it a new version
+        with engine.begin() as conn:
+            snapshots.bump_revision(conn)
         
         # Log final summary
         logger.info("=" * 60)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Summarise the slow-query log written by src/profiler.py.
+
+Queries are grouped by shape and ranked by the total time they took, with
+their EXPLAIN QUERY PLAN and an example of their parameters, so the
+costliest query patterns and their full scans stand out.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+DEFAULT_LOG = os.path.join(str(project_root), 'logs', 'tgvmax_slow_queries.log')
+
+
+def read_entries(paths):
+    """Slow-query records from `paths` (rotated files included), skipping unreadable lines."""
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+
+def summarise(entries):
+    """Per-shape statistics, costliest shape first."""
+    shapes = {}
+    for entry in entries:
+        shapes.setdefault(entry['shape'], []).append(entry)
+    summary = []
+    for shape, group in shapes.items():
+        durations = [entry['duration_ms'] for entry in group]
+        rows = [entry['rows'] for entry in group if entry.get('rows') is not None]
+        slowest = max(group, key=lambda entry: entry['duration_ms'])
+        summary.append({
+            'shape': shape,
+            'count': len(group),
+            'total_ms': sum(durations),
+            'median_ms': statistics.median(durations),
+            'max_ms': max(durations),
+            'avg_rows': sum(rows) / len(rows) if rows else None,
+            'full_scan': any(entry.get('full_scan') for entry in group),
+            'sources': sorted({entry.get('source') or '?' for entry in group}),
+            'query': slowest['query'],
+            'plan': next((entry['plan'] for entry in group if entry.get('plan')), None),
+            'params': slowest.get('params'),
+        })
+    summary.sort(key=lambda item: item['total_ms'], reverse=True)
+    return summary
+
+
+def print_report(summary, top):
+    total = sum(item['total_ms'] for item in summary)
+    print(f"{sum(item['count'] for item in summary):,} slow queries, {len(summary)} shapes, "
+          f"{total / 1000:.2f}s in total")
+    for rank, item in enumerate(summary[:top], 1):
+        avg_rows = '-' if item['avg_rows'] is None else f"{item['avg_rows']:,.0f}"
+        print()
+        print(f"#{rank} shape {item['shape']}{'  [FULL SCAN]' if item['full_scan'] else ''}")
+        print(f"   {item['count']:,} × | total {item['total_ms']:,.1f} ms ({item['total_ms'] / total:.0%}) | "
+              f"median {item['median_ms']:,.1f} ms | max {item['max_ms']:,.1f} ms | "
+              f"avg rows {avg_rows} | via {', '.join(item['sources'])}")
+        print(f"   {item['query']}")
+        for line in item['plan'] or ['(no plan)']:
+            print(f"     {line}")
+        if item['params']:
+            print(f"   params of the slowest: {json.dumps(item['params'], ensure_ascii=False)[:300]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rapport des requêtes SQL lentes")
+    parser.add_argument('logs', nargs='*', default=[DEFAULT_LOG],
+                        help="Slow-query log files (default: logs/tgvmax_slow_queries.log)")
+    parser.add_argument('--top', type=int, default=10, help="Number of shapes to show")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    missing = [path for path in args.logs if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Log file not found: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    summary = summarise(read_entries(args.logs))
+    if args.json:
+        print(json.dumps(summary[:args.top], indent=2, ensure_ascii=False))
+    elif not summary:
+        print("No slow queries logged")
+    else:
+        print_report(summary, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,7 @@ Conçu pour être exécuté par cron toutes les 12 heures.
 import os
 import sys
 import logging
+import argparse
 from datetime import datetime
 # Add the parent directory to the Python path so we can import src modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -20,21 +21,26 @@ logger = logging.getLogger(__name__)
 
 def main():
     """Fonction principale pour mettre à jour la base de données."""
+    parser = argparse.ArgumentParser(description="Mise à jour de la base TGV Max")
+    parser.add_argument('source', nargs='?', help="URL ou fichier CSV local de l'export (par défaut : API SNCF)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="N'applique que les trains modifiés depuis le dernier export")
+    args = parser.parse_args()
+
     try:
         logger.info("Début du processus de mise à jour de la base de données")
         
-        # Vérifier si le fichier de base de données existe et est accessible en écriture
-        db_path = 'tgvmax.db'
-        if not os.path.exists(db_path):
-            logger.error("Fichier de base de données %s introuvable", db_path)
-            return 1
-
-        if not os.access(db_path, os.W_OK):
-            logger.error("Le fichier de base de données %s n'est pas accessible en écriture", db_path)
+        # Vérifier que le répertoire des données est accessible en écriture (les snapshots y sont créés)
+        data_dir = os.path.dirname(os.path.abspath(engine.url.database))
+        if not os.access(data_dir, os.W_OK):
+            logger.error("Le répertoire de données %s n'est pas accessible en écriture", data_dir)
             return 1
         
-        # Mettre à jour la base de données
-        update_db(engine)
+        # Mettre à jour la base de données (source optionnelle : URL ou fichier CSV local)
+        result = update_db(engine, args.source, incremental=args.incremental)
+        if not result.get('success'):
+            logger.error("Échec de la mise à jour : %s", result.get('error'))
+            return 1
 
         logger.info("Mise à jour de la base de données terminée avec succès")
         return 0
@@ -1,8 +1,10 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, make_response, Response, stream_with_context
 from datetime import datetime, timedelta
+import json
 import logging
-from src import utils
+from src import utils, schema, snapshots, cache, logging_config, metrics
 import os
+import random
 import time
 from src.logging_config import setup_logging
 
@@ -16,6 +18,14 @@ app.config['PREFERRED_URL_SCHEME'] = 'https'
 # Trust the proxy headers (nginx is on localhost, so we can trust it)
 app.config['PROXY_FIX'] = 1
 
+# Databases written before the typed schema are converted once, at startup
+try:
+    schema.migrate_legacy_schema(utils.engine)
+except Exception as e:
+    logger.error("❌ Legacy schema migration failed: %s", e)
+
+metrics.register_collector(metrics.dataset_collector(utils.read_engine))
+
 def get_client_ip():
     """Get the real client IP address, handling proxy headers"""
     # Check for X-Forwarded-For header first
@@ -36,39 +46,60 @@ def get_client_ip():
 @app.before_request
 def before_request():
     request.start_time = time.time()
+    # Reopen connections if an update switched the live snapshot, then pin its version
+    snapshots.refresh_engine(utils.engine)
+    snapshots.refresh_engine(utils.read_engine)
+    request.dataset_version = snapshots.dataset_version(utils.read_engine)
 
 @app.after_request
 def after_request(response):
+    if hasattr(request, 'dataset_version'):
+        response.headers['X-Dataset-Version'] = request.dataset_version
     if hasattr(request, 'start_time'):
         duration = time.time() - request.start_time
-        request_logger = logging.getLogger('request_timing')
-        # Get query string
-        query_string = request.query_string.decode('utf-8') if request.query_string else ''
-        # Get JSON body if present
-        try:
-            json_body = request.get_json(silent=True)
-        except Exception:
-            json_body = None
+        metrics.observe_request(request.url_rule.rule if request.url_rule else 'unmatched', request.method,
+                                response.status_code, duration,
+                                None if response.is_streamed else response.content_length)
+        log_request(response, duration)
+    return response
+
+def _payload_excerpt(data):
+    """At most PAYLOAD_LOG_MAX_BYTES of a request or response body, as text."""
+    excerpt = data[:logging_config.PAYLOAD_LOG_MAX_BYTES].decode('utf-8', errors='replace')
+    if len(data) > logging_config.PAYLOAD_LOG_MAX_BYTES:
+        excerpt += f"... ({len(data)} bytes)"
+    return excerpt
+
+def log_request(response, duration):
+    """
+    Queue a compact record of the request for the request log.
+
+    Requests are sampled (REQUEST_LOG_SAMPLE, errors always kept) and only a
+    PAYLOAD_LOG_SAMPLE share of them carry headers and capped bodies; the
+    response is never re-parsed and streamed responses are never read.
+    """
+    is_error = response.status_code >= 400
+    if not is_error and random.random() >= logging_config.REQUEST_LOG_SAMPLE:
+        return
+    request_logger = logging.getLogger('request_timing')
+    payload = ''
+    if is_error or random.random() < logging_config.PAYLOAD_LOG_SAMPLE:
         # Get headers, excluding sensitive ones
         headers = {k: v for k, v in request.headers.items() if k.lower() not in ['authorization', 'cookie']}
-        # Only log response data if it's JSON
-        response_data = None
-        if response.is_json:
-            response_data = response.get_json(silent=True)
-        request_logger.info(
-            "Request: %s %s - Status: %s - Duration: %.3fs - IP: %s - User-Agent: %s - Query: %s - JSON: %s - Headers: %s%s",
-            request.method,
-            request.path,
-            response.status_code,
-            duration,
-            get_client_ip(),
-            request.headers.get('User-Agent', 'Unknown'),
-            query_string,
-            json_body,
-            headers,
-            f" - Response: {response_data}" if response_data is not None else ""
-        )
-    return response
+        payload = f" - JSON: {_payload_excerpt(request.get_data(cache=True))} - Headers: {headers}"
+        if response.is_json and not response.is_streamed:
+            payload += f" - Response: {_payload_excerpt(response.get_data())}"
+    request_logger.info(
+        "Request: %s %s - Status: %s - Duration: %.3fs - IP: %s - User-Agent: %s - Query: %s%s",
+        request.method,
+        request.path,
+        response.status_code,
+        duration,
+        get_client_ip(),
+        request.headers.get('User-Agent', 'Unknown'),
+        request.query_string.decode('utf-8') if request.query_string else '',
+        payload,
+    )
 
 @app.route('/')
 def index():
@@ -78,6 +109,14 @@ def index():
     
     # Generate dates for the next 30 days
     today = datetime.now()
+
+    # The page only changes with the dataset and the day
+    etag = f"{request.dataset_version}-{today.strftime('%Y-%m-%d')}"
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
     dates = []
     for i in range(30):
         date = today + timedelta(days=i)
@@ -87,14 +126,38 @@ def index():
         })
     
     # Get all destinations from database
-    all_destinations = utils.get_all_towns()
+    all_destinations = utils.get_all_towns(request.dataset_version)
     
     # Get station groups for the template
     station_groups = utils.STATION_GROUPS
     
     processing_time = time.time() - start_time
     logger.info("Index page served in %.3fs", processing_time)
-    return render_template('index.html', dates=dates, destinations=all_destinations, station_groups=station_groups)
+    response = make_response(render_template('index.html', dates=dates, destinations=all_destinations,
+                                             station_groups=station_groups))
+    response.set_etag(etag)
+    return response
+
+def get_page_params(data, sorts, default_sort):
+    """Read the optional 'sort', 'limit' and 'offset' request fields; ValueError when invalid."""
+    sort = data.get('sort') or default_sort
+    if sort not in sorts:
+        raise ValueError(f"Tri inconnu : {sort} (valeurs possibles : {', '.join(sorts)})")
+    limit = data.get('limit')
+    offset = data.get('offset') or 0
+    try:
+        limit = None if limit is None else int(limit)
+        offset = int(offset)
+    except (TypeError, ValueError):
+        raise ValueError("limit et offset doivent être des entiers.")
+    if (limit is not None and limit < 0) or offset < 0:
+        raise ValueError("limit et offset doivent être positifs.")
+    return sort, limit, offset
+
+def page_info(total, limit, offset):
+    """Pagination fields of a response; next_offset is None on the last page."""
+    next_offset = offset + limit if limit is not None and offset + limit < total else None
+    return {'total': total, 'offset': offset, 'limit': limit, 'next_offset': next_offset}
 
 @app.route('/get_destinations', methods=['POST'])
 def get_destinations():
@@ -110,120 +173,32 @@ def get_destinations():
     if not stations:
         stations = ['PARIS (intramuros)']
     
+    # Optional page of the results: sort key, limit and offset
+    try:
+        sort, limit, offset = get_page_params(data, utils.DESTINATION_SORTS, 'time_at_destination')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
     client_ip = get_client_ip()
     logger.info("Processing destinations request from %s for date %s with stations: %s", 
                 client_ip, selected_date, stations)
     
     start_time = time.time()
     try:
-        # Get trips from all selected stations
+        # Get trips from all selected stations in one batched search
+        trips_by_station = utils.find_optimal_destinations_many(stations, selected_date, request.dataset_version)
         all_trips = []
         for station in stations:
-            station_trips = utils.find_optimal_destinations(station, selected_date)
-            all_trips.extend(station_trips)
+            all_trips.extend(trips_by_station[station])
         
-        # Group trips by destination
-        grouped_trips = {}
-        for trip in all_trips:
-            dest = trip['destination']
-            if dest not in grouped_trips:
-                grouped_trips[dest] = {
-                    'destination': dest,
-                    'trips': [],
-                    'outbound_trips': [],
-                    'return_trips': [],
-                    'avg_travel_time': 0,
-                    'max_time_at_destination': 0
-                }
-            
-            grouped_trips[dest]['trips'].append(trip)
-            
-            # Add to outbound trips
-            outbound_key = f"{trip['outbound_departure']}-{trip['outbound_arrival']}"
-            existing_outbound_keys = [f"{t['departure']}-{t['arrival']}" for t in grouped_trips[dest]['outbound_trips']]
-            if outbound_key not in existing_outbound_keys:
-                grouped_trips[dest]['outbound_trips'].append({
-                    'departure': trip['outbound_departure'],
-                    'arrival': trip['outbound_arrival'],
-                    'train_no': trip['outbound_train'],
-                    'axe': trip.get('outbound_axe', 'N/A')
-                })
-            
-            # Add to return trips
-            return_key = f"{trip['return_departure']}-{trip['return_arrival']}"
-            existing_return_keys = [f"{t['departure']}-{t['arrival']}" for t in grouped_trips[dest]['return_trips']]
-            if return_key not in existing_return_keys:
-                grouped_trips[dest]['return_trips'].append({
-                    'departure': trip['return_departure'],
-                    'arrival': trip['return_arrival'],
-                    'train_no': trip['return_train'],
-                    'axe': trip.get('return_axe', 'N/A')
-                })
-        
-        # Calculate averages and max for each destination
-        for dest_data in grouped_trips.values():
-            travel_times = []
-            times_at_dest = []
-            axes = []
-            
-            for trip in dest_data['trips']:
-                # Parse travel time (e.g., "2h49m" -> minutes)
-                travel_time_str = trip['total_travel_time']
-                travel_minutes = parse_time_to_minutes(travel_time_str)
-                travel_times.append(travel_minutes)
-                
-                # Parse time at destination
-                dest_time_str = trip['time_at_destination']
-                dest_minutes = parse_time_to_minutes(dest_time_str)
-                times_at_dest.append(dest_minutes)
-                
-                # Collect axes
-                if 'outbound_axe' in trip:
-                    axes.append(trip['outbound_axe'])
-                if 'return_axe' in trip:
-                    axes.append(trip['return_axe'])
-            
-            # Calculate average travel time and max time at destination
-            avg_travel_minutes = round(sum(travel_times) / len(travel_times))
-            max_dest_minutes = max(times_at_dest)
-            
-            dest_data['avg_travel_time'] = format_minutes_to_time(avg_travel_minutes)
-            dest_data['max_time_at_destination'] = format_minutes_to_time(max_dest_minutes)
-            
-            # Sort outbound and return trips by departure time
-            dest_data['outbound_trips'].sort(key=lambda x: x['departure'])
-            dest_data['return_trips'].sort(key=lambda x: x['departure'])
-            
-            # Find the most frequent axis, with special handling for INTERNATIONAL
-            from collections import Counter
-            if axes:
-                axe_counts = Counter(axes)
-                
-                # Check if ALL axes are INTERNATIONAL
-                if len(axe_counts) == 1 and 'INTERNATIONAL' in axe_counts:
-                    most_common_axe = 'INTERNATIONAL'
-                else:
-                    # Filter out INTERNATIONAL and find the most common non-international axis
-                    non_international_axes = {axe: count for axe, count in axe_counts.items() if axe != 'INTERNATIONAL'}
-                    if non_international_axes:
-                        most_common_axe = max(non_international_axes.items(), key=lambda x: x[1])[0]
-                    else:
-                        most_common_axe = None
-            else:
-                most_common_axe = None
-            dest_data['main_axe'] = most_common_axe
-        
-        # Sort by max time at destination (descending)
-        sorted_destinations = sorted(
-            grouped_trips.values(), 
-            key=lambda x: parse_time_to_minutes(x['max_time_at_destination']), 
-            reverse=True
-        )
+        # Group trips by destination, keeping only the requested page
+        sorted_destinations, total = utils.aggregate_destinations(all_trips, sort=sort, limit=limit, offset=offset)
+        metrics.SEARCH_RESULTS.observe(total, 'destinations')
         
         processing_time = time.time() - start_time
-        logger.info("Found %d destinations in %.3fs", len(sorted_destinations), processing_time)
+        logger.info("Found %d destinations in %.3fs", total, processing_time)
         logger.debug("Destinations result: %s", sorted_destinations)
-        return jsonify({'success': True, 'destinations': sorted_destinations})
+        return jsonify({'success': True, 'destinations': sorted_destinations, **page_info(total, limit, offset)})
     except Exception as e:
         processing_time = time.time() - start_time
         logger.exception("Error in get_destinations after %.3fs", processing_time)
@@ -240,6 +215,16 @@ def get_trip_connections_endpoint():
     # Validate input
     if not (start_date and end_date and origin and destination):
         return jsonify({'success': False, 'error': 'Paramètres requis manquants.'}), 400
+    try:
+        sort, limit, offset = get_page_params(data, utils.CONNECTION_SORTS, 'departure')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    # Opt-in streaming: one record per date as soon as it is solved
+    stream_format = get_stream_format(data)
+    if stream_format not in (None, 'ndjson', 'sse'):
+        return jsonify({'success': False, 'error': f"Format de streaming inconnu : {stream_format}"}), 400
+    if stream_format and (limit is not None or offset):
+        return jsonify({'success': False, 'error': 'limit et offset ne sont pas disponibles en streaming.'}), 400
 
     # Ensure origin and destination are always flat lists of strings
     if isinstance(origin, str):
@@ -271,45 +256,90 @@ def get_trip_connections_endpoint():
         dates = [(d1 + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(num_days)]
         # Allow station group connections by default
         allow_station_groups = data.get('allow_station_groups', True)
-        results = utils.get_trip_connections(dates, origins, destinations, allow_station_groups=allow_station_groups)
+        # Optional 'HH:MM' deadline: return the latest departure arriving by then
+        arrive_by = data.get('arrive_by')
+        # Optional 'HH:MM' departure window applied to every date
+        depart_after = data.get('depart_after')
+        depart_before = data.get('depart_before')
+        if stream_format:
+            key, reverse = utils.CONNECTION_SORTS[sort]
+            search = utils.iter_trip_connections(dates, origins, destinations,
+                                                 allow_station_groups=allow_station_groups, arrive_by=arrive_by,
+                                                 depart_after=depart_after, depart_before=depart_before,
+                                                 sort_key=key, reverse=reverse, version=request.dataset_version)
+            return stream_connections(search, stream_format, start_time)
+        results = utils.get_trip_connections(dates, origins, destinations, allow_station_groups=allow_station_groups,
+                                             arrive_by=arrive_by, depart_after=depart_after,
+                                             depart_before=depart_before, version=request.dataset_version)
+        key, reverse = utils.CONNECTION_SORTS[sort]
+        results, total = utils.paginate(results, key, limit=limit, offset=offset, reverse=reverse)
+        metrics.SEARCH_RESULTS.observe(total, 'connections')
         processing_time = time.time() - start_time
-        logger.info("Found %d connections in %.3fs", len(results), processing_time)
+        logger.info("Found %d connections in %.3fs", total, processing_time)
         logger.debug("Connections result: %s", results)
-        return jsonify({'success': True, 'connections': results})
+        return jsonify({'success': True, 'connections': results, **page_info(total, limit, offset)})
     except Exception as e:
         processing_time = time.time() - start_time
         logger.exception("Error in get_trip_connections_endpoint after %.3fs", processing_time)
         return jsonify({'success': False, 'error': str(e)})
 
-def parse_time_to_minutes(time_str):
-    """Convert time string like '2h49m' to minutes"""
-    import re
-    hours = 0
-    minutes = 0
-    
-    # Extract hours
-    hour_match = re.search(r'(\d+)h', time_str)
-    if hour_match:
-        hours = int(hour_match.group(1))
-    
-    # Extract minutes
-    minute_match = re.search(r'(\d+)m', time_str)
-    if minute_match:
-        minutes = int(minute_match.group(1))
-    
-    return hours * 60 + minutes
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
 
-def format_minutes_to_time(minutes):
-    """Convert minutes to time string like '2h49m'"""
-    hours = minutes // 60
-    mins = minutes % 60
-    
-    if hours == 0:
-        return f"{mins}m"
-    elif mins == 0:
-        return f"{hours}h"
-    else:
-        return f"{hours}h{mins}m"
+def get_stream_format(data):
+    """'ndjson' or 'sse' when the client asked for a streamed response, else None."""
+    stream_format = data.get('stream')
+    if stream_format:
+        return stream_format
+    accept = request.headers.get('Accept', '')
+    for name, mimetype in STREAM_MIMETYPES.items():
+        if mimetype in accept:
+            return name
+    return None
+
+def stream_connections(search, stream_format, start_time):
+    """
+    Stream the (date, results) pairs of `search` as NDJSON lines or server-sent events.
+
+    Each date yields {'date', 'connections'}; a final {'done': true, 'total',
+    'dates'} record closes the stream, or {'success': false, 'error'} if the
+    search fails part way.
+    """
+    def encode(event, record):
+        payload = json.dumps(record, ensure_ascii=False)
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    def generate():
+        total = dates = 0
+        try:
+            for date, results in search:
+                total += len(results)
+                dates += 1
+                yield encode('date', {'date': date, 'connections': results})
+        except Exception as e:
+            logger.exception("Error while streaming connections after %.3fs", time.time() - start_time)
+            yield encode('error', {'success': False, 'error': str(e)})
+            return
+        logger.info("Streamed %d connections over %d dates in %.3fs", total, dates, time.time() - start_time)
+        metrics.SEARCH_RESULTS.observe(total, 'connections')
+        yield encode('summary', {'success': True, 'done': True, 'total': total, 'dates': dates})
+
+    response = Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[stream_format])
+    # Let proxies pass records through as they are produced
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Result cache counters (hits per tier, misses, evictions) for tuning its sizes."""
+    return jsonify({'success': True, 'cache': cache.result_cache.stats()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request latencies, SQL timings, result sizes, cache and dataset metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     # Use environment variables for production settings
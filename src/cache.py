@@ -0,0 +1,308 @@
+"""
+Versioned two-tier cache for search results.
+
+Results are keyed on the dataset version, a namespace (the search) and its
+normalised parameters, so an update or an in-place revision of the dataset
+makes every older entry unreachable; they are dropped once a newer version
+is seen. Range searches are stored as one entry
+per day, letting overlapping ranges reuse the days already computed.
+
+- memory tier: a bounded LRU per process;
+- disk tier: a small SQLite file shared by every worker on the host.
+
+Values are stored as JSON in both tiers, so a hit always returns a fresh
+copy the caller may modify.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+MEMORY_ENTRIES = int(os.environ.get('TGVMAX_CACHE_MEMORY_ENTRIES', '1024'))
+DISK_ENTRIES = int(os.environ.get('TGVMAX_CACHE_DISK_ENTRIES', '50000'))
+# An empty path disables the disk tier
+DISK_PATH = os.environ.get('TGVMAX_CACHE_PATH', 'data/result_cache.db')
+# Disk eviction runs every DISK_TRIM_EVERY stores rather than on each one
+DISK_TRIM_EVERY = 200
+# A disk hit only rewrites last_used when it is older than this: eviction is
+# approximate LRU, and reads stay read-only transactions
+DISK_TOUCH_SECONDS = 300
+# Part of every key: bump when the shape of cached results changes
+FORMAT_VERSION = 4
+
+CACHE_DDL = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    value TEXT NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+CACHE_INDEX_DDL = "CREATE INDEX IF NOT EXISTS idx_result_cache_last_used ON result_cache (last_used)"
+
+
+def _json_default(value):
+    # NumPy scalars coming from the timetable
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def make_key(namespace, version, params):
+    """Stable key for `params` (any JSON-serializable structure)."""
+    payload = json.dumps([FORMAT_VERSION, namespace, version, params], sort_keys=True, separators=(',', ':'),
+                         default=_json_default)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def version_order(version):
+    """Sort key of a "snapshot.revision" dataset version; unparsable versions sort first."""
+    try:
+        return tuple(int(part) for part in str(version).split('.'))
+    except ValueError:
+        return ()
+
+
+class ResultCache:
+    """LRU memory tier in front of a shared SQLite tier, both keyed by dataset version."""
+
+    def __init__(self, memory_entries=MEMORY_ENTRIES, disk_path=DISK_PATH, disk_entries=DISK_ENTRIES):
+        self.memory_entries = memory_entries
+        self.disk_path = disk_path
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._engine = None
+        self._disk_ready = False
+        self._version = None
+        self._stores_since_trim = 0
+        self._counters = dict.fromkeys(
+            ('memory_hits', 'disk_hits', 'misses', 'stores', 'memory_evictions', 'disk_evictions',
+             'invalidations', 'disk_errors'), 0)
+
+    # -- disk tier -----------------------------------------------------------
+
+    def _disk(self):
+        """The disk tier engine, created on first use; None when disabled or broken."""
+        if not self.disk_path:
+            return None
+        if not self._disk_ready:
+            try:
+                directory = os.path.dirname(os.path.abspath(self.disk_path))
+                os.makedirs(directory, exist_ok=True)
+                self._engine = create_engine(f'sqlite:///{self.disk_path}',
+                                             connect_args={'timeout': 5, 'check_same_thread': False})
+                with self._engine.begin() as conn:
+                    conn.execute(text("PRAGMA journal_mode=WAL"))
+                    conn.execute(text(CACHE_DDL))
+                    conn.execute(text(CACHE_INDEX_DDL))
+            except Exception as e:
+                logger.warning("⚠️ Result cache disk tier disabled: %s", e)
+                self.disk_path = None
+                self._engine = None
+                return None
+            self._disk_ready = True
+        return self._engine
+
+    def _disk_call(self, action):
+        engine = self._disk()
+        if engine is None:
+            return None
+        try:
+            with engine.begin() as conn:
+                return action(conn)
+        except Exception as e:
+            # The disk tier is best effort: a locked or corrupt file must not fail a search
+            self._count('disk_errors')
+            logger.warning("⚠️ Result cache disk tier error: %s", e)
+            return None
+
+    def dispose_after_fork(self):
+        """Drop the disk tier connections inherited from the parent process, without closing them."""
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+
+    # -- bookkeeping ---------------------------------------------------------
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] += n
+
+    def _observe_version(self, version):
+        """
+        Drop entries of older versions the first time a newer `version` is seen.
+
+        Requests pin the version they started with, so an older version may
+        still show up for a while after a newer one: it only uses the cache
+        and never invalidates the newer entries.
+        """
+        if version == self._version:
+            return
+        with self._lock:
+            if self._version is not None and version_order(version) <= version_order(self._version):
+                return
+            previous, self._version = self._version, version
+            dropped = len(self._memory)
+            self._memory.clear()
+            self._counters['invalidations'] += dropped
+        if previous is not None:
+            logger.info("♻️ Dataset v%s replaces v%s, result cache invalidated", version, previous)
+        self.retain_version(version)
+
+    def retain_version(self, version):
+        """Delete disk entries that belong to a dataset version older than `version`."""
+        def delete_older(conn):
+            versions = conn.execute(text("SELECT DISTINCT version FROM result_cache")).scalars().all()
+            older = [other for other in versions if version_order(other) < version_order(version)]
+            if not older:
+                return 0
+            placeholders = ', '.join(f':v{i}' for i in range(len(older)))
+            return conn.execute(text(f"DELETE FROM result_cache WHERE version IN ({placeholders})"),
+                                {f'v{i}': other for i, other in enumerate(older)}).rowcount
+
+        removed = self._disk_call(delete_older)
+        if removed:
+            self._count('invalidations', removed)
+        return removed or 0
+
+    def _remember(self, key, payload):
+        with self._lock:
+            self._memory[key] = payload
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+                self._counters['memory_evictions'] += 1
+
+    def _trim_disk(self, conn):
+        excess = conn.execute(text("SELECT COUNT(*) FROM result_cache")).scalar() - self.disk_entries
+        if excess <= 0:
+            return 0
+        return conn.execute(text("""
+            DELETE FROM result_cache WHERE key IN (
+                SELECT key FROM result_cache ORDER BY last_used LIMIT :excess)
+        """), {"excess": excess}).rowcount
+
+    # -- public API ----------------------------------------------------------
+
+    def get(self, namespace, version, params):
+        """The cached value for `params`, or None."""
+        self._observe_version(version)
+        key = make_key(namespace, version, params)
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+        if payload is not None:
+            return json.loads(payload)
+
+        def read(conn):
+            row = conn.execute(text("SELECT value, last_used FROM result_cache WHERE key = :key"),
+                               {"key": key}).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row[1] < now - DISK_TOUCH_SECONDS:
+                conn.execute(text("UPDATE result_cache SET last_used = :now WHERE key = :key"),
+                             {"now": now, "key": key})
+            return row[0]
+
+        payload = self._disk_call(read)
+        if payload is None:
+            self._count('misses')
+            return None
+        self._count('disk_hits')
+        self._remember(key, payload)
+        return json.loads(payload)
+
+    def put(self, namespace, version, params, value):
+        """Store `value` for `params` in both tiers."""
+        self._observe_version(version)
+        key = make_key(namespace, version, params)
+        payload = json.dumps(value, separators=(',', ':'), default=_json_default)
+        self._remember(key, payload)
+        self._count('stores')
+
+        with self._lock:
+            self._stores_since_trim += 1
+            trim = self._stores_since_trim >= DISK_TRIM_EVERY
+            if trim:
+                self._stores_since_trim = 0
+
+        def write(conn):
+            conn.execute(text("""
+                INSERT OR REPLACE INTO result_cache (key, version, namespace, value, last_used)
+                VALUES (:key, :version, :namespace, :value, :now)
+            """), {"key": key, "version": version, "namespace": namespace, "value": payload, "now": time.time()})
+            return self._trim_disk(conn) if trim else 0
+
+        evicted = self._disk_call(write)
+        if evicted:
+            self._count('disk_evictions', evicted)
+
+    def cached(self, namespace, version, params, compute):
+        """Return the cached value for `params`, computing and storing it on a miss."""
+        value = self.get(namespace, version, params)
+        if value is None:
+            value = compute()
+            self.put(namespace, version, params, value)
+        return value
+
+    def cached_many(self, namespace, version, params, field, values, compute):
+        """
+        Cached values for each of `values`, in order.
+
+        Each value is cached separately under `params` with `field` set to
+        it; `compute` is called once with the list of missing values and
+        must return a dict mapping each of them to its result.
+        """
+        results = {}
+        missing = []
+        for value in dict.fromkeys(values):
+            result = self.get(namespace, version, {**params, field: value})
+            if result is None:
+                missing.append(value)
+            else:
+                results[value] = result
+        if missing:
+            computed = compute(missing)
+            for value in missing:
+                results[value] = computed.get(value, [])
+                self.put(namespace, version, {**params, field: value}, results[value])
+        return [results[value] for value in values]
+
+    def cached_per_day(self, namespace, version, params, days, compute):
+        """Per-day values for `days`, in order (cached_many over a 'day' field)."""
+        return self.cached_many(namespace, version, params, 'day', days, compute)
+
+    def clear(self):
+        """Empty both tiers."""
+        with self._lock:
+            self._memory.clear()
+        self._disk_call(lambda conn: conn.execute(text("DELETE FROM result_cache")))
+
+    def stats(self):
+        """Counters, tier sizes and hit rate."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_capacity'] = self.memory_entries
+            stats['version'] = self._version
+        stats['disk_entries'] = self._disk_call(
+            lambda conn: conn.execute(text("SELECT COUNT(*) FROM result_cache")).scalar())
+        stats['disk_capacity'] = self.disk_entries if self.disk_path else 0
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else None
+        return stats
+
+
+result_cache = ResultCache()
@@ -0,0 +1,214 @@
+"""
+Day trips materialized at update time.
+
+The day-trip answer for an (origin, date) depends only on the dataset, so
+update_db evaluates it for every station and every day once, in a pool of
+worker processes partitioned by day. The pairs themselves, every outbound
+train times every return train of an (origin, destination), grow with the
+square of the trains, so the `day_trip_legs` table of the snapshot only stores the
+legs that take part in a pair, and a request for a single date pairs them
+in one keyed join. Dates outside the materialized window (and databases
+built before this table existed) fall back to the timetable search.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from src import db, schema, snapshots, timetable
+
+logger = logging.getLogger(__name__)
+
+# Worker processes used by materialize(); 1 computes in the calling process
+WORKERS = int(os.environ.get('TGVMAX_DAY_TRIPS_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Same pairs and order as Timetable.day_trip_pairs_many: largest hour gap first,
+# then outbound legs in departure order and their returns in arrival order
+LOOKUP_QUERY = """
+    SELECT o.name, d.name, a.dep_min, a.arr_min, r.dep_min, r.arr_min,
+           a.train_no, r.train_no, a.axe, r.axe
+    FROM day_trip_legs a
+    JOIN day_trip_legs r ON r.day = a.day AND r.origin_id = a.origin_id AND r.dest_id = a.dest_id
+                        AND r.leg = 1 AND r.dep_min > a.arr_min
+    JOIN stations o ON o.id = a.origin_id
+    JOIN stations d ON d.id = a.dest_id
+    WHERE o.name IN ({station_placeholders})
+      AND a.day = :day AND a.leg = 0
+    ORDER BY a.origin_id, r.dep_min / 60 - a.arr_min / 60 DESC, a.seq, r.seq
+"""
+
+_worker_timetable = None
+
+
+def _init_worker(database):
+    global _worker_timetable
+    _worker_timetable = timetable.Timetable.from_engine(db.create_engine(database, read_only=True))
+
+
+def _group_seq(group):
+    """Position of each row within its run of equal `group` values."""
+    if len(group) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    return np.arange(len(group)) - np.repeat(starts, np.diff(np.r_[starts, len(group)]))
+
+
+def day_trip_legs_frame(tt, days):
+    """
+    The legs of every same-day round trip of `tt` on `days`, for every origin station.
+
+    An outbound leg is kept when a return train leaves its destination for
+    its origin after it arrives, and a return leg when some outbound leg
+    arrives before it leaves, so pairing the kept legs gives exactly the
+    Timetable.day_trip_pairs_many pairs, without building them here.
+    Outbound legs arriving after midnight are left out: the day-trip search
+    always discards them.
+    """
+    n_stations = len(tt.stations)
+    frames = []
+    for day in days:
+        outbound = np.flatnonzero(tt.day == day)
+        outbound = outbound[(tt.dep[outbound] >= timetable.EARLIEST_OUTBOUND_DEPARTURE)
+                            & (tt.arr[outbound] >= tt.dep[outbound])]
+        returns = tt.by_destination[tt.day[tt.by_destination] == day]
+        # (origin of the day trip, destination) of each leg
+        outbound_keys = tt.origin[outbound].astype(np.int64) * n_stations + tt.destination[outbound]
+        return_keys = tt.destination[returns].astype(np.int64) * n_stations + tt.origin[returns]
+
+        last_return = pd.Series(tt.dep[returns]).groupby(return_keys).max()
+        paired = tt.arr[outbound] < last_return.reindex(outbound_keys, fill_value=-1).to_numpy()
+        outbound, outbound_keys = outbound[paired], outbound_keys[paired]
+        first_arrival = pd.Series(tt.arr[outbound]).groupby(outbound_keys).min()
+        returns = returns[tt.dep[returns] > first_arrival.reindex(return_keys, fill_value=24 * 60).to_numpy()]
+        if len(outbound) == 0:
+            continue
+
+        # Outbound legs come grouped by origin in departure order, returns by destination in arrival order
+        rows = np.r_[outbound, returns]
+        frames.append(pd.DataFrame({
+            'day': day,
+            'origin_id': np.r_[tt.origin[outbound], tt.destination[returns]],
+            'dest_id': np.r_[tt.destination[outbound], tt.origin[returns]],
+            'leg': np.r_[np.zeros(len(outbound), dtype=np.int8), np.ones(len(returns), dtype=np.int8)],
+            'seq': np.r_[_group_seq(tt.origin[outbound]), _group_seq(tt.destination[returns])],
+            'train_no': tt.train_no[rows],
+            'dep_min': tt.dep[rows],
+            'arr_min': tt.arr[rows],
+            'axe': tt.axes[tt.axe[rows]],
+        }, columns=schema.DAY_TRIP_LEGS_COLUMNS))
+    if not frames:
+        return pd.DataFrame(columns=schema.DAY_TRIP_LEGS_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _worker_day_trips(days):
+    return day_trip_legs_frame(_worker_timetable, days)
+
+
+def _compute(database, days, workers):
+    """Day-trip legs for `days`, over a process pool when several workers are allowed."""
+    partitions = [list(days[i::workers]) for i in range(workers)] if workers > 1 else []
+    partitions = [part for part in partitions if part]
+    if len(partitions) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=len(partitions), initializer=_init_worker,
+                                     initargs=(database,)) as pool:
+                return pd.concat(pool.map(_worker_day_trips, partitions), ignore_index=True), len(partitions)
+        except Exception as e:
+            logger.warning("⚠️ Day-trip worker pool failed (%s), computing in process", e)
+    tt = timetable.Timetable.from_engine(db.create_engine(database, read_only=True))
+    return day_trip_legs_frame(tt, days), 1
+
+
+def materialize(engine, days=None, workers=None):
+    """
+    Build the day_trip_legs table of the dataset behind `engine`.
+
+    With `days`, only those days are recomputed and the rest of the table
+    is kept; the whole table is rebuilt when it does not exist yet. The
+    materialized window (first and last day) is recorded in dataset_meta.
+    """
+    start_time = time.perf_counter()
+    workers = WORKERS if workers is None else workers
+    with engine.connect() as conn:
+        first_day, last_day = conn.execute(text("SELECT MIN(day), MAX(day) FROM TGVMAX")).fetchone()
+    full = days is None or not inspect(engine).has_table('day_trip_legs')
+    if full:
+        days = range(first_day, last_day + 1) if first_day is not None else []
+    days = sorted(int(day) for day in days)
+
+    rows, used_workers = _compute(engine.url.database, days, workers) if days else \
+        (pd.DataFrame(columns=schema.DAY_TRIP_LEGS_COLUMNS), 0)
+
+    with engine.begin() as conn:
+        # Snapshots built before the legs table stored every pair
+        conn.execute(text("DROP TABLE IF EXISTS day_trips"))
+        conn.execute(text(schema.DAY_TRIP_LEGS_DDL))
+        if full:
+            conn.execute(text("DELETE FROM day_trip_legs"))
+        elif days:
+            conn.execute(text("DELETE FROM day_trip_legs WHERE day = :day"), [{"day": day} for day in days])
+        rows.to_sql('day_trip_legs', con=conn, index=False, if_exists='append', chunksize=50_000)
+        snapshots.write_meta(conn, {'day_trip_legs_first_day': first_day if first_day is not None else '',
+                                    'day_trip_legs_last_day': last_day if last_day is not None else ''})
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"🗓️ Materialized {len(rows):,} day-trip legs for {len(days)} days "
+                f"({used_workers} worker(s)), Elapsed: {elapsed:.3f}s")
+    return {'rows': len(rows), 'days': len(days), 'workers': used_workers, 'elapsed': elapsed}
+
+
+def remove_past(conn, today, current_minutes):
+    """Drop day-trip legs of past days and outbound legs that have left, inside the caller's transaction."""
+    if not inspect(conn).has_table('day_trip_legs'):
+        return 0
+    # Today's return legs only pair with outbound legs arriving before they leave, so they stay
+    return conn.execute(text("""
+        DELETE FROM day_trip_legs
+        WHERE day < :today
+           OR (day = :today AND leg = 0 AND dep_min < :current_minutes)
+    """), {"today": today, "current_minutes": current_minutes}).rowcount
+
+
+_window_cache = {}
+
+
+def _window(engine):
+    """(first_day, last_day) materialized for the current dataset version, or None."""
+    version = snapshots.dataset_version(engine)
+    path = engine.url.database
+    cached = _window_cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    meta = snapshots.read_meta(engine)
+    try:
+        window = (int(meta['day_trip_legs_first_day']), int(meta['day_trip_legs_last_day']))
+    except (KeyError, ValueError):
+        window = None
+    _window_cache[path] = (version, window)
+    return window
+
+
+def lookup(engine, stations, day):
+    """
+    Materialized day trips from any of `stations` on `day`, or None if not materialized.
+
+    Rows are (origin, destination, outbound departure, outbound arrival,
+    return departure, return arrival, outbound train, return train,
+    outbound axe, return axe) with times in minutes since midnight, each
+    origin's rows in the order the day-trip search returns them.
+    """
+    window = _window(engine)
+    if window is None or not window[0] <= day <= window[1]:
+        return None
+    if not stations:
+        return []
+    params = {f'station_{i}': station for i, station in enumerate(stations)}
+    query = LOOKUP_QUERY.format(station_placeholders=', '.join(f':{name}' for name in params))
+    with engine.connect() as conn:
+        return conn.execute(text(query), {**params, "day": day}).fetchall()
@@ -0,0 +1,98 @@
+"""
+SQLite engines tuned for serving and for updates.
+
+Connections are kept open in a pool sized for the server threads, so a
+query reuses a connection (and its page cache and prepared statements)
+instead of reopening the file. Every connection gets the same PRAGMAs;
+writer engines also switch the database to WAL, so the cron cleanup and
+update steps no longer lock out readers, and read engines are opened with
+`query_only` so serving code cannot write by accident.
+"""
+
+import functools
+import os
+
+import sqlalchemy
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool
+
+# Persistent connections per engine; overflow connections are closed when returned
+POOL_SIZE = int(os.environ.get('TGVMAX_DB_POOL_SIZE', '16'))
+BUSY_TIMEOUT_MS = 10_000
+# Prepared statements kept by each sqlite3 connection
+CACHED_STATEMENTS = 256
+
+PRAGMAS = {
+    'busy_timeout': BUSY_TIMEOUT_MS,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB
+    'temp_store': 'MEMORY',
+}
+
+
+def _configure(dbapi_connection, read_only):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            # Persistent in the file: readers of the database use WAL from then on
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+    finally:
+        cursor.close()
+
+
+def create_engine(path, read_only=False):
+    """Engine for the SQLite file at `path`; `read_only` connections reject writes."""
+    engine = sqlalchemy.create_engine(
+        f'sqlite:///{path}',
+        poolclass=QueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_SIZE,
+        connect_args={'timeout': BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False,
+                      'cached_statements': CACHED_STATEMENTS},
+    )
+
+    @event.listens_for(engine, 'connect')
+    def configure(dbapi_connection, connection_record):
+        _configure(dbapi_connection, read_only)
+
+    # Imported here: the profiler's metrics depend on modules that import this one
+    from src import profiler
+    return profiler.instrument(engine)
+
+
+def file_state(path):
+    """
+    Cheap fingerprint of the SQLite file at `path` and of its write-ahead log.
+
+    In WAL mode a commit from another process only appends to the -wal file
+    until the next checkpoint, so the main file's own stat does not change.
+    A symlinked path (the live database links to its snapshot) is resolved
+    first: SQLite names the log after the file it opened. None when the
+    database file does not exist.
+    """
+    try:
+        path = os.path.realpath(path)
+    except TypeError:
+        return None
+    states = []
+    for name in (path, f"{path}-wal"):
+        try:
+            stat = os.stat(name)
+        except (TypeError, OSError):
+            if not states:
+                return None
+            states.append(None)
+            continue
+        states.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(states)
+
+
+@functools.lru_cache(maxsize=CACHED_STATEMENTS)
+def statement(query):
+    """The text() construct of `query`, parsed once per query string."""
+    return text(query)
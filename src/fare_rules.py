@@ -0,0 +1,207 @@
+"""
+Set-based fare-rule normalization over reconstructed train stop sequences.
+
+The export lists every origin/destination pair a train sells, each with its
+own availability. Two inconsistencies are repaired:
+
+- coupure non autorisée: A->B is unavailable while A->C (same departure,
+  arriving later) is available, so B is an intermediate stop of a sold trip;
+- soudure non autorisée: A->C is unavailable while A->B and B->C are
+  available with a valid connection at B (transitively).
+
+Each (day, train_no) is turned once into a stop sequence and dense
+k x k matrices (k stops): availability and the departure/arrival time of
+every sold pair. Trains with the same number of stops are processed
+together with NumPy, and the soudure closure is one pass by increasing span.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src import schema
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on trains x k^3 cells materialised at once
+CELLS_PER_BATCH = 4_000_000
+
+
+def reconstruct_stops(train, origin, destination, dep, arr):
+    """
+    Order the stations of every train along its route.
+
+    A station's position follows from the pairs it appears in: along a
+    complete OD matrix, the n-th stop is the destination of n pairs and the
+    origin of (k - 1 - n), so (in - out) increases along the route; times
+    break ties. Returns a DataFrame of (train, station, position, arr_min,
+    dep_min) sorted by train and position.
+    """
+    n = len(train)
+    ends = pd.DataFrame({
+        'train': np.concatenate([train, train]),
+        'station': np.concatenate([origin, destination]),
+        'score': np.concatenate([-np.ones(n, dtype=np.int64), np.ones(n, dtype=np.int64)]),
+        'dep_min': np.concatenate([dep, np.full(n, np.nan)]),
+        'arr_min': np.concatenate([np.full(n, np.nan), arr]),
+    })
+    stops = ends.groupby(['train', 'station'], sort=False).agg(
+        score=('score', 'sum'), dep_min=('dep_min', 'min'), arr_min=('arr_min', 'min')).reset_index()
+    stops['time'] = stops['dep_min'].fillna(stops['arr_min'])
+    stops.sort_values(['train', 'score', 'time'], inplace=True, kind='stable')
+    stops['position'] = stops.groupby('train').cumcount()
+    return stops[['train', 'station', 'position', 'arr_min', 'dep_min']].reset_index(drop=True)
+
+
+def _coupure(exists, avail, dep, arr):
+    """Unavailable short pairs A->B covered by an available A->C with the same departure."""
+    k = exists.shape[1]
+    short = exists & ~avail & (arr > dep)
+    other_destination = ~np.eye(k, dtype=bool)[None, None]
+    covered = (avail[:, :, None, :]
+               & (dep[:, :, :, None] == dep[:, :, None, :])
+               & (arr[:, :, :, None] < arr[:, :, None, :])
+               & other_destination).any(axis=3)
+    return short & covered
+
+
+def _compose(final, dep, arr):
+    """Pairs A->C reachable as A->B + B->C with the connection at B respected."""
+    return (final[:, :, :, None] & final[:, None, :, :]
+            & (arr[:, :, :, None] <= dep[:, None, :, :])).any(axis=2)
+
+
+def _soudure(exists, avail, dep, arr):
+    """
+    Transitive closure of availability over sold pairs.
+
+    With stops in route order, a pair only composes from pairs of shorter
+    span, so one pass by increasing span reaches the fixed point. A final
+    composition step confirms it and keeps iterating for the rare train
+    whose reconstructed order is inconsistent.
+    """
+    k = exists.shape[1]
+    final = avail & exists
+    for span in range(2, k):
+        o = np.arange(k - span)
+        d = o + span
+        via = (final[:, o, :] & final[:, :, d].transpose(0, 2, 1)
+               & (arr[:, o, :] <= dep[:, :, d].transpose(0, 2, 1)))
+        final[:, o, d] |= exists[:, o, d] & via.any(axis=2)
+    while True:
+        step = final | (exists & _compose(final, dep, arr))
+        if np.array_equal(step, final):
+            return final
+        final = step
+
+
+def normalize(rows):
+    """
+    Compute the fare-rule fixes for `rows` (TGVMAX columns, whole trains).
+
+    Returns (coupure_uids, soudure_uids, stops) where the UID arrays are the
+    unavailable rows to make available and `stops` the reconstructed stop
+    sequences keyed by (day, train_no).
+    """
+    trains, train = np.unique(rows[['day', 'train_no']].to_numpy(), axis=0, return_inverse=True)
+    train = train.ravel()
+    origin = rows['origin_id'].to_numpy()
+    destination = rows['dest_id'].to_numpy()
+    dep = rows['dep_min'].to_numpy(dtype=np.int32)
+    arr = rows['arr_min'].to_numpy(dtype=np.int32)
+    available = rows['dispo'].to_numpy() == 1
+    uid = rows['UID'].to_numpy()
+
+    stops = reconstruct_stops(train, origin, destination, dep, arr)
+    n_stations = int(max(origin.max(initial=0), destination.max(initial=0))) + 1
+    stop_keys = stops['train'].to_numpy(dtype=np.int64) * n_stations + stops['station'].to_numpy()
+    key_order = np.argsort(stop_keys)
+    sorted_keys = stop_keys[key_order]
+    positions = stops['position'].to_numpy()[key_order]
+    pos_o = positions[np.searchsorted(sorted_keys, train.astype(np.int64) * n_stations + origin)]
+    pos_d = positions[np.searchsorted(sorted_keys, train.astype(np.int64) * n_stations + destination)]
+
+    stop_counts = np.bincount(stops['train'].to_numpy(), minlength=len(trains))
+    row_k = stop_counts[train]
+    coupure = np.zeros(len(rows), dtype=bool)
+    soudure = np.zeros(len(rows), dtype=bool)
+
+    # Only trains with an unavailable pair can change
+    needs_fix = np.zeros(len(trains), dtype=bool)
+    needs_fix[train[~available]] = True
+
+    for k in np.unique(stop_counts[needs_fix]):
+        bucket = np.flatnonzero(needs_fix & (stop_counts == k))
+        batch_size = max(1, CELLS_PER_BATCH // int(k) ** 3)
+        for start in range(0, len(bucket), batch_size):
+            batch = bucket[start:start + batch_size]
+            local = np.full(len(trains), -1)
+            local[batch] = np.arange(len(batch))
+            in_batch = np.flatnonzero((row_k == k) & (local[train] >= 0))
+            t, o, d = local[train[in_batch]], pos_o[in_batch], pos_d[in_batch]
+
+            shape = (len(batch), k, k)
+            exists = np.zeros(shape, dtype=bool)
+            avail = np.zeros(shape, dtype=bool)
+            dep_m = np.zeros(shape, dtype=np.int32)
+            arr_m = np.zeros(shape, dtype=np.int32)
+            exists[t, o, d] = True
+            np.logical_or.at(avail, (t, o, d), available[in_batch])
+            dep_m[t, o, d] = dep[in_batch]
+            arr_m[t, o, d] = arr[in_batch]
+
+            coupure_cells = _coupure(exists, avail, dep_m, arr_m)
+            after_coupure = avail | coupure_cells
+            soudure_cells = _soudure(exists, after_coupure, dep_m, arr_m) & ~after_coupure
+
+            unavailable = ~available[in_batch]
+            coupure[in_batch] = unavailable & coupure_cells[t, o, d]
+            soudure[in_batch] = unavailable & soudure_cells[t, o, d]
+
+    stops['day'] = trains[stops['train'].to_numpy(), 0]
+    stops['train_no'] = trains[stops['train'].to_numpy(), 1]
+    stops = stops.rename(columns={'station': 'station_id'})
+    stops[['arr_min', 'dep_min']] = stops[['arr_min', 'dep_min']].astype('Int64')
+    stops = stops[schema.TRAIN_STOPS_COLUMNS]
+    return uid[coupure], uid[soudure], stops
+
+
+def normalize_trains(engine, trains_table=None):
+    """
+    Apply the fare-rule fixes to TGVMAX and persist the stop sequences.
+
+    With `trains_table`, only the (day, train_no) pairs it lists are
+    loaded and their stop sequences replaced. Returns the number of
+    coupure and soudure fixes and of trains processed.
+    """
+    scope = ""
+    if trains_table is not None:
+        scope = f"WHERE (day, train_no) IN (SELECT day, train_no FROM {trains_table})"
+    with engine.connect() as conn:
+        rows = pd.read_sql(text(f"""
+            SELECT UID, day, train_no, origin_id, dest_id, dep_min, arr_min, dispo
+            FROM TGVMAX {scope}
+        """), conn)
+
+    if rows.empty:
+        coupure_uids = soudure_uids = np.zeros(0, dtype=np.int64)
+        stops = pd.DataFrame(columns=schema.TRAIN_STOPS_COLUMNS)
+    else:
+        coupure_uids, soudure_uids, stops = normalize(rows)
+    fixed_uids = np.concatenate([coupure_uids, soudure_uids])
+
+    with engine.begin() as conn:
+        if len(fixed_uids):
+            conn.execute(text("UPDATE TGVMAX SET dispo = 1 WHERE UID = :uid"),
+                         [{"uid": int(uid)} for uid in fixed_uids])
+        conn.execute(text(schema.TRAIN_STOPS_DDL))
+        conn.execute(text(f"DELETE FROM train_stops {scope}"))
+        stops.to_sql('train_stops', con=conn, index=False, if_exists='append', chunksize=50_000)
+
+    return {
+        'coupure_fixed': len(coupure_uids),
+        'soudure_fixed': len(soudure_uids),
+        'trains': int(stops[['day', 'train_no']].drop_duplicates().shape[0]),
+    }
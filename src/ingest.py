@@ -0,0 +1,289 @@
+"""
+Streaming ingest of the SNCF TGVMAX export.
+
+The export is read in chunks straight from the HTTP body (or a local file),
+encoded to the typed schema chunk by chunk and appended to a staging table.
+The live tables are only replaced once the whole export has been loaded.
+"""
+
+import io
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import requests
+from sqlalchemy import text
+
+from src import schema
+
+logger = logging.getLogger(__name__)
+
+SNCF_EXPORT_URL = "https://ressources.data.sncf.com/api/explore/v2.1/catalog/datasets/tgvmax/exports/csv"
+
+# Rows parsed, encoded and inserted per chunk
+CHUNK_ROWS = int(os.environ.get('TGVMAX_INGEST_CHUNK_ROWS', '50000'))
+READ_BYTES = 1 << 20
+HTTP_TIMEOUT = (10, 300)
+
+STAGING_TABLE = 'TGVMAX_staging'
+READ_COLUMNS = set(schema.EXPORT_COLUMNS) | {'od_happy_card'}
+
+
+class DownloadError(Exception):
+    """The export endpoint answered with a non-200 status."""
+
+    def __init__(self, status_code, response_text):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response_text = response_text
+
+
+class CountingReader(io.RawIOBase):
+    """Raw binary stream over an iterator of byte chunks that counts what was read."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        self.bytes_read += size
+        return size
+
+
+@contextmanager
+def open_export(source):
+    """
+    Open the export as a CountingReader; yields (reader, total_bytes or None).
+
+    `source` is an http(s) URL, a file:// URL or a local path.
+    """
+    if source.startswith(('http://', 'https://')):
+        with requests.get(source, stream=True, timeout=HTTP_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise DownloadError(response.status_code, response.text)
+            total_bytes = int(response.headers.get('Content-Length') or 0) or None
+            yield CountingReader(response.iter_content(READ_BYTES)), total_bytes
+    else:
+        path = source[len('file://'):] if source.startswith('file://') else source
+        with open(path, 'rb') as f:
+            yield CountingReader(iter(lambda: f.read(READ_BYTES), b'')), os.path.getsize(path)
+
+
+def _format_progress(bytes_read, total_bytes):
+    if total_bytes:
+        return f"{bytes_read / 1e6:.1f}/{total_bytes / 1e6:.1f} MB"
+    return f"{bytes_read / 1e6:.1f} MB"
+
+
+def _new_stats():
+    return {'rows': 0, 'bytes': 0, 'chunks': 0, 'stations': 0,
+            'read_seconds': 0.0, 'encode_seconds': 0.0, 'insert_seconds': 0.0, 'publish_seconds': 0.0}
+
+
+def _stream_to_staging(engine, source, chunk_rows, stations, stats, uid_offset=0):
+    """
+    Parse, encode and append the export to the staging table, chunk by chunk.
+
+    `stations` is extended with the stations seen in the export and returned.
+    """
+    start_time = time.perf_counter()
+    logger.info("📥 Streaming export from %s", source)
+
+    with engine.begin() as conn:
+        schema.create_staging_table(conn, STAGING_TABLE)
+
+    with open_export(source) as (reader, total_bytes):
+        stream = io.TextIOWrapper(io.BufferedReader(reader, READ_BYTES), encoding='utf-8-sig')
+        chunks = pd.read_csv(stream, sep=';', dtype=str, chunksize=chunk_rows,
+                             usecols=lambda column: column in READ_COLUMNS)
+        stage_start = time.perf_counter()
+        for chunk in chunks:
+            stats['read_seconds'] += time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            schema.normalise_export_columns(chunk)
+            # The reader keeps numbering rows across chunks, so the index is a unique UID
+            chunk['UID'] = chunk.index + uid_offset
+            stations = schema.encode_stations(chunk, stations)
+            trips = schema.encode_trips(chunk, stations)
+            stats['encode_seconds'] += time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            with engine.begin() as conn:
+                trips.to_sql(STAGING_TABLE, con=conn, index=False, if_exists='append')
+            stats['insert_seconds'] += time.perf_counter() - stage_start
+
+            stats['chunks'] += 1
+            stats['rows'] += len(trips)
+            stats['bytes'] = reader.bytes_read
+            elapsed = time.perf_counter() - start_time
+            logger.info("📦 Chunk %d: %s rows total, %s read (%.1f MB/s)", stats['chunks'], f"{stats['rows']:,}",
+                        _format_progress(reader.bytes_read, total_bytes), reader.bytes_read / 1e6 / max(elapsed, 1e-9))
+            stage_start = time.perf_counter()
+
+    stats['stations'] = len(stations)
+    return stations
+
+
+def _log_completed(stats):
+    logger.info("✅ Ingest completed: %s rows, %s stations, %.1f MB in %.3fs "
+                "(read %.3fs, encode %.3fs, insert %.3fs, index+publish %.3fs)",
+                f"{stats['rows']:,}", stats['stations'], stats['bytes'] / 1e6, stats['elapsed'],
+                stats['read_seconds'], stats['encode_seconds'], stats['insert_seconds'], stats['publish_seconds'])
+
+
+def ingest_export(engine, source=None, chunk_rows=CHUNK_ROWS):
+    """
+    Stream the export into the database, replacing the current dataset.
+
+    Each chunk is parsed, encoded and appended to a staging table in its own
+    short transaction; indexes are built once, when the staging table is
+    published. Returns row/byte counts and the time spent in each stage.
+    """
+    source = source or os.environ.get('TGVMAX_EXPORT_URL', SNCF_EXPORT_URL)
+    stats = _new_stats()
+    start_time = time.perf_counter()
+    stations = _stream_to_staging(engine, source, chunk_rows, {}, stats)
+
+    stage_start = time.perf_counter()
+    with engine.begin() as conn:
+        schema.publish_staging(conn, STAGING_TABLE, stations)
+    stats['publish_seconds'] = time.perf_counter() - stage_start
+    stats['elapsed'] = time.perf_counter() - start_time
+    _log_completed(stats)
+    return stats
+
+
+# Trains touched by the last incremental ingest; the fare-rule fixes are scoped to them
+AFFECTED_TRAINS_TABLE = 'ingest_affected_trains'
+
+_SAME_KEY = ' AND '.join(f"r.{column} = s.{column}" for column in schema.NATURAL_KEY)
+
+CHANGE_COUNT_QUERIES = {
+    'inserted': f"""
+        SELECT COUNT(*) FROM {STAGING_TABLE} s
+        WHERE NOT EXISTS (SELECT 1 FROM {schema.RAW_TABLE} r WHERE {_SAME_KEY})
+    """,
+    'deleted': f"""
+        SELECT COUNT(*) FROM {schema.RAW_TABLE} r
+        WHERE NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} s WHERE {_SAME_KEY})
+    """,
+    'changed': f"""
+        SELECT COUNT(*) FROM {STAGING_TABLE} s
+        JOIN {schema.RAW_TABLE} r ON {_SAME_KEY}
+        WHERE r.row_hash != s.row_hash
+    """,
+}
+
+# A train is affected when any of its rows has no identical counterpart (same key and hash) on the other side
+AFFECTED_TRAINS_QUERY = f"""
+    INSERT OR IGNORE INTO {AFFECTED_TRAINS_TABLE} (day, train_no)
+    SELECT s.day, s.train_no FROM {STAGING_TABLE} s
+    WHERE NOT EXISTS (SELECT 1 FROM {schema.RAW_TABLE} r WHERE {_SAME_KEY} AND r.row_hash = s.row_hash)
+    UNION
+    SELECT r.day, r.train_no FROM {schema.RAW_TABLE} r
+    WHERE NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} s WHERE {_SAME_KEY} AND r.row_hash = s.row_hash)
+"""
+
+_IN_AFFECTED = f"(day, train_no) IN (SELECT day, train_no FROM {AFFECTED_TRAINS_TABLE})"
+
+
+def ingest_export_incremental(engine, source=None, chunk_rows=CHUNK_ROWS):
+    """
+    Stream the export and apply only what changed since the previous one.
+
+    Rows are matched with TGVMAX_RAW on their natural key (day, train_no,
+    origin, destination) and compared by row hash. Every train with an
+    inserted, deleted or changed row is replaced from the new export and
+    recorded in `ingest_affected_trains`, so the fare-rule fixes can be
+    re-run on those trains only. Unchanged rows keep their UID. Falls back
+    to a full ingest when there is no previous snapshot.
+    """
+    if not schema.has_raw_snapshot(engine):
+        logger.info("ℹ️ No previous export snapshot, running a full ingest")
+        stats = ingest_export(engine, source, chunk_rows)
+        stats['changes'] = None
+        return stats
+
+    source = source or os.environ.get('TGVMAX_EXPORT_URL', SNCF_EXPORT_URL)
+    stats = _new_stats()
+    start_time = time.perf_counter()
+    with engine.connect() as conn:
+        stations = schema.load_stations(conn)
+        uid_offset = conn.execute(text(f"SELECT COALESCE(MAX(UID), -1) + 1 FROM {schema.RAW_TABLE}")).scalar()
+    known_stations = set(stations)
+    stations = _stream_to_staging(engine, source, chunk_rows, stations, stats, uid_offset=uid_offset)
+
+    stage_start = time.perf_counter()
+    today = schema.date_to_day(time.strftime('%Y-%m-%d'))
+    with engine.begin() as conn:
+        # Days already over are not diffed; remove_past_trips drops them from TGVMAX
+        conn.execute(text(f"DELETE FROM {schema.RAW_TABLE} WHERE day < :today"), {"today": today})
+        conn.execute(text(f"DELETE FROM {STAGING_TABLE} WHERE day < :today"), {"today": today})
+        conn.execute(text(schema.NATURAL_KEY_INDEX_DDL.format(table=STAGING_TABLE)))
+
+        changes = {kind: conn.execute(text(query)).scalar() for kind, query in CHANGE_COUNT_QUERIES.items()}
+        conn.execute(text(f"DROP TABLE IF EXISTS {AFFECTED_TRAINS_TABLE}"))
+        conn.execute(text(f"""
+            CREATE TABLE {AFFECTED_TRAINS_TABLE} (
+                day INTEGER NOT NULL,
+                train_no INTEGER NOT NULL,
+                PRIMARY KEY (day, train_no)
+            ) WITHOUT ROWID
+        """))
+        conn.execute(text(AFFECTED_TRAINS_QUERY))
+        affected = conn.execute(text(f"SELECT day, train_no FROM {AFFECTED_TRAINS_TABLE} ORDER BY day, train_no")).fetchall()
+
+        # Unchanged rows of affected trains keep their previous UID (exact duplicates keep the new one)
+        conn.execute(text(f"""
+            UPDATE OR IGNORE {STAGING_TABLE} AS s
+            SET UID = r.UID
+            FROM {schema.RAW_TABLE} r
+            WHERE {_SAME_KEY} AND r.row_hash = s.row_hash
+              AND (s.day, s.train_no) IN (SELECT day, train_no FROM {AFFECTED_TRAINS_TABLE})
+        """))
+
+        columns = ', '.join(schema.TRIP_COLUMNS)
+        raw_columns = ', '.join(schema.RAW_COLUMNS)
+        conn.execute(text(f"DELETE FROM TGVMAX WHERE {_IN_AFFECTED}"))
+        conn.execute(text(f"DELETE FROM {schema.RAW_TABLE} WHERE {_IN_AFFECTED}"))
+        conn.execute(text(f"INSERT INTO {schema.RAW_TABLE} ({raw_columns}) "
+                          f"SELECT {raw_columns} FROM {STAGING_TABLE} WHERE {_IN_AFFECTED}"))
+        conn.execute(text(f"INSERT INTO TGVMAX ({columns}) "
+                          f"SELECT {columns} FROM {STAGING_TABLE} WHERE {_IN_AFFECTED}"))
+
+        new_stations = {name: value for name, value in stations.items() if name not in known_stations}
+        if new_stations:
+            schema.stations_frame(new_stations).to_sql('stations', con=conn, index=False, if_exists='append')
+        conn.execute(text(f"DROP TABLE {STAGING_TABLE}"))
+    stats['publish_seconds'] = time.perf_counter() - stage_start
+    stats['elapsed'] = time.perf_counter() - start_time
+
+    changes['trains'] = len(affected)
+    changes['days'] = sorted({schema.day_to_date(day) for day, _ in affected})
+    changes['new_stations'] = sorted(new_stations)
+    stats['changes'] = changes
+    logger.info("🔀 Export diff: %d inserted, %d deleted, %d changed rows across %d trains (%d days)",
+                changes['inserted'], changes['deleted'], changes['changed'], changes['trains'], len(changes['days']))
+    _log_completed(stats)
+    return stats
+
+
+def drop_affected_trains(engine):
+    """Forget the trains recorded by the last incremental ingest."""
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {AFFECTED_TRAINS_TABLE}"))
@@ -1,14 +1,95 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+import threading
 
 # Use project's logs directory instead of /var/log
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOGS_DIR = os.path.join(PROJECT_ROOT, 'logs')
 DEFAULT_LOG_FILE = os.path.join(LOGS_DIR, 'tgvmax_app.log')
 
+# Records waiting for the writer thread; new records are dropped when it is full
+QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Share of requests logged by after_request (errors are always logged)
+REQUEST_LOG_SAMPLE = float(os.getenv('REQUEST_LOG_SAMPLE', '1.0'))
+# Share of logged requests that also carry headers, JSON body and response
+PAYLOAD_LOG_SAMPLE = float(os.getenv('PAYLOAD_LOG_SAMPLE', '0.01'))
+# Request and response payloads are cut to this many bytes
+PAYLOAD_LOG_MAX_BYTES = int(os.getenv('PAYLOAD_LOG_MAX_BYTES', '2048'))
+
+_listeners = []
+_dropped = 0
+_dropped_lock = threading.Lock()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hand records to a QueueListener without formatting them.
+
+    The caller only pays for the enqueue: the message is built by the
+    listener thread, and a full queue drops the record instead of blocking.
+    """
+
+    def prepare(self, record):
+        # Tracebacks hold frames: render them now, leave msg % args to the listener
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _dropped_lock:
+                _dropped += 1
+
+
+def dropped_records():
+    """Number of log records dropped because the queue was full."""
+    return _dropped
+
+
+def _start_listener(handler, handlers):
+    listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _queued(logger, handlers):
+    """Route `logger` through a queue to `handlers`, written by a background thread."""
+    handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    logger.addHandler(handler)
+    # [queue handler, writing handlers, running listener or None]
+    _listeners.append([handler, handlers, _start_listener(handler, handlers)])
+
+
+def _stop_listeners():
+    for entry in _listeners:
+        listener, entry[2] = entry[2], None
+        if listener is not None:
+            listener.stop()
+
+
+def _restart_listeners():
+    # Threads do not survive fork (gunicorn workers), and a queue lock may have
+    # been held when it happened: give each child fresh queues and writers.
+    # The inherited listeners have no thread here, so they are dropped, not stopped
+    for entry in _listeners:
+        handler, handlers, _ = entry
+        handler.queue = queue.Queue(QUEUE_SIZE)
+        entry[2] = _start_listener(handler, handlers)
+
+
+atexit.register(_stop_listeners)
+os.register_at_fork(after_in_child=_restart_listeners)
+
+
 def setup_logging(log_file: str = DEFAULT_LOG_FILE) -> None:
-    """Configure root logger with console and rotating file handlers."""
+    """Configure root logger with console and rotating file handlers, written from a queue."""
     logger = logging.getLogger()
     if logger.handlers:
         # Already configured
@@ -20,7 +101,7 @@ def setup_logging(log_file: str = DEFAULT_LOG_FILE) -> None:
     formatter = logging.Formatter(
         '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
     )
-    
+
     # Create a more detailed formatter for request timing logs
     detailed_formatter = logging.Formatter(
         '%(asctime)s - %(levelname)s - %(name)s - [%(filename)s:%(lineno)d] - %(message)s'
@@ -32,21 +113,29 @@ def setup_logging(log_file: str = DEFAULT_LOG_FILE) -> None:
 
     file_handler = RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=5)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
-    
+    _queued(logger, [file_handler, stream_handler])
+
     # Create a separate logger for request timing
     request_logger = logging.getLogger('request_timing')
     request_logger.setLevel(logging.INFO)
-    
+
     # Create a separate log file for request timing
     request_log_file = os.path.join(LOGS_DIR, 'tgvmax_requests.log')
     request_file_handler = RotatingFileHandler(request_log_file, maxBytes=1_000_000, backupCount=5)
     request_file_handler.setFormatter(detailed_formatter)
-    request_logger.addHandler(request_file_handler)
-    
+    _queued(request_logger, [request_file_handler])
+
     # Don't propagate to root logger to avoid duplicate logs
     request_logger.propagate = False
+
+    # Slow queries with their plans, one JSON object per line (see src/profiler.py)
+    slow_query_logger = logging.getLogger('slow_queries')
+    slow_query_logger.setLevel(logging.WARNING)
+    slow_query_file_handler = RotatingFileHandler(os.path.join(LOGS_DIR, 'tgvmax_slow_queries.log'),
+                                                  maxBytes=1_000_000, backupCount=5)
+    slow_query_file_handler.setFormatter(logging.Formatter('%(message)s'))
+    _queued(slow_query_logger, [slow_query_file_handler])
+    slow_query_logger.propagate = False
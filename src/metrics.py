@@ -0,0 +1,253 @@
+"""
+In-process metrics exported in the Prometheus text format at /metrics.
+
+Counters, gauges and histograms are plain Python objects updated under a
+lock: an observation is a bisect and a few increments, cheap enough to
+stay on in production. Values that already live elsewhere (result cache
+counters, dataset version and age, update stage durations recorded in the
+snapshot) are read by collectors when the endpoint is scraped. Nothing is
+pushed anywhere, so no collector or network access is needed.
+
+Each process keeps its own registry: under gunicorn, every scrape reports
+the worker that served it.
+"""
+
+import bisect
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from src import cache, logging_config, snapshots
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label values."""
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    """Last value per label values."""
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label values, with sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items())
+        for label_values, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+
+def register_collector(collect):
+    """
+    Add `collect`, called on every scrape.
+
+    It returns (name, kind, documentation, samples) tuples, samples being
+    (labels dict, value) pairs.
+    """
+    _collectors.append(collect)
+
+
+def render():
+    """Every metric and collector in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, documentation, samples in collect():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# -- request and search metrics ----------------------------------------------
+
+REQUEST_DURATION = Histogram('tgvmax_http_request_duration_seconds',
+                             'Time to produce the response (first chunk for streamed ones)',
+                             ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram('tgvmax_http_response_bytes', 'Size of non-streamed response bodies',
+                           ('endpoint',), BYTES_BUCKETS)
+SEARCH_RESULTS = Histogram('tgvmax_search_results', 'Results found per search, before pagination',
+                           ('search',), COUNT_BUCKETS)
+SQL_DURATION = Histogram('tgvmax_sql_query_duration_seconds', 'SQL time by query shape',
+                         ('shape',), SQL_BUCKETS)
+SQL_SHAPES = Gauge('tgvmax_sql_query_shape_info', 'Normalised query text of each shape', ('shape', 'query'))
+
+
+def observe_request(endpoint, method, status, duration, size):
+    REQUEST_DURATION.observe(duration, endpoint, method, str(status))
+    if size is not None:
+        RESPONSE_BYTES.observe(size, endpoint)
+
+
+@lru_cache(maxsize=512)
+def normalise_query(query):
+    """
+    (shape id, normalised text) of `query`, placeholder lists folded into one placeholder.
+
+    Queries built for N stations or UIDs share a shape whatever N is; the
+    normalised text is exported once in tgvmax_sql_query_shape_info.
+    """
+    normalised = re.sub(r'\s+', ' ', query).strip().rstrip(';')
+    normalised = re.sub(r':(\w+?)_\d+\b', r':\1_N', normalised)
+    normalised = re.sub(r'(:\w+_N)(, \1)+', r'\1', normalised)
+    # Positional parameters as compiled by SQLAlchemy
+    normalised = re.sub(r'\?(, \?)+', '?', normalised)
+    shape = hashlib.sha1(normalised.encode('utf-8')).hexdigest()[:10]
+    SQL_SHAPES.set(1, shape, normalised[:200])
+    return shape, normalised
+
+
+def query_shape(query):
+    """Short id of the shape of `query` (see normalise_query)."""
+    return normalise_query(query)[0]
+
+
+def observe_query(query, duration):
+    """Record `duration` for the shape of `query` and return that shape."""
+    shape = query_shape(query)
+    SQL_DURATION.observe(duration, shape)
+    return shape
+
+
+# -- collectors ----------------------------------------------------------------
+
+def _cache_samples():
+    stats = cache.result_cache.stats()
+    return [
+        ('tgvmax_result_cache_hits_total', 'counter', 'Result cache hits by tier',
+         [({'tier': 'memory'}, stats['memory_hits']), ({'tier': 'disk'}, stats['disk_hits'])]),
+        ('tgvmax_result_cache_misses_total', 'counter', 'Result cache misses', [({}, stats['misses'])]),
+        ('tgvmax_result_cache_evictions_total', 'counter', 'Result cache evictions by tier',
+         [({'tier': 'memory'}, stats['memory_evictions']), ({'tier': 'disk'}, stats['disk_evictions'])]),
+        ('tgvmax_result_cache_entries', 'gauge', 'Result cache entries by tier',
+         [({'tier': 'memory'}, stats['memory_entries']), ({'tier': 'disk'}, stats['disk_entries'])]),
+        ('tgvmax_result_cache_hit_ratio', 'gauge', 'Share of result cache lookups served from a tier',
+         [({}, stats['hit_rate'])]),
+    ]
+
+
+def _logging_samples():
+    return [('tgvmax_log_records_dropped_total', 'counter', 'Log records dropped on a full logging queue',
+             [({}, logging_config.dropped_records())])]
+
+
+register_collector(_cache_samples)
+register_collector(_logging_samples)
+
+
+def dataset_collector(engine):
+    """Collector for the dataset behind `engine`: version, age and the stage durations of its build."""
+
+    def _age(meta, key):
+        try:
+            return round(time.time() - datetime.fromisoformat(meta[key]).timestamp(), 3)
+        except (KeyError, ValueError):
+            return None
+
+    def collect():
+        meta = snapshots.read_meta(engine)
+        try:
+            stages = json.loads(meta.get('build', '{}')).get('stages', {})
+        except ValueError:
+            stages = {}
+        return [
+            ('tgvmax_dataset_info', 'gauge', 'Live dataset version',
+             [({'version': snapshots.format_version(meta)}, 1)]),
+            ('tgvmax_dataset_age_seconds', 'gauge', 'Time since the live snapshot was built',
+             [({}, _age(meta, 'built_at'))]),
+            ('tgvmax_dataset_updated_age_seconds', 'gauge', 'Time since the live dataset last changed',
+             [({}, _age(meta, 'updated_at'))]),
+            ('tgvmax_update_stage_duration_seconds', 'gauge', 'Stage durations of the update that built the live snapshot',
+             [({'stage': stage}, seconds) for stage, seconds in sorted(stages.items())]),
+        ]
+
+    return collect
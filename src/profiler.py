@@ -0,0 +1,164 @@
+"""
+SQL query profiler with a slow-query log.
+
+Every statement is timed and fingerprinted by shape (see
+metrics.normalise_query): run_query records the time through the fetch
+and the row count, and a hook on each engine covers everything else (the
+fix passes, ingest, day-trip lookups). Timings feed the
+tgvmax_sql_query_duration_seconds histogram.
+
+A statement slower than TGVMAX_SLOW_QUERY_MS is written to the slow-query
+log (logs/tgvmax_slow_queries.log, one JSON object per line) with its
+bound parameters and its EXPLAIN QUERY PLAN, captured once per shape.
+Batches (executemany: the ingest inserts, the fix passes) are timed as a
+whole and only logged above TGVMAX_SLOW_BATCH_MS, with their row count:
+their parameters are thousands of rows and an INSERT has no plan.
+scripts/query_report.py summarises that log.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from src import metrics
+
+SLOW_QUERY_MS = float(os.environ.get('TGVMAX_SLOW_QUERY_MS', '100'))
+SLOW_BATCH_MS = float(os.environ.get('TGVMAX_SLOW_BATCH_MS', '1000'))
+# Parameters kept per slow query, and characters kept per parameter value
+PARAMS_LIMIT = 50
+PARAM_CHARS = 200
+# Shapes whose plan is remembered
+PLAN_CACHE_SIZE = 512
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+slow_logger = logging.getLogger('slow_queries')
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def _trim(value):
+    if isinstance(value, str) and len(value) > PARAM_CHARS:
+        return value[:PARAM_CHARS] + '...'
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+def _bound_params(params):
+    """At most PARAMS_LIMIT parameters, JSON-friendly."""
+    if not params:
+        return None
+    if isinstance(params, dict):
+        items = list(params.items())
+        kept = {key: _trim(value) for key, value in items[:PARAMS_LIMIT]}
+        if len(items) > PARAMS_LIMIT:
+            kept['...'] = f"{len(items) - PARAMS_LIMIT} more"
+        return kept
+    values = list(params)
+    kept = [_trim(value) for value in values[:PARAMS_LIMIT]]
+    if len(values) > PARAMS_LIMIT:
+        kept.append(f"... {len(values) - PARAMS_LIMIT} more")
+    return kept
+
+
+def _plan(shape, query, explain):
+    """EXPLAIN QUERY PLAN detail lines for `shape`, computed once per shape."""
+    with _plans_lock:
+        if shape in _plans:
+            return _plans[shape]
+    plan = None
+    keyword = (query.lstrip().split(None, 1) or [''])[0].upper()
+    if explain is not None and keyword in EXPLAINABLE:
+        try:
+            # Rows are (id, parent, notused, detail): indent each step under its parent
+            depth = {0: -1}
+            plan = []
+            for step_id, parent, _, detail in explain():
+                depth[step_id] = depth.get(parent, -1) + 1
+                plan.append('  ' * depth[step_id] + detail)
+        except Exception as e:
+            plan = [f"EXPLAIN failed: {e}"]
+    with _plans_lock:
+        if len(_plans) >= PLAN_CACHE_SIZE:
+            _plans.clear()
+        _plans[shape] = plan
+    return plan
+
+
+def observe(query, params, duration, rows=None, explain=None, source='run_query', database=None):
+    """
+    Record one execution of `query`; log it with its plan when slower than SLOW_QUERY_MS.
+
+    `explain` is a callable returning the EXPLAIN QUERY PLAN rows of the
+    query with the same parameters; it only runs for slow queries.
+    """
+    shape = metrics.observe_query(query, duration)
+    duration_ms = duration * 1000
+    if duration_ms < SLOW_QUERY_MS:
+        return
+    plan = _plan(shape, query, explain)
+    _log(shape, query, duration_ms, rows, _bound_params(params), plan, source, database)
+
+
+def observe_batch(query, batch_size, duration, database=None):
+    """
+    Record one executemany of `query` over `batch_size` parameter sets.
+
+    Logged when slower than SLOW_BATCH_MS, with the row count only: no
+    parameters and no plan.
+    """
+    shape = metrics.observe_query(query, duration)
+    duration_ms = duration * 1000
+    if duration_ms < SLOW_BATCH_MS:
+        return
+    _log(shape, query, duration_ms, batch_size, None, None, 'executemany', database)
+
+
+def _log(shape, query, duration_ms, rows, params, plan, source, database):
+    slow_logger.warning(json.dumps({
+        'at': datetime.now().isoformat(timespec='milliseconds'),
+        'shape': shape,
+        'query': metrics.normalise_query(query)[1],
+        'duration_ms': round(duration_ms, 3),
+        'rows': rows,
+        'params': params,
+        'plan': plan,
+        'full_scan': any(line.strip().startswith('SCAN ') and ' USING ' not in line for line in plan or ()),
+        'source': source,
+        'database': os.path.basename(database) if database else None,
+    }, default=str, ensure_ascii=False))
+
+
+def instrument(engine):
+    """Time every statement executed through `engine`, except those run_query already profiles."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profiler_start')
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        if context is not None and context.execution_options.get('profiled'):
+            return
+        if executemany:
+            observe_batch(statement, len(parameters or ()), duration, database=engine.url.database)
+            return
+        observe(statement, parameters, duration,
+                rows=cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None,
+                explain=lambda: cursor.connection.execute('EXPLAIN QUERY PLAN ' + statement,
+                                                          parameters or ()).fetchall(),
+                source='engine',
+                database=engine.url.database)
+
+    return engine
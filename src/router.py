@@ -0,0 +1,356 @@
+"""
+Connection Scan Algorithm (CSA) router over the in-memory timetable.
+
+Every TGVMAX row is a connection (origin, departure) -> (destination, arrival)
+on a given day. Journeys are chains of connections on the same day where each
+transfer either stays in the station (at least one minute) or walks between
+two stations of a station group within the configured connection time.
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INFINITY = np.iinfo(np.int32).max
+
+# Same-station transfers need the next train to leave strictly after the arrival
+MIN_TRANSFER_MINUTES = 1
+
+
+class ConnectionScanRouter:
+    """Earliest-arrival and latest-departure journeys over one timetable."""
+
+    def __init__(self, tt, transfers=()):
+        self.tt = tt
+        # Arrivals after midnight are kept on the departure day, shifted by 24h
+        self.arr_abs = np.where(tt.arr >= tt.dep, tt.arr, tt.arr + 1440).astype(np.int32)
+        self.footpaths = {}
+        for station1, station2, minutes in transfers:
+            id1, id2 = tt.station_id(station1), tt.station_id(station2)
+            if id1 is not None and id2 is not None:
+                self.footpaths.setdefault(id1, []).append((id2, int(minutes)))
+        self._by_departure = {}
+        self._by_arrival = {}
+        self._lock = threading.Lock()
+
+    def _day_rows(self, day):
+        return np.flatnonzero(self.tt.day == day)
+
+    def connections_by_departure(self, day):
+        """Row indices of `day`, sorted by departure time."""
+        if day not in self._by_departure:
+            rows = self._day_rows(day)
+            rows = rows[np.lexsort((self.arr_abs[rows], self.tt.dep[rows]))]
+            with self._lock:
+                self._by_departure[day] = rows
+        return self._by_departure[day]
+
+    def connections_by_arrival(self, day):
+        """Row indices of `day`, sorted by arrival time, latest first."""
+        if day not in self._by_arrival:
+            rows = self._day_rows(day)
+            rows = rows[np.lexsort((-self.tt.dep[rows].astype(np.int32), -self.arr_abs[rows]))]
+            with self._lock:
+                self._by_arrival[day] = rows
+        return self._by_arrival[day]
+
+    def _station_ids(self, names):
+        ids = (self.tt.station_id(name) for name in names)
+        return {station_id for station_id in ids if station_id is not None}
+
+    def earliest_arrival(self, day, origins, destinations, depart_after=0, allow_station_groups=True):
+        """
+        Return the connection rows of the earliest-arriving journey, or None.
+
+        A single forward scan over the day's connections sorted by departure.
+        """
+        sources = self._station_ids(origins)
+        targets = self._station_ids(destinations)
+        if not sources or not targets:
+            return None
+
+        tt = self.tt
+        rows = self.connections_by_departure(day)
+        deps = tt.dep[rows]
+        rows = rows[np.searchsorted(deps, depart_after, side='left'):]
+
+        n_stations = len(tt.stations)
+        ready = [INFINITY] * n_stations
+        arrival = [INFINITY] * n_stations
+        arrived_by = [-1] * n_stations
+        ready_from = [-1] * n_stations
+        for source in sources:
+            ready[source] = depart_after
+
+        footpaths = self.footpaths if allow_station_groups else {}
+        best_arrival, best_target = INFINITY, None
+        scan = zip(rows.tolist(), tt.origin[rows].tolist(), tt.destination[rows].tolist(),
+                   tt.dep[rows].tolist(), self.arr_abs[rows].tolist())
+        for row, boarded_at, station, departure, arrival_time in scan:
+            if departure >= best_arrival:
+                break
+            if ready[boarded_at] > departure or arrival_time >= arrival[station]:
+                continue
+            arrival[station] = arrival_time
+            arrived_by[station] = row
+            if station in targets and arrival_time < best_arrival:
+                best_arrival, best_target = arrival_time, station
+            if arrival_time + MIN_TRANSFER_MINUTES < ready[station]:
+                ready[station] = arrival_time + MIN_TRANSFER_MINUTES
+                ready_from[station] = station
+            for neighbour, minutes in footpaths.get(station, ()):
+                if arrival_time + minutes < ready[neighbour]:
+                    ready[neighbour] = arrival_time + minutes
+                    ready_from[neighbour] = station
+
+        if best_target is None:
+            return None
+
+        legs = []
+        station = best_target
+        while True:
+            row = arrived_by[station]
+            legs.append(row)
+            boarded_at = int(tt.origin[row])
+            if ready_from[boarded_at] == -1:
+                break
+            station = ready_from[boarded_at]
+        legs.reverse()
+        return legs
+
+    def latest_departure(self, day, origins, destinations, arrive_by=1439, depart_after=0, depart_before=1439,
+                         max_transfers=5, allow_station_groups=True):
+        """
+        Return the connection rows of the latest-departing journey arriving by `arrive_by`, or None.
+
+        The mirror image of `earliest_arrival`: one backward scan over the
+        day's connections sorted by arrival, latest first. Only journeys of at
+        most `max_transfers` changes leaving within [depart_after,
+        depart_before] are considered, so the labels are kept per number of
+        trains still to take.
+        """
+        sources = self._station_ids(origins)
+        targets = self._station_ids(destinations)
+        if not sources or not targets:
+            return None
+
+        tt = self.tt
+        rows = self.connections_by_arrival(day)
+        arrivals = self.arr_abs[rows]
+        # Arrivals are sorted descending, so skip those after the deadline
+        rows = rows[np.searchsorted(-arrivals, -arrive_by, side='left'):]
+
+        n_stations = len(tt.stations)
+        rounds = max_transfers + 1
+        # needed_by[k][station]: latest time one may arrive at a station and
+        # still reach a target in time with at most k more trains
+        needed_by = [[-1] * n_stations for _ in range(rounds + 1)]
+        continues_with = [[-1] * n_stations for _ in range(rounds + 1)]
+        for k in range(rounds + 1):
+            for target in targets:
+                needed_by[k][target] = arrive_by
+
+        footpaths = self.footpaths if allow_station_groups else {}
+        best_departure, best_row, best_trains = -1, None, 0
+        scan = zip(rows.tolist(), tt.origin[rows].tolist(), tt.destination[rows].tolist(),
+                   tt.dep[rows].tolist(), self.arr_abs[rows].tolist())
+        for row, station, alighted_at, departure, arrival_time in scan:
+            if arrival_time <= best_departure or arrival_time < depart_after:
+                break
+            # Fewest trains (this one included) that still reach a target in time
+            trains = 1
+            while trains <= rounds and arrival_time > needed_by[trains - 1][alighted_at]:
+                trains += 1
+            if trains > rounds:
+                continue
+            if (station in sources and depart_after <= departure <= depart_before
+                    and departure > best_departure):
+                best_departure, best_row, best_trains = departure, row, trains
+            for k in range(trains, rounds + 1):
+                if departure - MIN_TRANSFER_MINUTES > needed_by[k][station]:
+                    needed_by[k][station] = departure - MIN_TRANSFER_MINUTES
+                    continues_with[k][station] = row
+                for neighbour, minutes in footpaths.get(station, ()):
+                    if departure - minutes > needed_by[k][neighbour]:
+                        needed_by[k][neighbour] = departure - minutes
+                        continues_with[k][neighbour] = row
+
+        if best_row is None:
+            return None
+
+        legs = [best_row]
+        station = int(tt.destination[best_row])
+        remaining = best_trains - 1
+        while station not in targets:
+            row = continues_with[remaining][station]
+            legs.append(row)
+            station = int(tt.destination[row])
+            remaining -= 1
+        return legs
+
+
+class RaptorRouter(ConnectionScanRouter):
+    """
+    Adds a round-based (RAPTOR-style) multi-criteria profile search.
+
+    Round k extends every journey found in round k-1 by one more train, so
+    the number of trains is an explicit criterion. Departures are processed
+    from the latest to the earliest (rRAPTOR), reusing labels between them,
+    and only journeys that are Pareto-optimal on (later departure, earlier
+    arrival, fewer transfers) are returned.
+    """
+
+    def __init__(self, tt, transfers=()):
+        super().__init__(tt, transfers)
+        pairs = [(origin, target, minutes) for origin, paths in self.footpaths.items()
+                 for target, minutes in paths]
+        self._walk_from = np.array([p[0] for p in pairs], dtype=np.int64)
+        self._walk_to = np.array([p[1] for p in pairs], dtype=np.int64)
+        self._walk_minutes = np.array([p[2] for p in pairs], dtype=np.int64)
+
+    def _ready_times(self, stations, arrivals, allow_station_groups):
+        """Earliest boarding time at each station reachable right after arriving at `stations`."""
+        reached = [stations]
+        times = [arrivals + MIN_TRANSFER_MINUTES]
+        came_from = [stations]
+        if allow_station_groups and len(self._walk_from):
+            position = np.full(len(self.tt.stations), -1, dtype=np.int64)
+            position[stations] = np.arange(len(stations))
+            walks = np.flatnonzero(position[self._walk_from] >= 0)
+            reached.append(self._walk_to[walks])
+            times.append(arrivals[position[self._walk_from[walks]]] + self._walk_minutes[walks])
+            came_from.append(self._walk_from[walks])
+        reached, times, came_from = np.concatenate(reached), np.concatenate(times), np.concatenate(came_from)
+        return _best_per_station(reached, times, came_from)
+
+    def pareto_journeys(self, day, origins, destinations, depart_after=0, depart_before=1439,
+                        max_transfers=5, allow_station_groups=True):
+        """
+        Return the Pareto set of journeys leaving within [depart_after, depart_before].
+
+        Journeys are lists of connection rows, ordered by departure then by
+        number of transfers.
+        """
+        sources = np.array(sorted(self._station_ids(origins)), dtype=np.int64)
+        targets = np.array(sorted(self._station_ids(destinations)), dtype=np.int64)
+        if len(sources) == 0 or len(targets) == 0:
+            return []
+
+        tt = self.tt
+        rows = self.connections_by_departure(day)
+        rows = rows[np.searchsorted(tt.dep[rows], depart_after, side='left'):]
+        row_origin = tt.origin[rows].astype(np.int64)
+        row_destination = tt.destination[rows].astype(np.int64)
+        row_dep = tt.dep[rows].astype(np.int64)
+        row_arr = self.arr_abs[rows].astype(np.int64)
+
+        from_sources = np.isin(row_origin, sources) & (row_dep <= depart_before)
+        departure_times = np.unique(row_dep[from_sources])[::-1]
+
+        rounds = max_transfers + 1
+        n_stations = len(tt.stations)
+        arrival = np.full((rounds + 1, n_stations), INFINITY, dtype=np.int64)
+        arrived_by = np.full((rounds + 1, n_stations), -1, dtype=np.int64)
+        ready = np.full((rounds + 1, n_stations), INFINITY, dtype=np.int64)
+        ready_from = np.full((rounds + 1, n_stations), -1, dtype=np.int64)
+        best_at_target = np.full(rounds + 1, INFINITY, dtype=np.int64)
+
+        found = []
+        for departure in departure_times.tolist():
+            ready[0, sources] = departure
+            marked = np.zeros(n_stations, dtype=bool)
+            marked[sources] = True
+            start = np.searchsorted(row_dep, departure, side='left')
+            for k in range(1, rounds + 1):
+                candidates = start + np.flatnonzero(
+                    marked[row_origin[start:]] & (row_dep[start:] >= ready[k - 1, row_origin[start:]])
+                )
+                if k == 1:
+                    # The first train is the one that has to leave within the window
+                    candidates = candidates[row_dep[candidates] <= depart_before]
+                # Target pruning: nothing arriving after the best known arrival can be Pareto-optimal
+                candidates = candidates[row_arr[candidates] < best_at_target[:k + 1].min()]
+                if len(candidates) == 0:
+                    break
+                stations, times, best_rows = _best_per_station(
+                    row_destination[candidates], row_arr[candidates], candidates
+                )
+                improved = times < arrival[k, stations]
+                stations, times, best_rows = stations[improved], times[improved], best_rows[improved]
+                if len(stations) == 0:
+                    break
+                arrival[k, stations] = times
+                arrived_by[k, stations] = rows[best_rows]
+
+                at_targets = arrival[k, targets]
+                if at_targets.min() < best_at_target[k]:
+                    best_at_target[k] = at_targets.min()
+                    target = int(targets[np.argmin(at_targets)])
+                    found.append(self._reconstruct(k, target, arrived_by, ready_from))
+
+                reached, ready_times, came_from = self._ready_times(stations, times, allow_station_groups)
+                better = ready_times < ready[k, reached]
+                reached = reached[better]
+                ready[k, reached] = ready_times[better]
+                ready_from[k, reached] = came_from[better]
+                marked = np.zeros(n_stations, dtype=bool)
+                marked[reached] = True
+                if not marked.any():
+                    break
+
+        return self._pareto_filter(found)
+
+    def _reconstruct(self, k, station, arrived_by, ready_from):
+        legs = []
+        while k > 0:
+            row = int(arrived_by[k, station])
+            legs.append(row)
+            k -= 1
+            if k > 0:
+                station = int(ready_from[k, self.tt.origin[row]])
+        legs.reverse()
+        return legs
+
+    def _pareto_filter(self, journeys):
+        """Drop journeys beaten on departure, arrival and transfers by another one."""
+        labelled = sorted(
+            {(int(self.tt.dep[legs[0]]), int(self.arr_abs[legs[-1]]), len(legs)): legs for legs in journeys}.items()
+        )
+        kept = []
+        for (departure, arrival_time, n_legs), legs in labelled:
+            dominated = any(
+                other_dep >= departure and other_arr <= arrival_time and other_legs <= n_legs
+                and (other_dep, other_arr, other_legs) != (departure, arrival_time, n_legs)
+                for (other_dep, other_arr, other_legs), _ in labelled
+            )
+            if not dominated:
+                kept.append(legs)
+        return kept
+
+
+def _best_per_station(stations, times, payload):
+    """Keep, for each station, the smallest time and its payload."""
+    order = np.lexsort((times, stations))
+    stations, times, payload = stations[order], times[order], payload[order]
+    first = np.ones(len(stations), dtype=bool)
+    first[1:] = stations[1:] != stations[:-1]
+    return stations[first], times[first], payload[first]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router(tt, transfers=()):
+    """Return the router for `tt`, building a new one when the timetable is reloaded."""
+    global _router
+    router = _router
+    if router is not None and router.tt is tt:
+        return router
+    with _router_lock:
+        if _router is None or _router.tt is not tt:
+            _router = RaptorRouter(tt, transfers)
+        return _router
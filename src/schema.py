@@ -0,0 +1,294 @@
+"""
+Typed, dictionary-encoded storage schema for the TGVMAX dataset.
+
+Station names live once in the `stations` table; trips reference them by
+integer id and store day numbers (days since 1970-01-01) and minutes since
+midnight instead of text. The `TGVMAX_TEXT` view decodes rows back to the
+columns of the SNCF export for ad hoc queries and maintenance scripts.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Columns of the SNCF export that are kept, after renaming od_happy_card to DISPO
+EXPORT_COLUMNS = ['date', 'train_no', 'entity', 'axe', 'origine_iata', 'destination_iata',
+                  'origine', 'destination', 'heure_depart', 'heure_arrivee', 'DISPO']
+
+# Descriptive columns the encoder tolerates missing
+OPTIONAL_EXPORT_COLUMNS = ['entity', 'origine_iata', 'destination_iata']
+
+TRIP_COLUMNS = ['UID', 'day', 'train_no', 'entity', 'axe', 'origin_id', 'dest_id', 'dep_min', 'arr_min', 'dispo']
+
+# TGVMAX_RAW keeps the last export as received (before fare-rule fixes), so the
+# next export can be diffed against it row by row on its natural key
+RAW_TABLE = 'TGVMAX_RAW'
+RAW_COLUMNS = TRIP_COLUMNS + ['row_hash']
+NATURAL_KEY = ['day', 'train_no', 'origin_id', 'dest_id']
+ROW_HASH_COLUMNS = ['dep_min', 'arr_min', 'dispo', 'entity', 'axe']
+
+STATIONS_DDL = """
+CREATE TABLE stations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    iata TEXT
+)
+"""
+
+TRIPS_DDL = """
+CREATE TABLE {table} (
+    UID INTEGER PRIMARY KEY,
+    day INTEGER NOT NULL,
+    train_no INTEGER NOT NULL,
+    entity TEXT,
+    axe TEXT,
+    origin_id INTEGER NOT NULL,
+    dest_id INTEGER NOT NULL,
+    dep_min INTEGER NOT NULL,
+    arr_min INTEGER NOT NULL,
+    dispo INTEGER NOT NULL{extra_columns}
+)
+"""
+
+RAW_EXTRA_COLUMNS = """,
+    row_hash INTEGER NOT NULL"""
+
+INDEXES_DDL = [
+    "CREATE INDEX idx_{table}_origin ON {table} (origin_id, day, dep_min)",
+    "CREATE INDEX idx_{table}_dest ON {table} (dest_id, day, arr_min)",
+    "CREATE INDEX idx_{table}_train ON {table} (day, train_no)",
+]
+
+# Stop sequences reconstructed by the fare-rule normalization (arr_min is NULL
+# at the first stop, dep_min at the last)
+TRAIN_STOPS_COLUMNS = ['day', 'train_no', 'position', 'station_id', 'arr_min', 'dep_min']
+
+TRAIN_STOPS_DDL = """
+CREATE TABLE IF NOT EXISTS train_stops (
+    day INTEGER NOT NULL,
+    train_no INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    station_id INTEGER NOT NULL,
+    arr_min INTEGER,
+    dep_min INTEGER,
+    PRIMARY KEY (day, train_no, position)
+) WITHOUT ROWID
+"""
+
+# Day trips materialized at update time, stored as their legs and paired at
+# lookup: leg 0 is an outbound train (origin_id -> dest_id), leg 1 a return
+# train (dest_id -> origin_id), and seq orders each (day, origin_id, leg) as
+# the timetable lists them. Only legs that belong to at least one pair are kept.
+DAY_TRIP_LEGS_COLUMNS = ['day', 'origin_id', 'dest_id', 'leg', 'seq', 'train_no', 'dep_min', 'arr_min', 'axe']
+
+DAY_TRIP_LEGS_DDL = """
+CREATE TABLE IF NOT EXISTS day_trip_legs (
+    day INTEGER NOT NULL,
+    origin_id INTEGER NOT NULL,
+    dest_id INTEGER NOT NULL,
+    leg INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    train_no INTEGER NOT NULL,
+    dep_min INTEGER NOT NULL,
+    arr_min INTEGER NOT NULL,
+    axe TEXT,
+    PRIMARY KEY (day, origin_id, dest_id, leg, seq)
+) WITHOUT ROWID
+"""
+
+NATURAL_KEY_INDEX_DDL = "CREATE INDEX idx_{table}_key ON {table} (day, train_no, origin_id, dest_id)"
+
+TEXT_VIEW_DDL = """
+CREATE VIEW TGVMAX_TEXT AS
+SELECT t.UID,
+       date(t.day * 86400, 'unixepoch') AS date,
+       t.train_no,
+       t.entity,
+       t.axe,
+       o.iata AS origine_iata,
+       d.iata AS destination_iata,
+       o.name AS origine,
+       d.name AS destination,
+       printf('%02d:%02d', t.dep_min / 60, t.dep_min % 60) AS heure_depart,
+       printf('%02d:%02d', t.arr_min / 60, t.arr_min % 60) AS heure_arrivee,
+       CASE t.dispo WHEN 1 THEN 'OUI' ELSE 'NON' END AS DISPO
+FROM TGVMAX t
+JOIN stations o ON o.id = t.origin_id
+JOIN stations d ON d.id = t.dest_id
+"""
+
+
+def hhmm_to_minutes(values):
+    """Convert an array of 'HH:MM' strings to minutes since midnight."""
+    values = np.asarray(values, dtype='U5')
+    if values.size == 0:
+        return np.zeros(0, dtype=np.int16)
+    chars = values.view('U1').reshape(-1, 5)
+    digits = chars[:, [0, 1, 3, 4]].astype(np.int16)
+    return digits[:, 0] * 600 + digits[:, 1] * 60 + digits[:, 2] * 10 + digits[:, 3]
+
+
+def minutes_to_hhmm(minutes):
+    """Format minutes since midnight as 'HH:MM'."""
+    minutes = int(minutes) % 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def date_to_day(value):
+    """Convert a 'YYYY-MM-DD' string (or date/datetime) to a day number since 1970-01-01."""
+    if hasattr(value, 'strftime'):
+        value = value.strftime('%Y-%m-%d')
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+def day_to_date(day):
+    """Convert a day number back to a 'YYYY-MM-DD' string."""
+    return str(np.datetime64(int(day), 'D'))
+
+
+def normalise_export_columns(export_df):
+    """Rename od_happy_card to DISPO and add missing optional columns, in place."""
+    export_df.rename(columns={"od_happy_card": "DISPO"}, inplace=True)
+    for column in OPTIONAL_EXPORT_COLUMNS:
+        if column not in export_df:
+            export_df[column] = None
+    return export_df
+
+
+def encode_stations(export_df, stations=None):
+    """
+    Return the station dictionary extended with every station of `export_df`.
+
+    `stations` is an existing name -> (id, iata) mapping; new names get the
+    next free ids so previously assigned ids never change.
+    """
+    stations = dict(stations or {})
+    next_id = max((station_id for station_id, _ in stations.values()), default=0) + 1
+    for name_column, iata_column in (('origine', 'origine_iata'), ('destination', 'destination_iata')):
+        names = export_df[[name_column, iata_column]].drop_duplicates(name_column)
+        for name, iata in names.itertuples(index=False):
+            if name not in stations:
+                stations[name] = (next_id, iata)
+                next_id += 1
+    return stations
+
+
+def encode_trips(export_df, stations):
+    """Convert export rows (with a UID column) to the typed TGVMAX_RAW columns."""
+    station_ids = {name: station_id for name, (station_id, _) in stations.items()}
+    trips = pd.DataFrame({
+        'UID': export_df['UID'].to_numpy(dtype=np.int64),
+        'day': pd.to_datetime(export_df['date']).to_numpy().astype('datetime64[D]').astype(np.int64),
+        'train_no': pd.to_numeric(export_df['train_no'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64),
+        'entity': export_df['entity'].to_numpy(),
+        'axe': export_df['axe'].to_numpy(),
+        'origin_id': export_df['origine'].map(station_ids).to_numpy(dtype=np.int64),
+        'dest_id': export_df['destination'].map(station_ids).to_numpy(dtype=np.int64),
+        'dep_min': hhmm_to_minutes(export_df['heure_depart'].to_numpy(dtype=str)).astype(np.int64),
+        'arr_min': hhmm_to_minutes(export_df['heure_arrivee'].to_numpy(dtype=str)).astype(np.int64),
+        'dispo': (export_df['DISPO'] == 'OUI').to_numpy(dtype=np.int64),
+    }, columns=TRIP_COLUMNS)
+    trips['row_hash'] = pd.util.hash_pandas_object(trips[ROW_HASH_COLUMNS], index=False).to_numpy().view(np.int64)
+    return trips
+
+
+def load_stations(conn):
+    """The current station dictionary as a name -> (id, iata) mapping."""
+    return {name: (station_id, iata) for station_id, name, iata
+            in conn.execute(text("SELECT id, name, iata FROM stations"))}
+
+
+def stations_frame(stations):
+    """The station dictionary as rows of the `stations` table."""
+    return pd.DataFrame(
+        [(station_id, name, iata) for name, (station_id, iata) in stations.items()],
+        columns=['id', 'name', 'iata'],
+    ).sort_values('id')
+
+
+def create_staging_table(conn, table):
+    """Create an empty table with the TGVMAX_RAW columns (no indexes), replacing any previous one."""
+    conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    conn.execute(text(TRIPS_DDL.format(table=table, extra_columns=RAW_EXTRA_COLUMNS)))
+
+
+def create_indexes(conn, table='TGVMAX'):
+    """Create the composite lookup indexes on a trips table."""
+    for ddl in INDEXES_DDL:
+        conn.execute(text(ddl.format(table=table)))
+
+
+def drop_schema(conn):
+    """Drop the dataset tables and view, typed or legacy."""
+    conn.execute(text("DROP VIEW IF EXISTS TGVMAX_TEXT"))
+    conn.execute(text("DROP TABLE IF EXISTS TGVMAX"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {RAW_TABLE}"))
+    conn.execute(text("DROP TABLE IF EXISTS train_stops"))
+    conn.execute(text("DROP TABLE IF EXISTS day_trips"))
+    conn.execute(text("DROP TABLE IF EXISTS day_trip_legs"))
+    conn.execute(text("DROP TABLE IF EXISTS stations"))
+
+
+def publish_staging(conn, staging_table, stations):
+    """
+    Replace the live dataset with a fully loaded staging trips table.
+
+    Runs inside the caller's transaction: the staging table becomes
+    TGVMAX_RAW, TGVMAX is filled from it, the station dictionary is written
+    and the indexes and the text view are built once, on the final tables.
+    """
+    columns = ', '.join(TRIP_COLUMNS)
+    drop_schema(conn)
+    conn.execute(text(STATIONS_DDL))
+    stations_frame(stations).to_sql('stations', con=conn, index=False, if_exists='append')
+    conn.execute(text(f"ALTER TABLE {staging_table} RENAME TO {RAW_TABLE}"))
+    conn.execute(text(NATURAL_KEY_INDEX_DDL.format(table=RAW_TABLE)))
+    conn.execute(text(TRIPS_DDL.format(table='TGVMAX', extra_columns='')))
+    conn.execute(text(f"INSERT INTO TGVMAX ({columns}) SELECT {columns} FROM {RAW_TABLE}"))
+    create_indexes(conn)
+    conn.execute(text(TEXT_VIEW_DDL))
+
+
+def write_dataset(export_df, engine):
+    """
+    Replace the dataset with `export_df` (SNCF export columns plus UID).
+
+    Everything happens in one transaction; indexes are built after the bulk insert.
+    """
+    stations = encode_stations(export_df)
+    trips = encode_trips(export_df, stations)
+    with engine.begin() as conn:
+        create_staging_table(conn, 'TGVMAX_staging')
+        trips.to_sql('TGVMAX_staging', con=conn, index=False, if_exists='append', chunksize=50_000)
+        publish_staging(conn, 'TGVMAX_staging', stations)
+    return {'stations': len(stations), 'trips': len(trips)}
+
+
+def has_raw_snapshot(engine):
+    """True when the database holds a typed dataset with its TGVMAX_RAW export snapshot."""
+    with engine.connect() as conn:
+        tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    return {'TGVMAX', RAW_TABLE, 'stations'} <= tables and not is_legacy_schema(engine)
+
+
+def is_legacy_schema(engine):
+    """True when TGVMAX still has the text columns of the raw SNCF export."""
+    with engine.connect() as conn:
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(TGVMAX)"))]
+    return 'origine' in columns
+
+
+def migrate_legacy_schema(engine):
+    """Convert a database written by the former to_sql ingest to the typed schema, in place."""
+    if not is_legacy_schema(engine):
+        return False
+    logger.info("🔄 Migrating TGVMAX to the typed schema...")
+    with engine.connect() as conn:
+        legacy_df = normalise_export_columns(pd.read_sql(text("SELECT * FROM TGVMAX"), conn))
+    result = write_dataset(legacy_df, engine)
+    logger.info("✅ Migrated %d trips and %d stations to the typed schema", result['trips'], result['stations'])
+    return True
@@ -0,0 +1,151 @@
+"""
+Timetable arrays in POSIX shared memory, shared by all worker processes.
+
+Under a preforking server every worker would otherwise load and sort its
+own copy of the timetable. Instead, the first worker to see a dataset
+builds it once and publishes its arrays in a read-only shared-memory
+segment named after the database signature; the other workers map that
+segment and wrap zero-copy NumPy views around it.
+
+A new snapshot changes the signature, so the next request of each worker
+attaches (or publishes) the new segment without a restart. The publisher
+unlinks the previous segment: workers still holding it keep a valid
+mapping until they switch, after which the memory is released.
+
+Segments use the binary snapshot layout of src/timetable_file.py. When
+the dataset has a binary snapshot file, mapping that file already shares
+its pages between workers and no segment is needed.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from src import timetable, timetable_file
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'tgvmax_tt_'
+
+# Segments mapped by this process, by name; stale ones are closed once unused
+_attached = {}
+_attached_lock = threading.Lock()
+_current = None
+
+
+def segment_name(signature):
+    """Segment name for a database signature (see timetable._database_signature)."""
+    return SEGMENT_PREFIX + hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16]
+
+
+def _untrack(segment):
+    # The resource tracker would unlink the segment when this process exits,
+    # but it outlives any single worker: unlinking is done on replacement.
+    # It registers POSIX segments under their name with the leading slash.
+    try:
+        resource_tracker.unregister('/' + segment.name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def publish(tt, name):
+    """Copy the arrays of `tt` into a new shared-memory segment called `name`."""
+    size, chunks = timetable_file.encode(tt)
+    segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        timetable_file.write_into(segment.buf, chunks)
+    except Exception:
+        segment.close()
+        segment.unlink()
+        raise
+    _untrack(segment)
+    segment.close()
+    return size
+
+
+def attach(name):
+    """The timetable stored in segment `name`, or None if there is no such segment."""
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return None
+    _untrack(segment)
+    _, tt = timetable_file.decode(segment.buf)
+    with _attached_lock:
+        _attached[name] = segment
+    return tt
+
+
+def release_stale():
+    """Close the segments of previous datasets no longer referenced in this process."""
+    if len(_attached) <= 1:
+        return
+    with _attached_lock:
+        for name in [name for name in _attached if name != _current]:
+            try:
+                _attached[name].close()
+            except BufferError:
+                # A request (or the router) still holds the old timetable: retry later
+                continue
+            del _attached[name]
+
+
+@contextmanager
+def _publish_lock(database):
+    """Serialize publishing across processes with a lock file next to the database."""
+    path = os.path.join(os.path.dirname(os.path.abspath(database)), '.timetable.lock')
+    with open(path, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield os.path.join(os.path.dirname(path), '.timetable.segment')
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _replace_segment(registry, name):
+    """Record `name` as the live segment and unlink the one it replaces."""
+    try:
+        with open(registry) as handle:
+            previous = handle.read().strip()
+    except FileNotFoundError:
+        previous = ''
+    with open(registry, 'w') as handle:
+        handle.write(name)
+    if previous and previous != name:
+        try:
+            stale = shared_memory.SharedMemory(name=previous)
+        except FileNotFoundError:
+            return
+        # unlink() also drops the tracker registration made when opening it
+        stale.close()
+        stale.unlink()
+
+
+def load(engine, signature):
+    """
+    The timetable of the database behind `engine`, shared between processes.
+
+    Falls back to a private copy when shared memory is unavailable (no
+    /dev/shm, segment too large for it, ...).
+    """
+    global _current
+    name = segment_name(signature)
+    try:
+        tt = attach(name)
+        if tt is None:
+            with _publish_lock(engine.url.database) as registry:
+                tt = attach(name)
+                if tt is None:
+                    size = publish(timetable.Timetable.from_engine(engine), name)
+                    _replace_segment(registry, name)
+                    logger.info(f"🧠 Published shared timetable {name} ({size / 1e6:.1f} MB)")
+                    tt = attach(name)
+    except OSError as e:
+        logger.warning("⚠️ Shared timetable unavailable (%s), loading a private copy", e)
+        return timetable.Timetable.from_engine(engine)
+    _current = name
+    return tt
@@ -0,0 +1,203 @@
+"""
+Blue/green dataset snapshots.
+
+Every update builds a complete database file under data/snapshots/ while
+the app keeps serving the current one. The live path (data/tgvmax.db) is a
+relative symlink to the active snapshot and is switched with a single
+atomic rename. Each snapshot records its number and build metadata in
+`dataset_meta`; with the revision bumped by in-place edits (past-trip
+removal) it forms the dataset version exposed to caches and HTTP ETags.
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+from sqlalchemy import text
+
+from src import db
+
+logger = logging.getLogger(__name__)
+
+# Previous snapshots kept on disk for rollback and for readers still holding them open
+KEEP_SNAPSHOTS = int(os.environ.get('TGVMAX_KEEP_SNAPSHOTS', '2'))
+
+SNAPSHOT_PATTERN = re.compile(r'tgvmax-v(\d+)\.db$')
+# Files of a snapshot besides its database: the binary timetable (see timetable_file)
+COMPANION_SUFFIXES = ('.timetable',)
+
+META_DDL = """
+CREATE TABLE IF NOT EXISTS dataset_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+
+def snapshot_dir(live_path):
+    return os.path.join(os.path.dirname(os.path.abspath(live_path)), 'snapshots')
+
+
+def _snapshot_numbers(live_path):
+    numbers = []
+    for path in glob.glob(os.path.join(snapshot_dir(live_path), 'tgvmax-v*.db')):
+        match = SNAPSHOT_PATTERN.search(path)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+class Snapshot:
+    """A dataset file being built, not yet visible to readers."""
+
+    def __init__(self, live_path, number):
+        self.live_path = live_path
+        self.number = number
+        self.path = os.path.join(snapshot_dir(live_path), f'tgvmax-v{number}.db')
+        self.engine = db.create_engine(self.path)
+
+    def discard(self):
+        """Delete a snapshot that failed to build."""
+        self.engine.dispose()
+        companions = [os.path.splitext(self.path)[0] + suffix for suffix in COMPANION_SUFFIXES]
+        for path in [self.path, self.path + '-journal', self.path + '-wal', self.path + '-shm'] + companions:
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info("🗑️ Discarded snapshot v%d", self.number)
+
+
+def create_snapshot(engine, copy_live=False):
+    """
+    Allocate the next snapshot file next to the live database.
+
+    With `copy_live` the snapshot starts as a consistent copy of the live
+    dataset (for incremental updates); otherwise it starts empty.
+    """
+    live_path = engine.url.database
+    os.makedirs(snapshot_dir(live_path), exist_ok=True)
+    number = max(_snapshot_numbers(live_path) + [read_meta(engine).get('snapshot', 0)]) + 1
+    snapshot = Snapshot(live_path, number)
+    if copy_live and os.path.exists(live_path):
+        source = sqlite3.connect(live_path)
+        target = sqlite3.connect(snapshot.path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    logger.info("🧱 Building snapshot v%d at %s", number, snapshot.path)
+    return snapshot
+
+
+def write_meta(conn, values):
+    """Upsert `values` into dataset_meta (values are stored as text)."""
+    conn.execute(text(META_DDL))
+    for key, value in values.items():
+        conn.execute(text("INSERT OR REPLACE INTO dataset_meta (key, value) VALUES (:key, :value)"),
+                     {"key": key, "value": str(value)})
+
+
+def read_meta(engine):
+    """dataset_meta as a dict; snapshot and revision are ints (0 when missing)."""
+    try:
+        with engine.connect() as conn:
+            meta = dict(conn.execute(text("SELECT key, value FROM dataset_meta")).fetchall())
+    except Exception:
+        meta = {}
+    for key in ('snapshot', 'revision'):
+        meta[key] = int(meta.get(key, 0))
+    return meta
+
+
+def bump_revision(conn):
+    """Mark an in-place change of the live dataset, inside the caller's transaction."""
+    conn.execute(text(META_DDL))
+    conn.execute(text("INSERT OR IGNORE INTO dataset_meta (key, value) VALUES ('revision', '0')"))
+    conn.execute(text("UPDATE dataset_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'revision'"))
+    conn.execute(text("INSERT OR REPLACE INTO dataset_meta (key, value) VALUES ('updated_at', :now)"),
+                 {"now": datetime.now().isoformat(timespec='seconds')})
+
+
+def format_version(meta):
+    return f"{meta['snapshot']}.{meta['revision']}"
+
+
+def publish(engine, snapshot, build_info):
+    """
+    Record the build metadata and atomically point the live path at `snapshot`.
+
+    Returns the new dataset version. Older snapshots beyond KEEP_SNAPSHOTS
+    are removed; processes that still have them open keep reading them
+    until they notice the switch.
+    """
+    now = datetime.now().isoformat(timespec='seconds')
+    with snapshot.engine.begin() as conn:
+        write_meta(conn, {'snapshot': snapshot.number, 'revision': 0, 'built_at': now, 'updated_at': now,
+                          'build': json.dumps(build_info, default=str)})
+    snapshot.engine.dispose()
+
+    live_path = snapshot.live_path
+    link_target = os.path.relpath(snapshot.path, os.path.dirname(os.path.abspath(live_path)))
+    temporary_link = f"{live_path}.v{snapshot.number}.tmp"
+    if os.path.lexists(temporary_link):
+        os.remove(temporary_link)
+    os.symlink(link_target, temporary_link)
+    os.replace(temporary_link, live_path)
+    refresh_engine(engine)
+
+    for number in _snapshot_numbers(live_path)[:-KEEP_SNAPSHOTS or None]:
+        if number != snapshot.number:
+            for suffix in ('.db', '.db-wal', '.db-shm') + COMPANION_SUFFIXES:
+                path = os.path.join(snapshot_dir(live_path), f'tgvmax-v{number}{suffix}')
+                if os.path.exists(path):
+                    os.remove(path)
+    version = format_version({'snapshot': snapshot.number, 'revision': 0})
+    logger.info("🔀 Dataset v%s is live (%s)", version, link_target)
+    return version
+
+
+_live_identity = {}
+_version_cache = {}
+_refresh_lock = threading.Lock()
+
+
+def refresh_engine(engine):
+    """
+    Dispose pooled connections once the live path points at another file.
+
+    SQLite connections keep the file they opened, so without this a process
+    would keep serving the previous snapshot after a swap.
+    """
+    path = engine.url.database
+    identity = db.file_state(path)
+    inode = identity[0][0] if identity else None
+    # Engines on the same path (writer and reader) each have their own pool
+    key = (path, id(engine))
+    if _live_identity.get(key) == inode:
+        return False
+    with _refresh_lock:
+        if _live_identity.get(key) == inode:
+            return False
+        # The first call cannot tell which file pooled connections opened, so it resets them too
+        engine.dispose()
+        if key in _live_identity:
+            logger.info("🔄 Live dataset switched, connections reopened")
+        _live_identity[key] = inode
+    return True
+
+
+def dataset_version(engine):
+    """The version of the dataset behind `engine`, cached per file state (WAL included)."""
+    path = engine.url.database
+    identity = db.file_state(path)
+    cached = _version_cache.get(path)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    version = format_version(read_meta(engine))
+    _version_cache[path] = (identity, version)
+    return version
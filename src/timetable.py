@@ -0,0 +1,284 @@
+"""
+In-memory columnar timetable built from the TGVMAX table.
+
+The timetable is loaded once per dataset and answers the hot read paths
+(day trips, connection searches) with NumPy slicing instead of SQL joins.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from src import db
+from src.schema import minutes_to_hhmm
+
+logger = logging.getLogger(__name__)
+
+# Night trains are excluded from every search, so they never enter the timetable
+LOAD_QUERY = """
+    SELECT UID, day, origin_id, dest_id, dep_min, arr_min, train_no, axe
+    FROM TGVMAX
+    WHERE dispo = 1 AND axe != 'IC NUIT'
+"""
+
+STATIONS_QUERY = "SELECT id, name FROM stations"
+
+# Day trips only consider outbound trains leaving from 10:00 on
+EARLIEST_OUTBOUND_DEPARTURE = 10 * 60
+
+# Worker processes share one copy of the timetable in shared memory (see shared_timetable)
+SHARED_TIMETABLE = os.environ.get('TGVMAX_SHARED_TIMETABLE', '0') == '1'
+
+
+class Timetable:
+    """
+    Column arrays of available trips, sorted by (origin, day, departure).
+
+    A second permutation sorts the same rows by (destination, day, arrival),
+    so both "departures from X on D" and "arrivals at X on D" are contiguous
+    slices found with a binary search.
+    """
+
+    def __init__(self, stations, axes, uid, origin, destination, day, dep, arr, train_no, axe):
+        self.stations = np.asarray(stations, dtype=object)
+        self.station_index = {name: i for i, name in enumerate(self.stations) if name is not None}
+        self.axes = np.asarray(axes, dtype=object)
+
+        order = np.lexsort((dep, day, origin))
+        self.uid = np.asarray(uid, dtype=np.int64)[order]
+        self.origin = np.asarray(origin, dtype=np.int32)[order]
+        self.destination = np.asarray(destination, dtype=np.int32)[order]
+        self.day = np.asarray(day, dtype=np.int32)[order]
+        self.dep = np.asarray(dep, dtype=np.int16)[order]
+        self.arr = np.asarray(arr, dtype=np.int16)[order]
+        self.train_no = np.asarray(train_no, dtype=np.int64)[order]
+        self.axe = np.asarray(axe, dtype=np.int16)[order]
+
+        self.first_day = int(self.day.min()) if len(self.day) else 0
+        self.n_days = int(self.day.max()) - self.first_day + 1 if len(self.day) else 1
+
+        self._uid_order = np.argsort(self.uid, kind='stable')
+        self._origin_key = self._key(self.origin, self.day)
+        self.by_destination = np.lexsort((self.arr, self.day, self.destination)).astype(np.int64)
+        self._destination_key = self._key(self.destination, self.day)[self.by_destination]
+
+    # Every array the lookups use, including the derived sort orders and keys
+    ARRAY_FIELDS = ('uid', 'origin', 'destination', 'day', 'dep', 'arr', 'train_no', 'axe',
+                    '_uid_order', '_origin_key', 'by_destination', '_destination_key')
+
+    def __len__(self):
+        return len(self.uid)
+
+    @classmethod
+    def from_arrays(cls, stations, axes, arrays, first_day, n_days):
+        """
+        Rebuild a timetable from the ARRAY_FIELDS of an existing one.
+
+        Nothing is sorted or copied, so the arrays may live in shared or
+        mapped memory.
+        """
+        timetable = cls.__new__(cls)
+        timetable.stations = np.asarray(stations, dtype=object)
+        timetable.station_index = {name: i for i, name in enumerate(timetable.stations) if name is not None}
+        timetable.axes = np.asarray(axes, dtype=object)
+        for field in cls.ARRAY_FIELDS:
+            setattr(timetable, field, arrays[field])
+        timetable.first_day = first_day
+        timetable.n_days = n_days
+        return timetable
+
+    @classmethod
+    def from_engine(cls, engine):
+        """Load every available trip from the database into a new timetable."""
+        start_time = time.perf_counter()
+        with engine.connect() as conn:
+            rows = conn.execute(text(LOAD_QUERY)).fetchall()
+            station_rows = conn.execute(text(STATIONS_QUERY)).fetchall()
+
+        if rows:
+            uid, day, origin, destination, dep, arr, train_no, axe = map(np.asarray, zip(*rows))
+        else:
+            uid = day = origin = destination = dep = arr = train_no = axe = np.zeros(0, dtype=np.int64)
+
+        # Station ids come from the dictionary table, so names index by id directly
+        stations = np.full(max((station_id for station_id, _ in station_rows), default=-1) + 1, None, dtype=object)
+        for station_id, name in station_rows:
+            stations[station_id] = name
+        axes, axe_codes = np.unique(axe.astype(str), return_inverse=True)
+
+        timetable = cls(
+            stations=stations,
+            axes=axes,
+            uid=uid,
+            origin=origin,
+            destination=destination,
+            day=day,
+            dep=dep,
+            arr=arr,
+            train_no=train_no,
+            axe=axe_codes,
+        )
+        logger.info("🗂️ Timetable loaded: %d trips, %d stations (%.3fs)",
+                    len(timetable), len(timetable.station_index), time.perf_counter() - start_time)
+        return timetable
+
+    def _key(self, station, day):
+        return np.asarray(station, dtype=np.int64) * self.n_days + (np.asarray(day, dtype=np.int64) - self.first_day)
+
+    def _day_in_range(self, day):
+        return self.first_day <= day < self.first_day + self.n_days
+
+    def station_id(self, name):
+        """Return the integer id of a station name, or None if it has no trips."""
+        return self.station_index.get(name)
+
+    def rows_for_uids(self, uids):
+        """Row indices of `uids` in one vectorized lookup; -1 where a UID is not in the timetable."""
+        uids = np.asarray(uids, dtype=np.int64)
+        if len(self.uid) == 0:
+            return np.full(len(uids), -1, dtype=np.int64)
+        sorted_uids = self.uid[self._uid_order]
+        positions = np.minimum(np.searchsorted(sorted_uids, uids), len(sorted_uids) - 1)
+        return np.where(sorted_uids[positions] == uids, self._uid_order[positions], -1)
+
+    def leg(self, row):
+        """API representation of a trip: [origine, heure_depart, destination, heure_arrivee, train_no]."""
+        return [
+            self.stations[self.origin[row]],
+            minutes_to_hhmm(self.dep[row]),
+            self.stations[self.destination[row]],
+            minutes_to_hhmm(self.arr[row]),
+            int(self.train_no[row]),
+        ]
+
+    def departures(self, station_id, day):
+        """Row indices of trips leaving `station_id` on `day`, ordered by departure time."""
+        if station_id is None or not self._day_in_range(day):
+            return np.zeros(0, dtype=np.int64)
+        key = self._key(station_id, day)
+        lo = np.searchsorted(self._origin_key, key, side='left')
+        hi = np.searchsorted(self._origin_key, key, side='right')
+        return np.arange(lo, hi, dtype=np.int64)
+
+    def arrivals(self, station_id, day):
+        """Row indices of trips reaching `station_id` on `day`, ordered by arrival time."""
+        if station_id is None or not self._day_in_range(day):
+            return np.zeros(0, dtype=np.int64)
+        key = self._key(station_id, day)
+        lo = np.searchsorted(self._destination_key, key, side='left')
+        hi = np.searchsorted(self._destination_key, key, side='right')
+        return self.by_destination[lo:hi]
+
+    def day_trip_pairs(self, station, outbound_day, return_day, earliest_departure=EARLIEST_OUTBOUND_DEPARTURE):
+        """
+        Join outbound trips from `station` with return trips back to it.
+
+        Mirrors the former SQL self-join: the outbound leg leaves at or after
+        `earliest_departure` (the SQL compared 'HH:MM' text against 10, which
+        kept departures from 10:00 on) and the return leg must leave the
+        outbound destination after the outbound arrival. Pairs come back
+        ordered by the hour gap between outbound arrival and return departure,
+        largest first.
+        """
+        return self.day_trip_pairs_many([station], outbound_day, return_day, earliest_departure)
+
+    def day_trip_pairs_many(self, stations, outbound_day, return_day, earliest_departure=EARLIEST_OUTBOUND_DEPARTURE):
+        """
+        day_trip_pairs for several origin stations in one join.
+
+        Pairs are grouped by origin in the order of `stations` (unknown names
+        are skipped), each group ordered as day_trip_pairs orders it; the
+        origin of a pair is self.origin[out_idx].
+        """
+        station_ids = list(dict.fromkeys(
+            station_id for station_id in map(self.station_id, stations) if station_id is not None))
+        outbound = np.concatenate([self.departures(station_id, outbound_day) for station_id in station_ids]
+                                  or [np.zeros(0, dtype=np.int64)])
+        outbound = outbound[self.dep[outbound] >= earliest_departure]
+        returns = np.concatenate([self.arrivals(station_id, return_day) for station_id in station_ids]
+                                 or [np.zeros(0, dtype=np.int64)])
+        if len(outbound) == 0 or len(returns) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+
+        # Group return legs by (home station, origin) so each outbound leg matches a contiguous range;
+        # the stable sort keeps them in arrival order within a group
+        n_stations = len(self.stations)
+        return_keys = self.destination[returns].astype(np.int64) * n_stations + self.origin[returns]
+        by_key = np.argsort(return_keys, kind='stable')
+        returns, return_keys = returns[by_key], return_keys[by_key]
+        outbound_keys = self.origin[outbound].astype(np.int64) * n_stations + self.destination[outbound]
+        lo = np.searchsorted(return_keys, outbound_keys, side='left')
+        hi = np.searchsorted(return_keys, outbound_keys, side='right')
+        counts = hi - lo
+
+        out_idx = np.repeat(outbound, counts)
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        ret_idx = returns[np.arange(counts.sum()) + starts]
+
+        keep = self.arr[out_idx] < self.dep[ret_idx]
+        out_idx, ret_idx = out_idx[keep], ret_idx[keep]
+
+        # Origins stay in the order of `stations`, then the largest hour gap comes first
+        origin_rank = np.zeros(n_stations, dtype=np.int64)
+        origin_rank[station_ids] = np.arange(len(station_ids))
+        gap_hours = self.dep[ret_idx] // 60 - self.arr[out_idx] // 60
+        order = np.lexsort((-gap_hours, origin_rank[self.origin[out_idx]]))
+        return out_idx[order], ret_idx[order]
+
+
+# (database signature, Timetable) of the current dataset, replaced as a whole
+_loaded = None
+_timetable_lock = threading.Lock()
+
+
+def _database_signature(engine):
+    """Cheap fingerprint of the database file and its WAL, used to notice dataset changes."""
+    path = engine.url.database
+    state = db.file_state(path)
+    return None if state is None else (path,) + state
+
+
+def _load(engine, signature):
+    """The binary snapshot when it is current, else a shared or private copy built from SQLite."""
+    from src import timetable_file
+    mapped = timetable_file.load(engine)
+    if mapped is not None:
+        return mapped
+    if SHARED_TIMETABLE:
+        # Attach the copy published by another worker, or publish one
+        from src import shared_timetable
+        return shared_timetable.load(engine, signature)
+    return Timetable.from_engine(engine)
+
+
+def get_timetable(engine):
+    """Return the shared timetable, rebuilding it when the database file changes."""
+    global _loaded
+    signature = _database_signature(engine)
+    # Read the global once: a concurrent reload replaces it between two reads
+    loaded = _loaded
+    if loaded is not None and loaded[0] == signature:
+        if SHARED_TIMETABLE:
+            # Unmap the previous dataset once its last request is done
+            from src import shared_timetable
+            shared_timetable.release_stale()
+        return loaded[1]
+    with _timetable_lock:
+        loaded = _loaded
+        if loaded is None or loaded[0] != signature:
+            # Requests keep using the previous timetable until the new one is ready
+            loaded = (signature, _load(engine, signature))
+            _loaded = loaded
+    return loaded[1]
+
+
+def invalidate_timetable():
+    """Drop the cached timetable so the next call reloads it."""
+    global _loaded
+    with _timetable_lock:
+        _loaded = None
@@ -0,0 +1,164 @@
+"""
+Binary timetable snapshots, loaded with mmap.
+
+update_db writes the timetable of each dataset snapshot next to its
+database file (data/snapshots/tgvmax-vN.timetable). Starting a process or
+reloading after a snapshot switch then maps that file instead of querying
+SQLite and sorting: the arrays are NumPy views over the mapping, with no
+parsing or copying, and the pages are shared by every process through the
+page cache.
+
+Layout (little-endian):
+
+- 8 bytes magic, 4 bytes format version, 4 bytes reserved;
+- 8 bytes header length, then the JSON header: dataset version, stations,
+  axes, day range and the dtype/shape/offset of each array;
+- the Timetable.ARRAY_FIELDS arrays at 64-byte aligned offsets.
+
+A file is only used when its dataset version matches the database, so an
+in-place revision without a fresh export falls back to loading from SQLite.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from src import snapshots, timetable
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TGVMAXTT'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sIIQ')
+ALIGN = 64
+SUFFIX = '.timetable'
+
+
+def timetable_path(database):
+    """Binary snapshot of the database file at `database` (symlinks resolved)."""
+    return os.path.splitext(os.path.realpath(database))[0] + SUFFIX
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def encode(tt, dataset_version=None):
+    """
+    Lay out `tt` for writing: (total size, list of (offset, bytes-like)).
+
+    The same layout backs files and shared-memory segments.
+    """
+    arrays = {field: np.ascontiguousarray(getattr(tt, field)) for field in timetable.Timetable.ARRAY_FIELDS}
+    header = {
+        'dataset_version': dataset_version,
+        'stations': [None if station is None else str(station) for station in tt.stations],
+        'axes': [str(axe) for axe in tt.axes],
+        'first_day': int(tt.first_day),
+        'n_days': int(tt.n_days),
+        'arrays': {},
+    }
+    offset = 0
+    for field, array in arrays.items():
+        header['arrays'][field] = [array.dtype.str, list(array.shape), offset]
+        offset = _align(offset + array.nbytes)
+    # Offsets are relative to the end of the header until its size is known;
+    # reserve room for the digits they gain once shifted
+    base = _align(PREAMBLE.size + len(json.dumps(header)) + 32 * len(arrays))
+    for field in arrays:
+        header['arrays'][field][2] += base
+    payload = json.dumps(header).encode('utf-8')
+
+    chunks = [(0, PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(payload))), (PREAMBLE.size, payload)]
+    for field, array in arrays.items():
+        chunks.append((header['arrays'][field][2], array.view(np.uint8).reshape(-1).data))
+    return max(base + offset, 1), chunks
+
+
+def write_into(buffer, chunks):
+    """Copy encoded chunks into a writable buffer of the encoded size."""
+    for offset, data in chunks:
+        buffer[offset:offset + len(data)] = data
+
+
+def decode(buffer):
+    """(header, Timetable) over `buffer`, without copying the arrays."""
+    magic, version, _, length = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"not a version {FORMAT_VERSION} timetable snapshot")
+    header = json.loads(bytes(buffer[PREAMBLE.size:PREAMBLE.size + length]))
+    arrays = {}
+    for field, (dtype, shape, offset) in header['arrays'].items():
+        array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        array.flags.writeable = False
+        arrays[field] = array
+    tt = timetable.Timetable.from_arrays(header['stations'], header['axes'], arrays,
+                                         header['first_day'], header['n_days'])
+    return header, tt
+
+
+def write(tt, path, dataset_version):
+    """Write `tt` to `path` atomically; returns the file size."""
+    size, chunks = encode(tt, dataset_version)
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as handle:
+        handle.truncate(size)
+        for offset, data in chunks:
+            handle.seek(offset)
+            handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    # Processes mapping the previous file keep it until they reload
+    os.replace(temporary, path)
+    return size
+
+
+def export(engine, dataset_version=None):
+    """
+    Write the binary snapshot of the database behind `engine`.
+
+    `dataset_version` defaults to the one recorded in the database; pass it
+    when the snapshot is exported before being published.
+    """
+    start_time = time.perf_counter()
+    dataset_version = dataset_version or snapshots.dataset_version(engine)
+    tt = timetable.Timetable.from_engine(engine)
+    path = timetable_path(engine.url.database)
+    size = write(tt, path, dataset_version)
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"💾 Wrote timetable snapshot v{dataset_version} ({len(tt):,} trips, {size / 1e6:.1f} MB) "
+                f"to {path}, Elapsed: {elapsed:.3f}s")
+    return {'path': path, 'trips': len(tt), 'bytes': size, 'elapsed': elapsed}
+
+
+def refresh(engine):
+    """Re-export after an in-place change, if the dataset already has a binary snapshot."""
+    if os.path.exists(timetable_path(engine.url.database)):
+        return export(engine)
+    return None
+
+
+def load(engine):
+    """The mapped timetable of the database behind `engine`, or None if missing or stale."""
+    path = timetable_path(engine.url.database)
+    try:
+        with open(path, 'rb') as handle:
+            mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        header, tt = decode(mapping)
+    except (ValueError, struct.error) as e:
+        logger.warning("⚠️ Ignoring unreadable timetable snapshot %s: %s", path, e)
+        return None
+    version = snapshots.dataset_version(engine)
+    if header['dataset_version'] != version:
+        logger.info("Timetable snapshot %s is v%s, dataset is v%s: loading from the database",
+                    path, header['dataset_version'], version)
+        return None
+    return tt
@@ -1,7 +1,5 @@
 import pandas as pd
-from sqlalchemy import create_engine, text
-import requests
-from io import StringIO
+from sqlalchemy import text
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
@@ -9,16 +7,78 @@ import numpy as np
 import time
 import os
 import json
+import heapq
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from src import schema, ingest, snapshots, fare_rules, timetable, router, cache, day_trips, timetable_file, db, profiler
 # pd.set_option('display.max_rows', 500)
 # pd.set_option('display.max_columns', 500)
 # from app import destination
 
-engine = create_engine('sqlite:///data/tgvmax.db')
+DATABASE_PATH = 'data/tgvmax.db'
+# Updates and maintenance write through `engine`; searches read through `read_engine`
+engine = db.create_engine(DATABASE_PATH)
+read_engine = db.create_engine(DATABASE_PATH, read_only=True)
 logger = logging.getLogger(__name__)
 
+# Longest itinerary considered by the connection search (number of changes)
+MAX_CONNECTIONS = 5
+
+# Maximum number of UIDs bound in a single IN (...) query
+HYDRATION_BATCH_SIZE = 500
+
+# run_query result shapes; 'iter' fetches ITER_BATCH_SIZE rows at a time
+FETCH_MODES = ('frame', 'rows', 'tuples', 'columns', 'iter')
+ITER_BATCH_SIZE = 1000
+
+# Threads solving the dates of a multi-day connection search concurrently (1 = serial)
+SEARCH_WORKERS = int(os.environ.get('TGVMAX_SEARCH_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+def _get_search_pool():
+    """The process-wide pool bounding concurrent per-date searches, created on first use."""
+    global _search_pool
+    if _search_pool is None:
+        with _search_pool_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search')
+    return _search_pool
+
+def _fan_out(solve, items):
+    """
+    Yield (item, solve(item)) for each of `items`, in order.
+
+    Items are solved on the search pool with at most SEARCH_WORKERS in
+    flight, so results can be consumed while later items are still being
+    solved; a single item, or SEARCH_WORKERS = 1, runs in the caller.
+    """
+    items = list(items)
+    if len(items) <= 1 or SEARCH_WORKERS <= 1:
+        for item in items:
+            yield item, solve(item)
+        return
+    pool = _get_search_pool()
+    pending = deque()
+    upcoming = iter(items)
+    for item in upcoming:
+        pending.append((item, pool.submit(solve, item)))
+        if len(pending) >= SEARCH_WORKERS:
+            break
+    while pending:
+        item, future = pending.popleft()
+        for next_item in upcoming:
+            pending.append((next_item, pool.submit(solve, next_item)))
+            break
+        yield item, future.result()
+
 def format_duration(td):
-    total_minutes = int(td.total_seconds() // 60)
-    
+    return format_minutes(int(td.total_seconds() // 60))
+
+def format_minutes(total_minutes):
+    """Format a number of minutes like '2h49m' (see format_duration)."""
     # Handle negative durations (should not happen in normal cases)
     if total_minutes < 0:
         return "0m"  # Return 0 minutes for invalid durations
@@ -33,6 +93,13 @@ def format_duration(td):
         else:
             return f"{hours}h{minutes}m"
 
+def _parse_hhmm(value, default):
+    """Convert an optional 'HH:MM' string to minutes since midnight."""
+    if not value:
+        return default
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
 def scheduled_task():
     logger.info("Tâche effectuée")
 
@@ -40,7 +107,8 @@ def remove_past_trips(engine=None):
     """
     Remove all trips from TGVMAX table that have already departed (before now).
     Uses single optimized query for better performance.
-    Logs the number of rows removed and the time taken.
+    Logs the number of rows removed and the time taken. The dataset revision
+    is bumped in the same transaction when rows were removed.
     """
     if engine is None:
         from src.utils import engine as default_engine
@@ -48,8 +116,8 @@ def remove_past_trips(engine=None):
         
     start_time = time.perf_counter()
     now = datetime.now()
-    today_str = now.strftime('%Y-%m-%d')
-    current_time_str = now.strftime('%H:%M')
+    today = schema.date_to_day(now)
+    current_minutes = now.hour * 60 + now.minute
 
     try:
         with engine.begin() as conn:
@@ -60,273 +128,179 @@ def remove_past_trips(engine=None):
             # Single optimized deletion query
             delete_query = text("""
                 DELETE FROM TGVMAX 
-                WHERE DATE < :today 
-                   OR (DATE = :today AND heure_depart < :current_time)
+                WHERE day < :today
+                   OR (day = :today AND dep_min < :current_minutes)
             """)
-            conn.execute(delete_query, {"today": today_str, "current_time": current_time_str})
+            conn.execute(delete_query, {"today": today, "current_minutes": current_minutes})
 
             # Count rows after deletion
             result = conn.execute(text("SELECT COUNT(*) FROM TGVMAX"))
             after_count = result.fetchone()[0]
 
             removed = before_count - after_count
+            day_trips.remove_past(conn, today, current_minutes)
+            if removed:
+                snapshots.bump_revision(conn)
             elapsed = time.perf_counter() - start_time
             
             logger.info(f"🧹 Removed {removed} past trips from database. Before: {before_count:,}, After: {after_count:,}, Elapsed: {elapsed:.3f}s")
-            return {"removed": removed, "before": before_count, "after": after_count, "elapsed": elapsed}
-            
+            summary = {"removed": removed, "before": before_count, "after": after_count, "elapsed": elapsed}
+
     except Exception as e:
         elapsed = time.perf_counter() - start_time
         logger.error(f"❌ Error removing past trips: {e}, Elapsed: {elapsed:.3f}s")
         raise
 
+    # The binary timetable snapshot records the revision, so it is rewritten for the new one
+    if removed:
+        timetable_file.refresh(engine)
+    return summary
+
 def test_app_scheduler():
     scheduler = BackgroundScheduler()
     scheduler.add_job(scheduled_task, 'interval', seconds=1)
     scheduler.start()
 
-def update_db(engine):
+def update_db(engine, source=None, incremental=False):
     """
     Complete database update pipeline:
-    1. Download fresh data from SNCF
-    2. Replace existing data
+    1. Stream fresh data from SNCF (or `source`: a URL or local CSV path)
+       into a new snapshot, starting from a copy of the live one with `incremental`
+    2. Replace existing data, or with `incremental` only the trains that changed
     3. Remove past trips
     4. Optimize database (fix inconsistencies and cleanup)
+    5. Materialize the day trips of every station and date
+    6. Write the binary timetable snapshot mapped by the app
+    7. Atomically switch readers to the new snapshot
+    The live dataset is never modified while the update runs.
     """
     overall_start = time.perf_counter()
-    
-    # URL to download the CSV file
-    url = "https://ressources.data.sncf.com/api/explore/v2.1/catalog/datasets/tgvmax/exports/csv"
     logger.info("🚀 Starting complete database update pipeline")
-    logger.info("📥 Downloading fresh data from SNCF...")
-    
-    # Send the GET request to download the file
-    response = requests.get(url)
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        csv_data = StringIO(response.text)
-        logger.info("📊 Data received, processing...")
-        new_data_df = pd.read_csv(csv_data, sep=";")
-        new_data_df.rename(columns={"od_happy_card": "DISPO"}, inplace=True)
-        new_data_df["UID"] = new_data_df.index
-        
-        # Get initial row count
-        initial_rows = len(new_data_df)
+    snapshot = snapshots.create_snapshot(engine, copy_live=incremental)
+
+    # Stage durations, recorded with the snapshot and exported by /metrics
+    stages = {}
+    stage_start = time.perf_counter()
+
+    def end_stage(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        stages[stage] = round(now - stage_start, 3)
+        stage_start = now
+
+    try:
+        if incremental:
+            ingest_result = ingest.ingest_export_incremental(snapshot.engine, source)
+        else:
+            ingest_result = ingest.ingest_export(snapshot.engine, source)
+        end_stage('ingest')
+
+        initial_rows = ingest_result['rows']
         logger.info(f"📋 Downloaded {initial_rows:,} trip records")
-        
-        # Replace database
-        new_data_df.to_sql('TGVMAX', con=engine, index=False, if_exists='replace')
-        logger.info("✅ Database replacement completed")
-        
+
         # Remove past trips
         logger.info("🧹 Removing past trips...")
-        past_trips_result = remove_past_trips(engine)
-        
+        past_trips_result = remove_past_trips(snapshot.engine)
+        end_stage('past_trips')
+
         # Optimize database (fix inconsistencies)
         logger.info("🔧 Starting database optimization...")
-        optimization_result = optimize_database_complete(engine)
-        
-        # Final summary
-        overall_elapsed = time.perf_counter() - overall_start
-        
-        logger.info(f"🎉 Complete database update finished successfully!")
-        logger.info(f"📊 Summary: {optimization_result['final_available']:,} available trips "
-                   f"({optimization_result['final_availability_rate']:.1f}% availability), "
-                   f"total time: {overall_elapsed:.3f}s")
-        
-        return {
-            'downloaded_rows': initial_rows,
-            'past_trips_removed': past_trips_result.get('removed', 0),
-            'optimization_result': optimization_result,
-            'total_time': overall_elapsed,
-            'success': True
-        }
-        
-    else:
-        logger.error(
-            "❌ Failed to download data. Status code: %s", response.status_code
-        )
-        logger.error("Response: %s", response.text)
+        changes = ingest_result.get('changes')
+        if changes is not None:
+            optimization_result = optimize_database_complete(snapshot.engine,
+                                                             trains_table=ingest.AFFECTED_TRAINS_TABLE)
+            ingest.drop_affected_trains(snapshot.engine)
+        else:
+            optimization_result = optimize_database_complete(snapshot.engine)
+        end_stage('optimize')
+
+        # Precompute day trips (only the days that changed on an incremental update)
+        logger.info("🗓️ Materializing day trips...")
+        changed_days = [schema.date_to_day(day) for day in changes['days']] if changes is not None else None
+        day_trips_result = day_trips.materialize(snapshot.engine, days=changed_days)
+        end_stage('day_trips')
+
+        # Mapped by the app on its next reload instead of loading from SQLite
+        logger.info("💾 Writing timetable snapshot...")
+        timetable_file_result = timetable_file.export(
+            snapshot.engine, snapshots.format_version({'snapshot': snapshot.number, 'revision': 0}))
+        end_stage('timetable_file')
+    except ingest.DownloadError as e:
+        snapshot.discard()
+        logger.error("❌ Failed to download data. Status code: %s", e.status_code)
+        logger.error("Response: %s", e.response_text)
         return {
             'success': False,
-            'error': f"HTTP {response.status_code}",
-            'response': response.text
+            'error': f"HTTP {e.status_code}",
+            'response': e.response_text
         }
+    except Exception:
+        snapshot.discard()
+        raise
 
-
-def fix_coupure_non_autorisee(engine=None):
-    """
-    Fix coupure non autorisée by changing DISPO from 'NON' to 'OUI' 
-    for A->B trips where A->C is available and B is intermediate.
-    Production version for main database.
-    """
-    if engine is None:
-        from src.utils import engine as default_engine
-        engine = default_engine
-        
-    start_time = time.perf_counter()
+    version = snapshots.publish(engine, snapshot, {
+        'source': source or 'default',
+        'mode': 'incremental' if changes is not None else 'full',
+        'downloaded_rows': initial_rows,
+        'final_rows': optimization_result['final_available'],
+        'stages': stages,
+    })
+    cache.result_cache.retain_version(version)
+
+    # Final summary
+    overall_elapsed = time.perf_counter() - overall_start
     
-    # Query to find coupure non autorisée cases
-    find_query = text("""
-    WITH unavailable_short AS (
-        SELECT date, train_no, origine as A, destination as B, 
-               heure_depart, heure_arrivee, axe, UID
-        FROM TGVMAX 
-        WHERE DISPO = 'NON'
-    ),
-    available_long AS (
-        SELECT date, train_no, origine as A, destination as C, 
-               heure_depart, heure_arrivee, axe
-        FROM TGVMAX 
-        WHERE DISPO = 'OUI'
-    ),
-    intermediate_stations AS (
-        SELECT DISTINCT date, train_no, origine, destination, 
-               heure_depart, heure_arrivee, axe
-        FROM TGVMAX
-    )
-    SELECT DISTINCT us.UID as short_uid
-    FROM unavailable_short us
-    JOIN available_long al ON (
-        us.date = al.date 
-        AND us.train_no = al.train_no
-        AND us.A = al.A
-        AND us.B != al.C
-    )
-    JOIN intermediate_stations inter ON (
-        us.date = inter.date
-        AND us.train_no = inter.train_no
-        AND us.B = inter.destination
-        AND inter.origine = us.A
-    )
-    WHERE us.heure_depart = al.heure_depart
-      AND inter.heure_arrivee > us.heure_depart
-      AND inter.heure_arrivee < al.heure_arrivee
-      AND us.heure_arrivee = inter.heure_arrivee
-    """)
+    logger.info(f"🎉 Complete database update finished successfully!")
+    logger.info(f"📊 Summary: {optimization_result['final_available']:,} available trips "
+               f"({optimization_result['final_availability_rate']:.1f}% availability), "
+               f"dataset v{version}, total time: {overall_elapsed:.3f}s")
     
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(find_query)
-            uids_to_fix = [row[0] for row in result.fetchall()]
-        
-        if not uids_to_fix:
-            elapsed = time.perf_counter() - start_time
-            logger.info(f"✅ No coupure non autorisée issues found ({elapsed:.3f}s)")
-            return {'found': 0, 'fixed': 0, 'elapsed': elapsed}
-        
-        # Fix all issues in batch
-        with engine.begin() as conn:
-            uid_list = ','.join(map(str, uids_to_fix))
-            batch_update_query = text(f"UPDATE TGVMAX SET DISPO = 'OUI' WHERE UID IN ({uid_list})")
-            result = conn.execute(batch_update_query)
-            fixed_count = result.rowcount
-        
-        elapsed = time.perf_counter() - start_time
-        logger.info(f"🔧 Fixed {fixed_count} coupure non autorisée issues ({elapsed:.3f}s)")
-        
-        return {
-            'found': len(uids_to_fix),
-            'fixed': fixed_count,
-            'elapsed': elapsed
-        }
-        
-    except Exception as e:
-        elapsed = time.perf_counter() - start_time
-        logger.error(f"❌ Error fixing coupure non autorisée: {e} ({elapsed:.3f}s)")
-        raise
+    return {
+        'downloaded_rows': initial_rows,
+        'ingest': ingest_result,
+        'changes': changes,
+        'dataset_version': version,
+        'past_trips_removed': past_trips_result.get('removed', 0),
+        'optimization_result': optimization_result,
+        'day_trips': day_trips_result,
+        'timetable_file': timetable_file_result,
+        'stages': stages,
+        'total_time': overall_elapsed,
+        'success': True
+    }
 
 
-def fix_soudure_non_autorisee_iterative(engine=None):
+def normalize_fare_rules(engine=None, trains_table=None):
     """
-    Fix soudure non autorisée iteratively by changing DISPO from 'NON' to 'OUI' 
-    for A->C trips where both A->B and B->C segments are available.
-    Production version for main database.
+    Fix coupure and soudure non autorisée by setting dispo from 0 (NON) to 1 (OUI)
+    in one set-based pass over reconstructed train stop sequences:
+    - coupure: A->B trips where A->C is available and B is intermediate
+    - soudure: A->C trips where A->B and B->C segments are available (transitively)
+    Production version for main database; `trains_table` limits the fixes
+    to the trains it lists. The stop sequences are kept in train_stops.
     """
     if engine is None:
         from src.utils import engine as default_engine
         engine = default_engine
-        
-    overall_start_time = time.perf_counter()
-    
-    find_query = text("""
-    WITH unavailable_direct AS (
-        SELECT date, train_no, origine as A, destination as C, 
-               heure_depart, heure_arrivee, axe, UID
-        FROM TGVMAX 
-        WHERE DISPO = 'NON'
-    ),
-    available_segments AS (
-        SELECT date, train_no, origine, destination, 
-               heure_depart, heure_arrivee, axe
-        FROM TGVMAX 
-        WHERE DISPO = 'OUI'
-    )
-    SELECT DISTINCT ud.UID as direct_uid
-    FROM unavailable_direct ud
-    JOIN available_segments seg1 ON (
-        ud.date = seg1.date 
-        AND ud.train_no = seg1.train_no
-        AND ud.A = seg1.origine
-        AND seg1.destination != ud.C
-    )
-    JOIN available_segments seg2 ON (
-        ud.date = seg2.date
-        AND ud.train_no = seg2.train_no  
-        AND seg1.destination = seg2.origine
-        AND seg2.destination = ud.C
-    )
-    WHERE seg1.heure_arrivee <= seg2.heure_depart
-    """)
-    
-    total_fixed = 0
-    iteration = 0
-    
+
+    start_time = time.perf_counter()
     try:
-        while iteration < 10:  # Safety limit
-            iteration += 1
-            
-            # Find issues in this iteration
-            with engine.connect() as conn:
-                result = conn.execute(find_query)
-                uids_to_fix = [row[0] for row in result.fetchall()]
-            
-            if not uids_to_fix:
-                break
-            
-            # Fix the issues in batch
-            with engine.begin() as conn:
-                uid_list = ','.join(map(str, uids_to_fix))
-                batch_update_query = text(f"UPDATE TGVMAX SET DISPO = 'OUI' WHERE UID IN ({uid_list})")
-                result = conn.execute(batch_update_query)
-                fixed_count = result.rowcount
-                total_fixed += fixed_count
-            
-            logger.info(f"🔧 Iteration {iteration}: Fixed {fixed_count} soudure non autorisée issues")
-        
-        overall_elapsed = time.perf_counter() - overall_start_time
-        
-        if total_fixed > 0:
-            logger.info(f"✅ Completed soudure fixes: {total_fixed} total issues fixed in {iteration} iterations ({overall_elapsed:.3f}s)")
-        else:
-            logger.info(f"✅ No soudure non autorisée issues found ({overall_elapsed:.3f}s)")
-        
-        return {
-            'total_iterations': iteration,
-            'total_fixed': total_fixed,
-            'elapsed': overall_elapsed
-        }
-        
+        result = fare_rules.normalize_trains(engine, trains_table)
     except Exception as e:
-        elapsed = time.perf_counter() - overall_start_time
-        logger.error(f"❌ Error fixing soudure non autorisée: {e} ({elapsed:.3f}s)")
+        elapsed = time.perf_counter() - start_time
+        logger.error(f"❌ Error normalizing fare rules: {e} ({elapsed:.3f}s)")
         raise
 
+    elapsed = time.perf_counter() - start_time
+    result['elapsed'] = elapsed
+    logger.info(f"🔧 Fixed {result['coupure_fixed']} coupure and {result['soudure_fixed']} soudure "
+                f"non autorisée issues over {result['trains']:,} trains ({elapsed:.3f}s)")
+    return result
+
 
 def cleanup_unavailable_trips(engine=None):
     """
-    Remove all trips with DISPO='NON' from the database.
+    Remove all trips with dispo = 0 (NON) from the database.
     Production version for main database.
     """
     if engine is None:
@@ -341,7 +315,7 @@ def cleanup_unavailable_trips(engine=None):
             result = conn.execute(text("SELECT COUNT(*) FROM TGVMAX"))
             total_before = result.fetchone()[0]
             
-            result = conn.execute(text("SELECT COUNT(*) FROM TGVMAX WHERE DISPO = 'NON'"))
+            result = conn.execute(text("SELECT COUNT(*) FROM TGVMAX WHERE dispo = 0"))
             unavailable_count = result.fetchone()[0]
         
         if unavailable_count == 0:
@@ -351,7 +325,7 @@ def cleanup_unavailable_trips(engine=None):
         
         # Perform cleanup
         with engine.begin() as conn:
-            delete_query = text("DELETE FROM TGVMAX WHERE DISPO = 'NON'")
+            delete_query = text("DELETE FROM TGVMAX WHERE dispo = 0")
             result = conn.execute(delete_query)
             deleted_count = result.rowcount
             
@@ -378,13 +352,14 @@ def cleanup_unavailable_trips(engine=None):
         raise
 
 
-def optimize_database_complete(engine=None):
+def optimize_database_complete(engine=None, trains_table=None):
     """
     Complete database optimization pipeline:
     1. Fix coupure non autorisée
     2. Fix soudure non autorisée  
     3. Clean up unavailable trips
     Production version for main database with comprehensive logging.
+    The fixes only look at the trains listed in `trains_table` when given.
     """
     if engine is None:
         from src.utils import engine as default_engine
@@ -398,21 +373,18 @@ def optimize_database_complete(engine=None):
             result = conn.execute(text("SELECT COUNT(*) FROM TGVMAX"))
             initial_total = result.fetchone()[0]
             
-            result = conn.execute(text("SELECT DISPO, COUNT(*) FROM TGVMAX GROUP BY DISPO"))
+            result = conn.execute(text("SELECT dispo, COUNT(*) FROM TGVMAX GROUP BY dispo"))
             initial_stats = dict(result.fetchall())
             
-            initial_available = initial_stats.get('OUI', 0)
-            initial_unavailable = initial_stats.get('NON', 0)
+            initial_available = initial_stats.get(1, 0)
+            initial_unavailable = initial_stats.get(0, 0)
             initial_rate = (initial_available / initial_total * 100) if initial_total > 0 else 0
         
         logger.info(f"🚀 Starting database optimization: {initial_total:,} trips, "
                    f"{initial_available:,} available ({initial_rate:.1f}%)")
         
-        # Step 1: Fix coupure
-        coupure_result = fix_coupure_non_autorisee(engine)
-        
-        # Step 2: Fix soudure
-        soudure_result = fix_soudure_non_autorisee_iterative(engine)
+        # Steps 1-2: Fix coupure and soudure
+        fare_rules_result = normalize_fare_rules(engine, trains_table)
         
         # Step 3: Cleanup
         cleanup_result = cleanup_unavailable_trips(engine)
@@ -422,10 +394,10 @@ def optimize_database_complete(engine=None):
             result = conn.execute(text("SELECT COUNT(*) FROM TGVMAX"))
             final_total = result.fetchone()[0]
             
-            result = conn.execute(text("SELECT DISPO, COUNT(*) FROM TGVMAX GROUP BY DISPO"))
+            result = conn.execute(text("SELECT dispo, COUNT(*) FROM TGVMAX GROUP BY dispo"))
             final_stats = dict(result.fetchall())
             
-            final_available = final_stats.get('OUI', 0)
+            final_available = final_stats.get(1, 0)
             final_rate = (final_available / final_total * 100) if final_total > 0 else 0
         
         overall_elapsed = time.perf_counter() - overall_start
@@ -442,8 +414,8 @@ def optimize_database_complete(engine=None):
             'initial_available': initial_available,
             'final_available': final_available,
             'new_available_trips': new_available,
-            'coupure_fixes': coupure_result['fixed'],
-            'soudure_fixes': soudure_result['total_fixed'],
+            'coupure_fixes': fare_rules_result['coupure_fixed'],
+            'soudure_fixes': fare_rules_result['soudure_fixed'],
             'trips_deleted': cleanup_result['deleted'],
             'total_time': overall_elapsed,
             'final_availability_rate': final_rate
@@ -455,25 +427,94 @@ def optimize_database_complete(engine=None):
         raise
 
 
-def run_query(query, params=None, engine=engine, as_list=False):
+def run_query(query, params=None, engine=read_engine, as_list=False, fetch='frame'):
+    """
+    Run `query` with `params` and return the result in the `fetch` shape:
+
+    - 'frame': a pandas DataFrame (the default, for scripts and analysis);
+    - 'rows': a list of named rows (tuple-like, with attribute access);
+    - 'tuples': a list of plain tuples straight from the sqlite3 cursor;
+    - 'columns': a dict of NumPy arrays by column name;
+    - 'iter': an iterator of plain tuples, fetched in batches as it is consumed.
+
+    With `as_list`, the first column is returned as a list.
+    """
+    if fetch not in FETCH_MODES:
+        raise ValueError(f"Unknown fetch mode {fetch!r}, expected one of {', '.join(FETCH_MODES)}")
     logger.debug("Running query: %s params=%s", query.strip(), params)
+    if fetch == 'iter':
+        return _iter_query(query, params, engine)
+    start_time = time.perf_counter()
+    result = _fetch(query, params, engine, as_list, fetch)
+    profiler.observe(query, params, time.perf_counter() - start_time,
+                     rows=len(result) if fetch != 'columns' else len(next(iter(result.values()), ())),
+                     explain=_explainer(query, params, engine), database=engine.url.database)
+    return result
+
+
+def _explainer(query, params, engine):
+    """EXPLAIN QUERY PLAN of `query` on a fresh connection, for the profiler."""
+    def explain():
+        with engine.connect() as connection:
+            return connection.connection.driver_connection.execute(
+                'EXPLAIN QUERY PLAN ' + query, params or {}).fetchall()
+    return explain
+
+
+def _fetch(query, params, engine, as_list, fetch):
     with engine.connect() as connection:
-        result = connection.execute(text(query), params or {})
-        if as_list:
-            return [row[0] for row in result.fetchall()]
+        if as_list or fetch in ('tuples', 'columns'):
+            # The sqlite3 cursor accepts the same :name parameters and skips SQLAlchemy rows
+            cursor = connection.connection.driver_connection.execute(query, params or {})
+            rows = cursor.fetchall()
+            if as_list:
+                return [row[0] for row in rows]
+            if fetch == 'tuples':
+                return rows
+            names = [column[0] for column in cursor.description]
+            columns = zip(*rows) if rows else [()] * len(names)
+            return {name: np.asarray(column) for name, column in zip(names, columns)}
+        # The engine hook skips it: run_query profiles the whole fetch itself
+        result = connection.execute(db.statement(query), params or {}, execution_options={'profiled': True})
+        if fetch == 'rows':
+            return result.all()
         return pd.DataFrame(result.fetchall(), columns=result.keys())
 
 
-def get_all_towns():
-    """Return all distinct towns available in the dataset, including station group names."""
+def _iter_query(query, params, engine):
+    """Rows of `query` as plain tuples; the connection is held until the iterator is exhausted or closed."""
+    start_time = time.perf_counter()
+    rows = 0
+    try:
+        with engine.connect() as connection:
+            cursor = connection.connection.driver_connection.execute(query, params or {})
+            while True:
+                batch = cursor.fetchmany(ITER_BATCH_SIZE)
+                if not batch:
+                    return
+                rows += len(batch)
+                yield from batch
+    finally:
+        # Includes the time the consumer spends between batches
+        profiler.observe(query, params, time.perf_counter() - start_time, rows=rows,
+                         explain=_explainer(query, params, engine), source='iter', database=engine.url.database)
+
+
+def get_all_towns(version=None):
+    """
+    Return all distinct towns available in the dataset, including station group names.
+
+    `version` is the dataset version the caller pinned (the current one by default).
+    """
     # Get all individual stations from the database
     query = """
-        SELECT DISTINCT origine AS Town FROM TGVMAX
-        UNION
-        SELECT DISTINCT destination AS Town FROM TGVMAX;
+        SELECT name AS Town FROM stations
+        WHERE id IN (SELECT origin_id FROM TGVMAX UNION SELECT dest_id FROM TGVMAX);
     """
     
-    individual_stations = run_query(query, as_list=True)
+    # Served from the shared result cache, so a restarted process does not rescan TGVMAX
+    individual_stations = cache.result_cache.cached(
+        'towns', version or snapshots.dataset_version(read_engine), {}, lambda: run_query(query, as_list=True))
     
     # Add station group names
     group_names = list(STATION_GROUP_MAPPING.keys())
@@ -515,21 +556,28 @@ def find_optimal_trips(station, dates):
     
     query = f"""
     SELECT *
-    FROM TGVMAX as aller
-    WHERE aller.date in ({date_placeholders}) AND aller.origine = :ville AND axe = "SUD EST" AND aller.destination = "VALENCE TGV" AND DISPO = "OUI";
+    FROM TGVMAX_TEXT
+    WHERE UID IN (
+        SELECT aller.UID
+        FROM TGVMAX as aller
+        WHERE aller.origin_id = (SELECT id FROM stations WHERE name = :ville)
+          AND aller.day in ({date_placeholders})
+          AND aller.dest_id = (SELECT id FROM stations WHERE name = 'VALENCE TGV')
+          AND aller.axe = 'SUD EST' AND aller.dispo = 1
+    );
     """
     
     # Build parameters dictionary
     params = {}
     for i, date in enumerate(dates):
-        params[f'date_{i}'] = date
+        params[f'date_{i}'] = schema.date_to_day(date)
     params['ville'] = station
 
     return run_query(query, params=params, as_list=False)
 
 
-def find_optimal_destinations(station, dates):
-    """Find optimal destinations for round trips from a given station on specified dates."""
+def _trip_dates(dates):
+    """Outbound and return datetimes of a single date or a (date1, date2) pair."""
     # Handle both single date and date pair inputs
     if isinstance(dates, str):
         # Single date provided - use same date for outbound and return
@@ -542,121 +590,245 @@ def find_optimal_destinations(station, dates):
         date2 = datetime.strptime(dates[1], '%Y-%m-%d')
         n_jours = (date2 - date1).days
         logger.info("Planification d'un voyage de %s jours", n_jours)
-    
-    # Check if the station is a group name and expand it
-    if station in STATION_GROUP_MAPPING:
-        # This is a station group, get all individual stations
-        individual_stations = STATION_GROUP_MAPPING[station]
-        logger.info(
-            "Extension du groupe de gares '%s' vers %d gares individuelles",
-            station,
-            len(individual_stations),
-        )
-        
-        # Get trips from all stations in the group
-        all_trips = []
-        for individual_station in individual_stations:
-            station_trips = find_optimal_destinations_single_station(individual_station, date1, date2)
-            all_trips.extend(station_trips)
-        
-        # Sort by time at destination (descending)
-        all_trips.sort(key=lambda x: x['time_at_destination_minutes'], reverse=True)
-        return all_trips
-    else:
-        # This is an individual station
-        return find_optimal_destinations_single_station(station, date1, date2)
+    return date1, date2
 
 
-def find_optimal_destinations_single_station(station, date1, date2):
-    """Find optimal destinations for round trips from a single station on specified dates."""
-    query = """
-    SELECT 
-        aller.destination,
-        aller.heure_depart as outbound_departure,
-        aller.heure_arrivee as outbound_arrival,
-        retour.heure_depart as return_departure,
-        retour.heure_arrivee as return_arrival,
-        aller.train_no as outbound_train,
-        retour.train_no as return_train,
-        aller.axe as outbound_axe,
-        retour.axe as return_axe
-    FROM TGVMAX as aller
-    JOIN (SELECT *
-          FROM TGVMAX 
-          WHERE date = :date2 AND destination = :ville AND DISPO = 'OUI' AND Axe != 'IC NUIT') as retour
-    ON aller.destination = retour.origine
-    WHERE aller.date = :date1 AND aller.DISPO = 'OUI' AND aller.origine = :ville 
-    AND aller.Axe != 'IC NUIT'
-    AND aller.heure_arrivee < retour.heure_depart
-    AND aller.heure_depart > 10
-    ORDER BY (24 - aller.heure_arrivee + retour.heure_depart) DESC
+def find_optimal_destinations(station, dates, version=None):
+    """Find optimal destinations for round trips from a given station on specified dates."""
+    return find_optimal_destinations_many([station], dates, version)[station]
+
+
+def find_optimal_destinations_many(stations, dates, version=None):
     """
-    
-    # Build parameters dictionary
-    params = {
-        'date1': date1.strftime('%Y-%m-%d'),
-        'date2': date2.strftime('%Y-%m-%d'),
-        'ville': station
-    }
+    find_optimal_destinations for several stations (or station groups) at once.
 
-    result = run_query(query, params=params, as_list=False)
-    
-    # Calculate travel times and time at destination
-    trips_data = []
-    for _, row in result.iterrows():
-        # Parse times
-        outbound_depart = datetime.strptime(row['outbound_departure'], '%H:%M')
-        outbound_arrive = datetime.strptime(row['outbound_arrival'], '%H:%M')
-        return_depart = datetime.strptime(row['return_departure'], '%H:%M')
-        return_arrive = datetime.strptime(row['return_arrival'], '%H:%M')
-        
-        # Handle overnight trips (arrival time earlier than departure time)
-        if outbound_arrive < outbound_depart:
-            outbound_arrive += timedelta(days=1)
-        if return_arrive < return_depart:
-            return_arrive += timedelta(days=1)
-        
-        # Handle cases where return departure is before outbound arrival
-        if return_depart < outbound_arrive:
-            return_depart += timedelta(days=1)
-            return_arrive += timedelta(days=1)
-        
-        # Exclude trips where outbound arrival is on the next day (not a valid day trip)
-        if (outbound_arrive - outbound_depart) >= timedelta(days=1):
-            continue
-        # Exclude trips where return departure is not on the same day as outbound departure
-        if return_depart.date() != outbound_depart.date():
-            continue
-        
-        # Calculate travel times
-        outbound_travel_time = outbound_arrive - outbound_depart
-        return_travel_time = return_arrive - return_depart
-        total_travel_time = outbound_travel_time + return_travel_time
-        
-        # Calculate time at destination
-        time_at_destination = return_depart - outbound_arrive
-        
-        trips_data.append({
-            'destination': row['destination'],
-            'outbound_departure': row['outbound_departure'],
-            'outbound_arrival': row['outbound_arrival'],
-            'return_departure': row['return_departure'],
-            'return_arrival': row['return_arrival'],
-            'outbound_train': row['outbound_train'],
-            'return_train': row['return_train'],
-            'outbound_axe': row['outbound_axe'],
-            'return_axe': row['return_axe'],
-            'outbound_travel_time': format_duration(outbound_travel_time),
-            'return_travel_time': format_duration(return_travel_time),
-            'total_travel_time': format_duration(total_travel_time),
-            'time_at_destination': format_duration(time_at_destination),
-            'time_at_destination_minutes': time_at_destination.total_seconds() / 60
+    Groups are expanded and every individual station not already cached is
+    searched in a single batched pass. Returns a dict mapping each of
+    `stations` to its trips, each trip tagged with its `origin` station.
+    Results are cached under `version`, the dataset version the caller
+    pinned (the current one by default).
+    """
+    date1, date2 = _trip_dates(dates)
+
+    members = {}
+    for station in stations:
+        # Check if the station is a group name and expand it
+        if station in STATION_GROUP_MAPPING:
+            members[station] = STATION_GROUP_MAPPING[station]
+            logger.info(
+                "Extension du groupe de gares '%s' vers %d gares individuelles",
+                station,
+                len(members[station]),
+            )
+        else:
+            members[station] = [station]
+    individual_stations = list(dict.fromkeys(name for names in members.values() for name in names))
+
+    params = {'date1': date1.strftime('%Y-%m-%d'), 'date2': date2.strftime('%Y-%m-%d')}
+    per_station = dict(zip(individual_stations, cache.result_cache.cached_many(
+        'destinations', version or snapshots.dataset_version(read_engine), params, 'station', individual_stations,
+        lambda missing: _search_day_trips(missing, date1, date2))))
+
+    results = {}
+    for station in stations:
+        if station in STATION_GROUP_MAPPING:
+            # Get trips from all stations in the group, sorted by time at destination (descending)
+            all_trips = [trip for name in members[station] for trip in per_station[name]]
+            all_trips.sort(key=lambda x: x['time_at_destination_minutes'], reverse=True)
+            results[station] = all_trips
+        else:
+            results[station] = per_station[station]
+    return results
+
+
+def find_optimal_destinations_single_station(station, date1, date2):
+    """Find optimal destinations for round trips from a single station on specified dates."""
+    return _search_day_trips([station], date1, date2)[station]
+
+
+def _search_day_trips(stations, date1, date2):
+    """Day trips from each of the individual `stations`, searched in one pass; a dict by station."""
+    # Same-day trips are precomputed by update_db; other dates search the timetable
+    rows = day_trips.lookup(read_engine, stations, schema.date_to_day(date1)) if date1 == date2 else None
+    if rows is not None:
+        columns = list(zip(*rows)) or [()] * 10
+        origin, destination = (np.asarray(column, dtype=object) for column in columns[0:2])
+        outbound_departure, outbound_arrival, return_departure, return_arrival = (
+            np.asarray(column, dtype=np.int64) for column in columns[2:6])
+        outbound_train, return_train = (np.asarray(column, dtype=np.int64) for column in columns[6:8])
+        outbound_axe, return_axe = (np.asarray(column, dtype=object) for column in columns[8:10])
+    else:
+        tt = timetable.get_timetable(read_engine)
+        out_idx, ret_idx = tt.day_trip_pairs_many(stations, schema.date_to_day(date1), schema.date_to_day(date2))
+        origin = tt.stations[tt.origin[out_idx]]
+        destination = tt.stations[tt.destination[out_idx]]
+        outbound_departure = tt.dep[out_idx].astype(np.int64)
+        outbound_arrival = tt.arr[out_idx].astype(np.int64)
+        return_departure = tt.dep[ret_idx].astype(np.int64)
+        return_arrival = tt.arr[ret_idx].astype(np.int64)
+        outbound_train, return_train = tt.train_no[out_idx], tt.train_no[ret_idx]
+        outbound_axe, return_axe = tt.axes[tt.axe[out_idx]], tt.axes[tt.axe[ret_idx]]
+
+    # All four times are minutes on the same (undated) day, as the former HH:MM parsing did
+    # Handle overnight trips (arrival time earlier than departure time)
+    outbound_arrive = outbound_arrival + 1440 * (outbound_arrival < outbound_departure)
+    return_arrive = return_arrival + 1440 * (return_arrival < return_departure)
+    # Handle cases where return departure is before outbound arrival
+    next_day = 1440 * (return_departure < outbound_arrive)
+    return_depart = return_departure + next_day
+    return_arrive = return_arrive + next_day
+
+    # Exclude trips where outbound arrival is on the next day (not a valid day trip)
+    # and trips where return departure is not on the same day as outbound departure
+    valid = ((outbound_arrive - outbound_departure) < 1440) & (return_depart < 1440)
+
+    # Calculate travel times and time at destination, only for the trips kept
+    keep = np.flatnonzero(valid)
+    outbound_travel_time = (outbound_arrive - outbound_departure)[keep]
+    return_travel_time = (return_arrive - return_depart)[keep]
+    total_travel_time = outbound_travel_time + return_travel_time
+    time_at_destination = (return_depart - outbound_arrive)[keep]
+
+    trips_data = {station: [] for station in stations}
+    for i, row in enumerate(keep.tolist()):
+        trips_data[origin[row]].append({
+            'origin': origin[row],
+            'destination': destination[row],
+            'outbound_departure': schema.minutes_to_hhmm(outbound_departure[row]),
+            'outbound_arrival': schema.minutes_to_hhmm(outbound_arrival[row]),
+            'return_departure': schema.minutes_to_hhmm(return_departure[row]),
+            'return_arrival': schema.minutes_to_hhmm(return_arrival[row]),
+            'outbound_train': int(outbound_train[row]),
+            'return_train': int(return_train[row]),
+            'outbound_axe': outbound_axe[row],
+            'return_axe': return_axe[row],
+            'outbound_travel_time': format_minutes(int(outbound_travel_time[i])),
+            'return_travel_time': format_minutes(int(return_travel_time[i])),
+            'total_travel_time': format_minutes(int(total_travel_time[i])),
+            'time_at_destination': format_minutes(int(time_at_destination[i])),
+            'time_at_destination_minutes': float(time_at_destination[i]),
+            'total_travel_time_minutes': int(total_travel_time[i])
         })
     
     return trips_data
 
 
 
+# Sort keys accepted by aggregate_destinations: (key of a destination summary, descending)
+DESTINATION_SORTS = {
+    'time_at_destination': (lambda summary: summary['max_minutes'], True),
+    'travel_time': (lambda summary: summary['avg_minutes'], False),
+    'departure': (lambda summary: summary['first_departure'], False),
+}
+
+# Sort keys accepted by paginate() for connection results: (key, descending)
+CONNECTION_SORTS = {
+    'departure': (lambda result: _departure_datetime(result), False),
+    'travel_time': (lambda result: result['duration_minutes'], False),
+}
+
+
+def paginate(items, key, limit=None, offset=0, reverse=False):
+    """
+    The `offset`..`offset + limit` slice of `items` sorted by `key`, and the item count.
+
+    With a limit only the first offset + limit items are selected, with a
+    bounded heap instead of a full sort; ties keep their input order either way.
+    """
+    items = list(items)
+    if limit is None:
+        return sorted(items, key=key, reverse=reverse)[offset:], len(items)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(offset + limit, items, key=key)[offset:], len(items)
+
+
+def aggregate_destinations(trips, sort='time_at_destination', limit=None, offset=0):
+    """
+    Group day trips by destination for /get_destinations.
+
+    A first pass over `trips` keeps integer summaries per destination
+    (average travel time, longest time on site, earliest departure); the
+    requested page is then selected by `sort` (a DESTINATION_SORTS key) and
+    only its destinations get their trip and deduplicated leg lists built.
+    Returns (destinations, total number of destinations).
+    """
+    summaries = {}
+    for trip in trips:
+        dest = trip['destination']
+        summary = summaries.get(dest)
+        if summary is None:
+            summary = summaries[dest] = {'destination': dest, 'trips': [], 'travel_minutes': 0,
+                                         'max_minutes': None, 'first_departure': None}
+        summary['trips'].append(trip)
+        summary['travel_minutes'] += trip['total_travel_time_minutes']
+        minutes_at_destination = int(trip['time_at_destination_minutes'])
+        if summary['max_minutes'] is None or minutes_at_destination > summary['max_minutes']:
+            summary['max_minutes'] = minutes_at_destination
+        # 'HH:MM' strings compare like the times they encode
+        if summary['first_departure'] is None or trip['outbound_departure'] < summary['first_departure']:
+            summary['first_departure'] = trip['outbound_departure']
+    for summary in summaries.values():
+        summary['avg_minutes'] = round(summary['travel_minutes'] / len(summary['trips']))
+
+    key, reverse = DESTINATION_SORTS[sort]
+    page, total = paginate(summaries.values(), key, limit=limit, offset=offset, reverse=reverse)
+    return [_destination_details(summary) for summary in page], total
+
+
+def _destination_details(summary):
+    """Response entry of one destination: its trips, deduplicated legs and main axis."""
+    data = {
+        'destination': summary['destination'],
+        'trips': summary['trips'],
+        'outbound_trips': [],
+        'return_trips': [],
+        'avg_travel_time': format_minutes(summary['avg_minutes']),
+        'max_time_at_destination': format_minutes(summary['max_minutes']),
+    }
+    outbound_seen = set()
+    return_seen = set()
+    axes = {}
+    for trip in summary['trips']:
+        outbound_key = (trip['outbound_departure'], trip['outbound_arrival'])
+        if outbound_key not in outbound_seen:
+            outbound_seen.add(outbound_key)
+            data['outbound_trips'].append({
+                'departure': trip['outbound_departure'],
+                'arrival': trip['outbound_arrival'],
+                'train_no': trip['outbound_train'],
+                'axe': trip.get('outbound_axe', 'N/A')
+            })
+        return_key = (trip['return_departure'], trip['return_arrival'])
+        if return_key not in return_seen:
+            return_seen.add(return_key)
+            data['return_trips'].append({
+                'departure': trip['return_departure'],
+                'arrival': trip['return_arrival'],
+                'train_no': trip['return_train'],
+                'axe': trip.get('return_axe', 'N/A')
+            })
+        for key in ('outbound_axe', 'return_axe'):
+            if key in trip:
+                axes[trip[key]] = axes.get(trip[key], 0) + 1
+
+    data['outbound_trips'].sort(key=lambda x: x['departure'])
+    data['return_trips'].sort(key=lambda x: x['departure'])
+    data['main_axe'] = _main_axe(axes)
+    return data
+
+
+def _main_axe(axe_counts):
+    """Most frequent axis; INTERNATIONAL only wins when it is the only one."""
+    if not axe_counts:
+        return None
+    if len(axe_counts) == 1 and 'INTERNATIONAL' in axe_counts:
+        return 'INTERNATIONAL'
+    non_international_axes = {axe: count for axe, count in axe_counts.items() if axe != 'INTERNATIONAL'}
+    if not non_international_axes:
+        return None
+    return max(non_international_axes.items(), key=lambda x: x[1])[0]
+
+
 def preview_query(query, params):
     # This function is only for debugging and should not be used in production
     formatted_query = query
@@ -670,7 +842,101 @@ def preview_query(query, params):
     logger.debug("Requête formatée : %s", formatted_query)
 
 
-def get_trip_connections(dates, origins, destinations, max_connections=0, allow_station_groups=True):
+def get_trip_connections(dates, origins, destinations, max_connections=None, allow_station_groups=True,
+                         arrive_by=None, depart_after=None, depart_before=None, version=None):
+    """
+    Search itineraries between two sets of stations on each of `dates`.
+
+    Results are cached per day under the dataset version (`version` when
+    the caller pinned one), so overlapping date ranges only search the days
+    not seen yet. See _search_trip_connections for the parameters.
+    """
+    params, search = _connection_search(origins, destinations, max_connections, allow_station_groups,
+                                        arrive_by, depart_after, depart_before)
+    per_day = cache.result_cache.cached_per_day('connections', version or snapshots.dataset_version(read_engine),
+                                                params, list(dates), search)
+    result_list = [result for day_results in per_day for result in day_results]
+    result_list.sort(key=_departure_datetime)
+    return result_list
+
+
+def iter_trip_connections(dates, origins, destinations, max_connections=None, allow_station_groups=True,
+                          arrive_by=None, depart_after=None, depart_before=None, sort_key=None, reverse=False,
+                          version=None):
+    """
+    Yield (date, results) for each of `dates` as soon as that date is solved.
+
+    Same search and per-day cache as get_trip_connections; each date's
+    results are sorted by `sort_key` (departure time by default), so only
+    one date's worth of results is held at a time.
+    """
+    params, search = _connection_search(origins, destinations, max_connections, allow_station_groups,
+                                        arrive_by, depart_after, depart_before)
+    version = version or snapshots.dataset_version(read_engine)
+
+    def solve(date):
+        return cache.result_cache.cached_per_day('connections', version, params, [date], search)[0]
+
+    # Later dates are solved on the search pool while earlier ones are being sent
+    for date, results in _fan_out(solve, dates):
+        results.sort(key=sort_key or _departure_datetime, reverse=reverse)
+        yield date, results
+
+
+def _connection_search(origins, destinations, max_connections, allow_station_groups,
+                       arrive_by, depart_after, depart_before):
+    """Normalised cache parameters of a connection search and its per-day search function."""
+    origins = sorted(set(expand_station_groups(origins)))
+    destinations = sorted(set(expand_station_groups(destinations)))
+    params = {
+        'origins': origins,
+        'destinations': destinations,
+        'max_connections': max_connections,
+        'allow_station_groups': bool(allow_station_groups),
+        'arrive_by': None if arrive_by is None else _parse_hhmm(arrive_by, 1439),
+        'depart_after': _parse_hhmm(depart_after, 0),
+        'depart_before': _parse_hhmm(depart_before, 1439),
+    }
+
+    def search(missing_dates):
+        results = _search_trip_connections(missing_dates, origins, destinations, max_connections=max_connections,
+                                           allow_station_groups=allow_station_groups, arrive_by=arrive_by,
+                                           depart_after=depart_after, depart_before=depart_before)
+        date_of_day = {schema.date_to_day(date): date for date in missing_dates}
+        by_date = {date: [] for date in missing_dates}
+        for result in results:
+            by_date[date_of_day[schema.date_to_day(result['date'])]].append(result)
+        return by_date
+
+    return params, search
+
+
+def _search_trip_connections(dates, origins, destinations, max_connections=None, allow_station_groups=True,
+                             arrive_by=None, depart_after=None, depart_before=None):
+    """
+    Search itineraries between two sets of stations on each of `dates`.
+
+    By default a single round-based search returns the Pareto-optimal
+    journeys (later departure, earlier arrival, fewer changes) with at most
+    MAX_CONNECTIONS changes, departing between `depart_after` and
+    `depart_before` ('HH:MM'). `max_connections=0` lists every direct train
+    instead, and `arrive_by` ('HH:MM') returns the latest departure in that
+    window that arrives in time.
+
+    Dates are independent searches: with several dates and SEARCH_WORKERS
+    above 1 each one is solved on the search pool and the results merged
+    in date order, exactly as the serial search orders them.
+    """
+    if len(dates) > 1 and SEARCH_WORKERS > 1:
+        def solve(date):
+            return _search_trip_connections([date], origins, destinations, max_connections=max_connections,
+                                            allow_station_groups=allow_station_groups, arrive_by=arrive_by,
+                                            depart_after=depart_after, depart_before=depart_before)
+
+        result_list = [result for _, results in _fan_out(solve, dates) for result in results]
+        result_list.sort(key=_departure_datetime)
+        return result_list
+
     # Expand "ILE DE FRANCE" to the list of cities
     origins = expand_station_groups(origins)
     destinations = expand_station_groups(destinations)
@@ -685,20 +951,20 @@ def get_trip_connections(dates, origins, destinations, max_connections=0, allow_
 
     # Generate origin condition
     if use_equal_for_origin:
-        origin_condition = f"origine = :origin_0"
+        origin_condition = f"o.name = :origin_0"
     else:
         origin_placeholders = ', '.join([f':origin_{i}' for i in range(len(origins))])
-        origin_condition = f"origine IN ({origin_placeholders})"
+        origin_condition = f"o.name IN ({origin_placeholders})"
 
     # Generate destination condition
     if use_equal_for_destination:
-        destination_condition = f"destination = :destination_0"
+        destination_condition = f"d.name = :destination_0"
     else:
         destination_placeholders = ', '.join([f':destination_{i}' for i in range(len(destinations))])
-        destination_condition = f"destination IN ({destination_placeholders})"
+        destination_condition = f"d.name IN ({destination_placeholders})"
 
     # Build the parameters dictionary
-    params = {'max_connections': max_connections}
+    params = {}
 
     # Add origins to params
     for i, origin in enumerate(origins):
@@ -710,292 +976,145 @@ def get_trip_connections(dates, origins, destinations, max_connections=0, allow_
 
     # Add dates to params
     for i, date in enumerate(dates):
-        params[f'date_{i}'] = date
+        params[f'date_{i}'] = schema.date_to_day(date)
 
-    if max_connections == 0:
-        # ✂️  MUCH simpler query, no recursion at all
+    if max_connections == 0 and arrive_by is None:
+        # Direct trains only: list all of them, dominated or not
         query = f"""
-            SELECT origine, destination, heure_depart AS first_leg_departure,
-                   heure_arrivee AS last_leg_arrival, uid, date
-            FROM   TGVMAX
+            SELECT o.name AS origine, d.name AS destination, t.dep_min AS first_leg_departure,
+                   t.arr_min AS last_leg_arrival, t.UID, t.day
+            FROM   TGVMAX t
+            JOIN   stations o ON o.id = t.origin_id
+            JOIN   stations d ON d.id = t.dest_id
             WHERE  {origin_condition}
               AND  {destination_condition}
-              AND  date IN ({date_placeholders})
-              AND  DISPO='OUI' AND axe!='IC NUIT'
-            ORDER  BY heure_depart;
+              AND  t.day IN ({date_placeholders})
+              AND  t.dispo = 1 AND t.axe != 'IC NUIT'
+            ORDER  BY t.dep_min, t.arr_min, t.UID;
         """
-        result = run_query(query, params=params)
-        
-        # If no direct connections found, try with 1 connection
-        if len(result) == 0:
-            logger.info("No direct connections found, trying with 1 connection")
-            # Fall back to recursive query with max_connections = 1
-            return get_trip_connections(dates, origins, destinations, max_connections=1, allow_station_groups=allow_station_groups)
-        
-        return _post_process_direct_trips(result)
-
-    # Create a CTE for station groups to allow connections within groups
-    station_groups_cte = ""
-    station_group_condition = ""
-    if allow_station_groups and STATION_GROUPS:
-        # Create a simpler approach using UNION ALL for SQLite compatibility
-        group_unions = []
-        for group in STATION_GROUPS:
-            for station_data in group["stations"]:
-                if isinstance(station_data, list):
-                    # New format: [station1, station2, connection_time]
-                    station1, station2, connection_time = station_data[0], station_data[1], station_data[2]
-                    group_unions.append(f"SELECT '{station1}' as station1, '{station2}' as station2, {connection_time} as connection_time")
-                    # Also add reverse direction
-                    group_unions.append(f"SELECT '{station2}' as station1, '{station1}' as station2, {connection_time} as connection_time")
-                else:
-                    # Old format: just station name (for backward compatibility)
-                    pass  # Skip old format for now
-        
-        if group_unions:
-            station_groups_cte = f"""
-            , station_groups AS (
-                {' UNION ALL '.join(group_unions)}
-            )
-            """
-            station_group_condition = """
-                OR
-                -- Connection through station group: both stations are in the same group
-                EXISTS (
-                    SELECT 1 FROM station_groups sg 
-                    WHERE sg.station1 = pr.destination AND sg.station2 = t.origine
-                )
-            """
-
-    query = f"""
-        WITH RECURSIVE filtered AS (
-            SELECT *
-            FROM TGVMAX
-            WHERE date IN ({date_placeholders}) 
-              AND DISPO = 'OUI' 
-              AND axe != 'IC NUIT'
-              AND ({origin_condition} OR {destination_condition})
-        ),
-        possible_routes AS (
-            -- Base case: Direct trips
-            SELECT
-                origine,
-                destination,
-                heure_depart,
-                heure_arrivee,
-                date,
-                0 AS connection_count,
-                heure_depart AS first_leg_departure,
-                heure_arrivee AS last_leg_arrival,
-                CAST(origine || ' -> ' || destination AS TEXT) AS route_description,
-                CAST(uid AS TEXT) AS route_uid
-            FROM filtered
-            WHERE {origin_condition}
-
-            UNION ALL
-
-            -- Recursive case: Trips with connections, limit recursion to max_connections
-            SELECT
-                t.origine,
-                t.destination,
-                t.heure_depart,
-                t.heure_arrivee,
-                t.date,
-                pr.connection_count + 1 AS connection_count,
-                pr.first_leg_departure,
-                t.heure_arrivee AS last_leg_arrival,
-                CAST(
-                    CASE 
-                        WHEN t.origine = pr.destination THEN pr.route_description || ' -> ' || t.destination
-                        ELSE pr.route_description || ' -> ' || t.origine || ' -> ' || t.destination
-                    END AS TEXT
-                ) AS route_description,
-                CAST(pr.route_uid || '-' || t.uid AS TEXT) AS route_uid
-            FROM filtered t
-            JOIN possible_routes pr
-              ON (
-                -- Direct connection: t.origine = pr.destination
-                t.origine = pr.destination{station_group_condition}
-              )
-              AND (
-                -- For direct connections: just check departure time is after arrival
-                (t.origine = pr.destination AND t.heure_depart > pr.last_leg_arrival)
-                OR
-                -- For station group connections: check if there's enough time for the transfer
-                (t.origine != pr.destination AND 
-                 EXISTS (
-                   SELECT 1 FROM station_groups sg 
-                   WHERE sg.station1 = pr.destination AND sg.station2 = t.origine
-                 ) AND
-                 -- Calculate if there's enough time for the transfer
-                 (CAST(SUBSTR(t.heure_depart, 1, 2) AS INTEGER) * 60 + CAST(SUBSTR(t.heure_depart, 4, 2) AS INTEGER)) -
-                 (CAST(SUBSTR(pr.last_leg_arrival, 1, 2) AS INTEGER) * 60 + CAST(SUBSTR(pr.last_leg_arrival, 4, 2) AS INTEGER)) >= 
-                 (SELECT connection_time FROM station_groups sg 
-                  WHERE sg.station1 = pr.destination AND sg.station2 = t.origine LIMIT 1)
-                )
-              )
-              AND t.date = pr.date
-            WHERE pr.connection_count < :max_connections
-        ){station_groups_cte}
-        -- Select only trips that end at the desired destination
-        SELECT
-            origine,
-            destination,
-            first_leg_departure,
-            last_leg_arrival,
-            route_description,
-            connection_count,
-            date, 
-            route_uid
-        FROM possible_routes
-        WHERE {destination_condition}
-        ORDER BY connection_count, first_leg_departure, last_leg_arrival;
-    """
+        return _post_process_direct_trips(run_query(query, params=params, fetch='rows'))
 
-    # Preview the query (optional)
-    preview_query(query, params)
+    # Connection search over the in-memory timetable, one bounded search per date
+    tt = timetable.get_timetable(read_engine)
+    journey_router = router.get_router(tt, STATION_TRANSFERS)
+    max_transfers = MAX_CONNECTIONS if max_connections is None else min(max_connections, MAX_CONNECTIONS)
+    arrive_by_minutes = _parse_hhmm(arrive_by, 1439)
+    depart_after_minutes = _parse_hhmm(depart_after, 0)
+    depart_before_minutes = _parse_hhmm(depart_before, 1439)
 
-    # Run the query
-    result = run_query(query, params=params)
-    logger.info("Nombre de résultats trouvés : %d", len(result))
-
-    # Only increase max_connections if no results found and user didn't specify a limit
-    if len(result) == 0 and max_connections == 0:
-        params['max_connections'] = 1
-        logger.info(
-            "Augmentation du nombre maximum de connexions à %d", params['max_connections']
-        )
-        result = run_query(query, params=params)
-        
-        # Continue increasing until results found or limit reached
-        while len(result) == 0 and params['max_connections'] < 5:
-            params['max_connections'] += 1
-            logger.info(
-                "Augmentation du nombre maximum de connexions à %d",
-                params['max_connections'],
-            )
-            result = run_query(query, params=params)
-    elif len(result) == 0 and max_connections > 0:
-        # If we're already trying with connections but found none, try with more
-        params['max_connections'] = max_connections + 1
-        if params['max_connections'] <= 5:
-            logger.info(
-                "Augmentation du nombre maximum de connexions à %d",
-                params['max_connections'],
-            )
-            result = run_query(query, params=params)
-
-    # Process results for recursive queries
     result_list = []
-    for index, route in result.iterrows():
-        trains = list(map(int, route['route_uid'].split('-')))
-        train_dic = {}
-        train_dic['train_list'] = []
-        prev_station = None
-        for index_train, train in enumerate(trains):
-            query = """
-            SELECT origine, heure_depart, destination, heure_arrivee, train_no
-            FROM TGVMAX
-            WHERE "UID"=:uid
-            """
-            params = {"uid": train}
-            train_info = list(run_query(query, params=params).values[0])
-            # Si ce n'est pas le premier train, vérifier s'il y a un transfert de groupe
-            if prev_station is not None and train_info[0] != prev_station:
-                # Vérifier si prev_station et train_info[0] sont dans le même groupe
-                if are_stations_in_same_group(prev_station, train_info[0]):
-                    # Obtenir le temps de connexion pour le message d'avertissement
-                    connection_time = get_station_connection_time(prev_station, train_info[0])
-                    # Insérer une connexion virtuelle avec le format approprié et le temps de connexion
-                    virtual_leg = [prev_station, '', train_info[0], '', 'Correspondance', connection_time]
-                    train_dic['train_list'].append(virtual_leg)
-            train_dic['train_list'].append(train_info)
-            prev_station = train_info[2]  # destination
-        train_dic['route_name'] = route['route_description']
-        
-        # Calculate total duration by considering all train segments and waiting times
-        total_duration = timedelta()
-        current_time = None
-        filtered_train_list = []
-        last_real_destination = None
-        for train_info in train_dic['train_list']:
-            if len(train_info) >= 5 and train_info[4] != 'Correspondance':
-                # Regular train segment
-                departure_str = train_info[1]
-                arrival_str = train_info[3]
-                if departure_str and arrival_str:
-                    departure_time = datetime.strptime(departure_str, '%H:%M')
-                    arrival_time = datetime.strptime(arrival_str, '%H:%M')
-                    # If this is not the first train, add waiting time between trains
-                    if current_time is not None:
-                        if departure_time < current_time:
-                            departure_time += timedelta(days=1)
-                        waiting_time = departure_time - current_time
-                        total_duration += waiting_time
-                    
-                    # Si ce segment arrive après minuit, on arrête l'itinéraire ici
-                    if arrival_time < departure_time:
-                        # On ajoute la durée complète jusqu'à l'arrivée réelle
-                        arrival_time += timedelta(days=1)
-                        train_duration = arrival_time - departure_time
-                        total_duration += train_duration
-                        filtered_train_list.append(list(train_info))
-                        last_real_destination = train_info[2]
-                        break
-                    # Add train travel time
-                    train_duration = arrival_time - departure_time
-                    total_duration += train_duration
-                    current_time = arrival_time
-                filtered_train_list.append(list(train_info))
-                last_real_destination = train_info[2]
-            else:
-                filtered_train_list.append(list(train_info))
-        # Vérifier que la dernière gare atteinte est bien la destination demandée
-        if last_real_destination is not None and last_real_destination != route['destination']:
-            continue  # Ne pas inclure cet itinéraire
-        train_dic['train_list'] = filtered_train_list
-        train_dic['duration'] = format_duration(total_duration)
-        train_dic['date'] = route['date']
-        result_list.append(train_dic)
+    for date in dates:
+        day = schema.date_to_day(date)
+        if arrive_by is not None:
+            legs = journey_router.latest_departure(day, origins, destinations, arrive_by_minutes,
+                                                   depart_after=depart_after_minutes,
+                                                   depart_before=depart_before_minutes,
+                                                   max_transfers=max_transfers,
+                                                   allow_station_groups=allow_station_groups)
+            journeys = [legs] if legs is not None else []
+        else:
+            journeys = journey_router.pareto_journeys(day, origins, destinations,
+                                                      depart_after=depart_after_minutes,
+                                                      depart_before=depart_before_minutes,
+                                                      max_transfers=max_transfers,
+                                                      allow_station_groups=allow_station_groups)
+        for legs in journeys:
+            result_list.append(_format_journey(tt, date, legs))
+    logger.info("Nombre de résultats trouvés : %d", len(result_list))
 
     # Sort results by departure time (earliest first)
-    def get_departure_datetime(result):
-        """Extract departure date and time for sorting"""
-        from datetime import datetime
-        try:
-            # Get the first train's departure time
-            if result['train_list'] and len(result['train_list']) > 0:
-                first_train = result['train_list'][0]
-                if len(first_train) >= 2 and first_train[1]:  # has departure time
-                    departure_time = first_train[1]  # format: "HH:MM"
-                    date_str = result.get('date', '2025-01-01')  # fallback date
-                    datetime_str = f"{date_str} {departure_time}"
-                    return datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
-            # Fallback: use a very late time if no departure time found
-            return datetime.strptime('2099-12-31 23:59', '%Y-%m-%d %H:%M')
-        except (ValueError, KeyError, IndexError):
-            # Fallback for any parsing errors
-            return datetime.strptime('2099-12-31 23:59', '%Y-%m-%d %H:%M')
-
-    result_list.sort(key=get_departure_datetime)
+    result_list.sort(key=_departure_datetime)
     return result_list
 
-def _post_process_direct_trips(result):
-    """Post-process direct trip results (no connections)"""
-    result_list = []
-    for index, route in result.iterrows():
-        train_dic = {}
-        train_dic['train_list'] = []
-        
-        # Get train details
-        query = """
-        SELECT origine, heure_depart, destination, heure_arrivee, train_no
-        FROM TGVMAX
-        WHERE "UID"=:uid
+def _departure_datetime(result):
+    """Extract departure date and time for sorting"""
+    try:
+        # Get the first train's departure time
+        if result['train_list'] and len(result['train_list']) > 0:
+            first_train = result['train_list'][0]
+            if len(first_train) >= 2 and first_train[1]:  # has departure time
+                departure_time = first_train[1]  # format: "HH:MM"
+                date_str = result.get('date', '2025-01-01')  # fallback date
+                datetime_str = f"{date_str} {departure_time}"
+                return datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
+        # Fallback: use a very late time if no departure time found
+        return datetime.strptime('2099-12-31 23:59', '%Y-%m-%d %H:%M')
+    except (ValueError, KeyError, IndexError):
+        # Fallback for any parsing errors
+        return datetime.strptime('2099-12-31 23:59', '%Y-%m-%d %H:%M')
+
+def _format_journey(tt, date, legs):
+    """Build the API representation of a journey given as timetable row indices."""
+    train_list = []
+    stops = []
+    prev_station = None
+    for row in legs:
+        origine = tt.stations[tt.origin[row]]
+        destination = tt.stations[tt.destination[row]]
+        if prev_station is not None and origine != prev_station:
+            # Transfer between two stations of the same group, outside TGV MAX
+            connection_time = get_station_connection_time(prev_station, origine)
+            train_list.append([prev_station, '', origine, '', 'Correspondance', connection_time])
+        if prev_station is None or origine != prev_station:
+            stops.append(origine)
+        stops.append(destination)
+        train_list.append(tt.leg(row))
+        prev_station = destination
+
+    # Total duration includes the waits between trains; only the last leg may end after midnight
+    departure = int(tt.dep[legs[0]])
+    arrival = int(tt.arr[legs[-1]])
+    if arrival < int(tt.dep[legs[-1]]):
+        arrival += 1440
+    elapsed = arrival - departure
+
+    return {
+        'train_list': train_list,
+        'route_name': ' -> '.join(stops),
+        'duration': format_duration(timedelta(minutes=elapsed)),
+        'duration_minutes': elapsed,
+        'date': date,
+    }
+
+def _hydrate_legs(uids):
+    """
+    Fetch the train details of many trips at once, keyed by UID.
+
+    Trips are read from the in-memory timetable; any UID it does not hold
+    is fetched with a single IN query instead of one query per UID.
+    """
+    uids = [int(uid) for uid in uids]
+    tt = timetable.get_timetable(read_engine)
+    legs = {}
+    for uid, row in zip(uids, tt.rows_for_uids(uids).tolist()):
+        if row >= 0:
+            legs[uid] = tt.leg(row)
+
+    missing = sorted(set(uids) - legs.keys())
+    for start in range(0, len(missing), HYDRATION_BATCH_SIZE):
+        batch = missing[start:start + HYDRATION_BATCH_SIZE]
+        placeholders = ', '.join(f':uid_{i}' for i in range(len(batch)))
+        query = f"""
+        SELECT t.UID, o.name, t.dep_min, d.name, t.arr_min, t.train_no
+        FROM TGVMAX t
+        JOIN stations o ON o.id = t.origin_id
+        JOIN stations d ON d.id = t.dest_id
+        WHERE t.UID IN ({placeholders})
         """
-        params = {"uid": route['UID']}
-        train_info = list(run_query(query, params=params).values[0])
-        train_dic['train_list'].append(train_info)
+        rows = run_query(query, params={f'uid_{i}': uid for i, uid in enumerate(batch)}, fetch='tuples')
+        for uid, origine, dep_min, destination, arr_min, train_no in rows:
+            legs[int(uid)] = [origine, schema.minutes_to_hhmm(dep_min), destination,
+                              schema.minutes_to_hhmm(arr_min), int(train_no)]
+    return legs
+
+def _post_process_direct_trips(rows):
+    """Post-process direct trip rows (origine, destination, ..., UID, day; no connections)"""
+    legs = _hydrate_legs([row.UID for row in rows]) if rows else {}
+    result_list = []
+    for row in rows:
+        origine, destination, date = row.origine, row.destination, schema.day_to_date(row.day)
+        train_info = legs[int(row.UID)]
+        train_dic = {'train_list': [train_info]}
         
         # Calculate duration
         departure_str = train_info[1]
@@ -1007,33 +1126,17 @@ def _post_process_direct_trips(result):
                 arrival_time += timedelta(days=1)
             train_duration = arrival_time - departure_time
             train_dic['duration'] = format_duration(train_duration)
+            train_dic['duration_minutes'] = int(train_duration.total_seconds() // 60)
         else:
             train_dic['duration'] = '0m'
+            train_dic['duration_minutes'] = 0
         
-        train_dic['route_name'] = f"{route['origine']} -> {route['destination']}"
-        train_dic['date'] = route.get('date', '')
+        train_dic['route_name'] = f"{origine} -> {destination}"
+        train_dic['date'] = date
         result_list.append(train_dic)
     
     # Sort results by departure time (earliest first)
-    def get_departure_datetime(result):
-        """Extract departure date and time for sorting"""
-        from datetime import datetime
-        try:
-            # Get the first train's departure time
-            if result['train_list'] and len(result['train_list']) > 0:
-                first_train = result['train_list'][0]
-                if len(first_train) >= 2 and first_train[1]:  # has departure time
-                    departure_time = first_train[1]  # format: "HH:MM"
-                    date_str = result.get('date', '2025-01-01')  # fallback date
-                    datetime_str = f"{date_str} {departure_time}"
-                    return datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
-            # Fallback: use a very late time if no departure time found
-            return datetime.strptime('2099-12-31 23:59', '%Y-%m-%d %H:%M')
-        except (ValueError, KeyError, IndexError):
-            # Fallback for any parsing errors
-            return datetime.strptime('2099-12-31 23:59', '%Y-%m-%d %H:%M')
-
-    result_list.sort(key=get_departure_datetime)
+    result_list.sort(key=_departure_datetime)
     return result_list
 def load_station_groups():
     """Load station groups from the JSON file."""
@@ -1064,6 +1167,15 @@ for group in STATION_GROUPS:
             stations.append(station_data)
     STATION_GROUP_MAPPING[group["group"]] = list(set(stations))  # Remove duplicates
 
+# Walking transfers between stations of a group, in both directions: (from, to, minutes)
+STATION_TRANSFERS = []
+for group in STATION_GROUPS:
+    for station_data in group["stations"]:
+        if isinstance(station_data, list):
+            station1, station2, connection_time = station_data[0], station_data[1], station_data[2]
+            STATION_TRANSFERS.append((station1, station2, connection_time))
+            STATION_TRANSFERS.append((station2, station1, connection_time))
+
 # Create a reverse mapping from station to group for quick lookup
 STATION_TO_GROUP_MAPPING = {}
 for group in STATION_GROUPS:
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Dataset version and timetable signature after writes from another process.
+
+In WAL mode another process's commit only reaches the -wal file, so the
+main database file keeps its inode, mtime and size.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import text
+
+from src import db, snapshots, timetable
+
+BUMP_REVISION = """
+import sys
+sys.path.insert(0, {root!r})
+from src import db, snapshots
+engine = db.create_engine({path!r})
+with engine.begin() as conn:
+    snapshots.bump_revision(conn)
+"""
+
+
+class DatasetVersionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tgvmax-v1.db')
+        self.writer = db.create_engine(self.path)
+        with self.writer.begin() as conn:
+            snapshots.write_meta(conn, {'snapshot': 1, 'revision': 0})
+        self.reader = db.create_engine(self.path, read_only=True)
+
+    def tearDown(self):
+        self.reader.dispose()
+        self.writer.dispose()
+        self.directory.cleanup()
+
+    def bump_in_other_process(self, path=None):
+        script = BUMP_REVISION.format(root=PROJECT_ROOT, path=path or self.path)
+        subprocess.run([sys.executable, '-c', script], check=True)
+
+    def test_revision_bumped_by_another_process(self):
+        # An open reader connection keeps the WAL from being checkpointed into the main file
+        with self.reader.connect() as held:
+            held.execute(text("SELECT COUNT(*) FROM dataset_meta")).fetchall()
+            self.assertEqual(snapshots.dataset_version(self.reader), '1.0')
+
+            self.bump_in_other_process()
+
+            self.assertEqual(snapshots.read_meta(self.reader)['revision'], 1)
+            self.assertEqual(snapshots.dataset_version(self.reader), '1.1')
+
+    def test_timetable_signature_follows_wal(self):
+        with self.reader.connect() as held:
+            held.execute(text("SELECT COUNT(*) FROM dataset_meta")).fetchall()
+            before = timetable._database_signature(self.reader)
+            self.bump_in_other_process()
+            self.assertNotEqual(timetable._database_signature(self.reader), before)
+
+    def test_symlinked_live_database(self):
+        # As published by update_db: the live path links to the snapshot, which owns the -wal file
+        live = os.path.join(self.directory.name, 'tgvmax.db')
+        os.symlink(os.path.basename(self.path), live)
+        reader = db.create_engine(live, read_only=True)
+        try:
+            with reader.connect() as held:
+                held.execute(text("SELECT COUNT(*) FROM dataset_meta")).fetchall()
+                self.assertEqual(snapshots.dataset_version(reader), '1.0')
+                before = timetable._database_signature(reader)
+
+                self.bump_in_other_process(live)
+
+                self.assertFalse(os.path.exists(f"{live}-wal"))
+                self.assertEqual(snapshots.dataset_version(reader), '1.1')
+                self.assertNotEqual(timetable._database_signature(reader), before)
+        finally:
+            reader.dispose()
+
+    def test_missing_database(self):
+        self.assertIsNone(db.file_state(os.path.join(self.directory.name, 'missing.db')))
+
+
+if __name__ == '__main__':
+    unittest.main()
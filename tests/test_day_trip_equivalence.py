@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Day-trip searches against the original implementation, on a small export.
+
+tests/fixtures/tgvmax_sample.csv comes from benchmarks/synthetic.py
+(scale 1, 2 days from 2035-01-08, seed 0), keeping the trains with
+(train_no // 2) % 6 == 0 so both directions of each corridor remain.
+It goes through update_db like a real export.
+
+The reference is the original code, kept here verbatim: the SQL self-join
+on the text TGVMAX table with its iterrows post-processing, the per-station
+group expansion and the destination grouping of /get_destinations. Its SQL
+orders pairs by hour gap only, so results are compared as sets plus the
+sequence of their sort key; the materialized lookup and the timetable
+search are compared exactly.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import mock
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+# Searches must not be served from a cache left by another run
+os.environ['TGVMAX_CACHE_PATH'] = ''
+os.environ.setdefault('TGVMAX_DAY_TRIPS_WORKERS', '1')
+
+import pandas as pd
+
+from src import cache, day_trips, db, schema, utils
+
+FIXTURE = os.path.join(PROJECT_ROOT, 'tests', 'fixtures', 'tgvmax_sample.csv')
+DATES = ['2035-01-08', '2035-01-09']
+GROUP = 'ILE DE FRANCE (toutes gares)'
+
+BASELINE_QUERY = """
+    SELECT
+        aller.destination,
+        aller.heure_depart as outbound_departure,
+        aller.heure_arrivee as outbound_arrival,
+        retour.heure_depart as return_departure,
+        retour.heure_arrivee as return_arrival,
+        aller.train_no as outbound_train,
+        retour.train_no as return_train,
+        aller.axe as outbound_axe,
+        retour.axe as return_axe
+    FROM TGVMAX as aller
+    JOIN (SELECT *
+          FROM TGVMAX
+          WHERE date = :date2 AND destination = :ville AND DISPO = 'OUI' AND Axe != 'IC NUIT') as retour
+    ON aller.destination = retour.origine
+    WHERE aller.date = :date1 AND aller.DISPO = 'OUI' AND aller.origine = :ville
+    AND aller.Axe != 'IC NUIT'
+    AND aller.heure_arrivee < retour.heure_depart
+    AND aller.heure_depart > 10
+    ORDER BY (24 - aller.heure_arrivee + retour.heure_depart) DESC
+    """
+
+BASELINE_FIELDS = ['destination', 'outbound_departure', 'outbound_arrival', 'return_departure', 'return_arrival',
+                   'outbound_train', 'return_train', 'outbound_axe', 'return_axe', 'outbound_travel_time',
+                   'return_travel_time', 'total_travel_time', 'time_at_destination', 'time_at_destination_minutes']
+
+
+def baseline_single_station(conn, station, date1, date2):
+    params = {
+        'date1': date1.strftime('%Y-%m-%d'),
+        'date2': date2.strftime('%Y-%m-%d'),
+        'ville': station
+    }
+    result = pd.read_sql_query(BASELINE_QUERY, conn, params=params)
+
+    trips_data = []
+    for _, row in result.iterrows():
+        outbound_depart = datetime.strptime(row['outbound_departure'], '%H:%M')
+        outbound_arrive = datetime.strptime(row['outbound_arrival'], '%H:%M')
+        return_depart = datetime.strptime(row['return_departure'], '%H:%M')
+        return_arrive = datetime.strptime(row['return_arrival'], '%H:%M')
+
+        if outbound_arrive < outbound_depart:
+            outbound_arrive += timedelta(days=1)
+        if return_arrive < return_depart:
+            return_arrive += timedelta(days=1)
+
+        if return_depart < outbound_arrive:
+            return_depart += timedelta(days=1)
+            return_arrive += timedelta(days=1)
+
+        if (outbound_arrive - outbound_depart) >= timedelta(days=1):
+            continue
+        if return_depart.date() != outbound_depart.date():
+            continue
+
+        outbound_travel_time = outbound_arrive - outbound_depart
+        return_travel_time = return_arrive - return_depart
+        total_travel_time = outbound_travel_time + return_travel_time
+        time_at_destination = return_depart - outbound_arrive
+
+        trips_data.append({
+            'destination': row['destination'],
+            'outbound_departure': row['outbound_departure'],
+            'outbound_arrival': row['outbound_arrival'],
+            'return_departure': row['return_departure'],
+            'return_arrival': row['return_arrival'],
+            'outbound_train': row['outbound_train'],
+            'return_train': row['return_train'],
+            'outbound_axe': row['outbound_axe'],
+            'return_axe': row['return_axe'],
+            'outbound_travel_time': utils.format_duration(outbound_travel_time),
+            'return_travel_time': utils.format_duration(return_travel_time),
+            'total_travel_time': utils.format_duration(total_travel_time),
+            'time_at_destination': utils.format_duration(time_at_destination),
+            'time_at_destination_minutes': time_at_destination.total_seconds() / 60
+        })
+    return trips_data
+
+
+def baseline_destinations(conn, station, dates):
+    date1 = datetime.strptime(dates[0], '%Y-%m-%d')
+    date2 = datetime.strptime(dates[1], '%Y-%m-%d')
+    if station in utils.STATION_GROUP_MAPPING:
+        all_trips = []
+        for individual_station in utils.STATION_GROUP_MAPPING[station]:
+            all_trips.extend(baseline_single_station(conn, individual_station, date1, date2))
+        all_trips.sort(key=lambda x: x['time_at_destination_minutes'], reverse=True)
+        return all_trips
+    return baseline_single_station(conn, station, date1, date2)
+
+
+def parse_time_to_minutes(time_str):
+    hours = 0
+    minutes = 0
+    hour_match = re.search(r'(\d+)h', time_str)
+    if hour_match:
+        hours = int(hour_match.group(1))
+    minute_match = re.search(r'(\d+)m', time_str)
+    if minute_match:
+        minutes = int(minute_match.group(1))
+    return hours * 60 + minutes
+
+
+def format_minutes_to_time(minutes):
+    hours = minutes // 60
+    mins = minutes % 60
+    if hours == 0:
+        return f"{mins}m"
+    elif mins == 0:
+        return f"{hours}h"
+    else:
+        return f"{hours}h{mins}m"
+
+
+def baseline_aggregate(all_trips):
+    grouped_trips = {}
+    for trip in all_trips:
+        dest = trip['destination']
+        if dest not in grouped_trips:
+            grouped_trips[dest] = {
+                'destination': dest,
+                'trips': [],
+                'outbound_trips': [],
+                'return_trips': [],
+                'avg_travel_time': 0,
+                'max_time_at_destination': 0
+            }
+        grouped_trips[dest]['trips'].append(trip)
+
+        outbound_key = f"{trip['outbound_departure']}-{trip['outbound_arrival']}"
+        existing_outbound_keys = [f"{t['departure']}-{t['arrival']}" for t in grouped_trips[dest]['outbound_trips']]
+        if outbound_key not in existing_outbound_keys:
+            grouped_trips[dest]['outbound_trips'].append({
+                'departure': trip['outbound_departure'],
+                'arrival': trip['outbound_arrival'],
+                'train_no': trip['outbound_train'],
+                'axe': trip.get('outbound_axe', 'N/A')
+            })
+
+        return_key = f"{trip['return_departure']}-{trip['return_arrival']}"
+        existing_return_keys = [f"{t['departure']}-{t['arrival']}" for t in grouped_trips[dest]['return_trips']]
+        if return_key not in existing_return_keys:
+            grouped_trips[dest]['return_trips'].append({
+                'departure': trip['return_departure'],
+                'arrival': trip['return_arrival'],
+                'train_no': trip['return_train'],
+                'axe': trip.get('return_axe', 'N/A')
+            })
+
+    for dest_data in grouped_trips.values():
+        travel_times = []
+        times_at_dest = []
+        axes = []
+        for trip in dest_data['trips']:
+            travel_times.append(parse_time_to_minutes(trip['total_travel_time']))
+            times_at_dest.append(parse_time_to_minutes(trip['time_at_destination']))
+            if 'outbound_axe' in trip:
+                axes.append(trip['outbound_axe'])
+            if 'return_axe' in trip:
+                axes.append(trip['return_axe'])
+
+        avg_travel_minutes = round(sum(travel_times) / len(travel_times))
+        max_dest_minutes = max(times_at_dest)
+        dest_data['avg_travel_time'] = format_minutes_to_time(avg_travel_minutes)
+        dest_data['max_time_at_destination'] = format_minutes_to_time(max_dest_minutes)
+
+        dest_data['outbound_trips'].sort(key=lambda x: x['departure'])
+        dest_data['return_trips'].sort(key=lambda x: x['departure'])
+
+        if axes:
+            axe_counts = Counter(axes)
+            if len(axe_counts) == 1 and 'INTERNATIONAL' in axe_counts:
+                most_common_axe = 'INTERNATIONAL'
+            else:
+                non_international_axes = {axe: count for axe, count in axe_counts.items() if axe != 'INTERNATIONAL'}
+                if non_international_axes:
+                    most_common_axe = max(non_international_axes.items(), key=lambda x: x[1])[0]
+                else:
+                    most_common_axe = None
+        else:
+            most_common_axe = None
+        dest_data['main_axe'] = most_common_axe
+
+    return sorted(
+        grouped_trips.values(),
+        key=lambda x: parse_time_to_minutes(x['max_time_at_destination']),
+        reverse=True
+    )
+
+
+def hour_gap(trip):
+    """The sort key of the original SQL."""
+    return 24 - int(trip['outbound_arrival'][:2]) + int(trip['return_departure'][:2])
+
+
+def as_rows(trips):
+    return sorted(tuple(trip[field] for field in BASELINE_FIELDS) for trip in trips)
+
+
+class DayTripEquivalenceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, 'tgvmax.db')
+        writer = db.create_engine(path)
+        result = utils.update_db(writer, FIXTURE)
+        assert result['success'], result
+        writer.dispose()
+
+        cls.patches = [mock.patch.object(utils, 'engine', db.create_engine(path)),
+                       mock.patch.object(utils, 'read_engine', db.create_engine(path, read_only=True))]
+        for patch in cls.patches:
+            patch.start()
+
+        # The original schema: the trips as text, as the export was loaded
+        cls.legacy = sqlite3.connect(os.path.join(cls.directory.name, 'legacy.db'))
+        with sqlite3.connect(path) as conn:
+            trips = pd.read_sql_query("SELECT * FROM TGVMAX_TEXT", conn)
+            cls.stations = [name for (name,) in conn.execute("SELECT name FROM stations ORDER BY name")]
+        trips.to_sql('TGVMAX', cls.legacy, index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        cls.legacy.close()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.result_cache.clear()
+
+    def assertSameTrips(self, trips, expected, order_key):
+        self.assertEqual(as_rows(trips), as_rows(expected))
+        self.assertEqual([order_key(trip) for trip in trips], [order_key(trip) for trip in expected])
+
+    def test_fixture_has_day_trips(self):
+        date = datetime.strptime(DATES[0], '%Y-%m-%d')
+        self.assertGreater(len(utils.find_optimal_destinations_single_station('PARIS (intramuros)', date, date)), 10)
+
+    def test_single_station_matches_baseline(self):
+        first, second = (datetime.strptime(date, '%Y-%m-%d') for date in DATES)
+        for date1, date2 in ((first, first), (second, second), (first, second)):
+            for station in self.stations:
+                with self.subTest(station=station, date1=date1, date2=date2):
+                    self.assertSameTrips(utils.find_optimal_destinations_single_station(station, date1, date2),
+                                         baseline_single_station(self.legacy, station, date1, date2), hour_gap)
+
+    def test_materialized_lookup_matches_timetable_search(self):
+        for date in DATES:
+            day = datetime.strptime(date, '%Y-%m-%d')
+            self.assertIsNotNone(day_trips.lookup(utils.read_engine, self.stations, schema.date_to_day(date)))
+            materialized = utils._search_day_trips(self.stations, day, day)
+            with mock.patch.object(day_trips, 'lookup', return_value=None):
+                searched = utils._search_day_trips(self.stations, day, day)
+            self.assertEqual(materialized, searched)
+
+    def test_batched_stations_match_baseline(self):
+        stations = ['PARIS (intramuros)', GROUP, 'LYON (intramuros)', 'RENNES', 'BORDEAUX ST JEAN']
+        for dates in ([DATES[0], DATES[0]], DATES):
+            batched = utils.find_optimal_destinations_many(stations, dates)
+            for station in stations:
+                with self.subTest(station=station, dates=dates):
+                    order_key = (lambda trip: trip['time_at_destination_minutes']) if station == GROUP else hour_gap
+                    self.assertSameTrips(batched[station], baseline_destinations(self.legacy, station, dates),
+                                         order_key)
+
+    def test_aggregation_matches_baseline(self):
+        trips_by_station = utils.find_optimal_destinations_many(['PARIS (intramuros)', GROUP, 'LILLE (intramuros)'],
+                                                                DATES[0])
+        all_trips = [trip for trips in trips_by_station.values() for trip in trips]
+        expected = baseline_aggregate(all_trips)
+        destinations, total = utils.aggregate_destinations(all_trips)
+        self.assertEqual(total, len(expected))
+        self.assertEqual(destinations, expected)
+        self.assertEqual(utils.aggregate_destinations(all_trips, limit=5, offset=3)[0], expected[3:8])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Fare-rule normalization against the original implementation, on a small export.
+
+tests/fixtures/tgvmax_sample.csv (see test_day_trip_equivalence.py) is
+ingested into two databases without any fix applied. One is normalized by
+the original SQL passes, kept here verbatim: the coupure self-join and the
+soudure self-join repeated up to 10 times. The other goes through
+normalize_fare_rules. Both must end with the same dispo on every row, for
+the whole export and when an incremental update limits the fixes to a set
+of trains.
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+os.environ['TGVMAX_CACHE_PATH'] = ''
+
+from sqlalchemy import text
+
+from src import db, ingest, utils
+
+logger = logging.getLogger(__name__)
+
+FIXTURE = os.path.join(PROJECT_ROOT, 'tests', 'fixtures', 'tgvmax_sample.csv')
+SCOPE_TABLE = 'scope_trains'
+
+
+def _train_scope(alias, trains_table):
+    """SQL condition restricting `alias` rows to the (day, train_no) pairs of `trains_table`."""
+    if trains_table is None:
+        return ""
+    return f"AND ({alias}.day, {alias}.train_no) IN (SELECT day, train_no FROM {trains_table})"
+
+
+def fix_coupure_non_autorisee(engine=None, trains_table=None):
+    """
+    Fix coupure non autorisée by setting dispo from 0 (NON) to 1 (OUI)
+    for A->B trips where A->C is available and B is intermediate.
+    Production version for main database; `trains_table` limits the fix
+    to the trains it lists.
+    """
+    if engine is None:
+        from src.utils import engine as default_engine
+        engine = default_engine
+        
+    start_time = time.perf_counter()
+    
+    # Query to find coupure non autorisée cases
+    # The short leg A->B and the long leg A->C share their departure; B is an
+    # intermediate stop when the short leg arrives before the long one does.
+    find_query = text(f"""
+    SELECT DISTINCT us.UID as short_uid
+    FROM TGVMAX us
+    JOIN TGVMAX al ON (
+        us.day = al.day
+        AND us.train_no = al.train_no
+        AND us.origin_id = al.origin_id
+        AND us.dest_id != al.dest_id
+    )
+    WHERE us.dispo = 0
+      {_train_scope('us', trains_table)}
+      AND al.dispo = 1
+      AND us.dep_min = al.dep_min
+      AND us.arr_min > us.dep_min
+      AND us.arr_min < al.arr_min
+    """)
+    
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(find_query)
+            uids_to_fix = [row[0] for row in result.fetchall()]
+        
+        if not uids_to_fix:
+            elapsed = time.perf_counter() - start_time
+            logger.info(f"✅ No coupure non autorisée issues found ({elapsed:.3f}s)")
+            return {'found': 0, 'fixed': 0, 'elapsed': elapsed}
+        
+        # Fix all issues in batch
+        with engine.begin() as conn:
+            uid_list = ','.join(map(str, uids_to_fix))
+            batch_update_query = text(f"UPDATE TGVMAX SET dispo = 1 WHERE UID IN ({uid_list})")
+            result = conn.execute(batch_update_query)
+            fixed_count = result.rowcount
+        
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"🔧 Fixed {fixed_count} coupure non autorisée issues ({elapsed:.3f}s)")
+        
+        return {
+            'found': len(uids_to_fix),
+            'fixed': fixed_count,
+            'elapsed': elapsed
+        }
+        
+    except Exception as e:
+        elapsed = time.perf_counter() - start_time
+        logger.error(f"❌ Error fixing coupure non autorisée: {e} ({elapsed:.3f}s)")
+        raise
+
+
+def fix_soudure_non_autorisee_iterative(engine=None, trains_table=None):
+    """
+    Fix soudure non autorisée iteratively by setting dispo from 0 (NON) to 1 (OUI)
+    for A->C trips where both A->B and B->C segments are available.
+    Production version for main database; `trains_table` limits the fix
+    to the trains it lists.
+    """
+    if engine is None:
+        from src.utils import engine as default_engine
+        engine = default_engine
+        
+    overall_start_time = time.perf_counter()
+    
+    find_query = text(f"""
+    SELECT DISTINCT ud.UID as direct_uid
+    FROM TGVMAX ud
+    JOIN TGVMAX seg1 ON (
+        ud.day = seg1.day
+        AND ud.train_no = seg1.train_no
+        AND ud.origin_id = seg1.origin_id
+        AND seg1.dest_id != ud.dest_id
+    )
+    JOIN TGVMAX seg2 ON (
+        ud.day = seg2.day
+        AND ud.train_no = seg2.train_no
+        AND seg1.dest_id = seg2.origin_id
+        AND seg2.dest_id = ud.dest_id
+    )
+    WHERE ud.dispo = 0
+      {_train_scope('ud', trains_table)}
+      AND seg1.dispo = 1
+      AND seg2.dispo = 1
+      AND seg1.arr_min <= seg2.dep_min
+    """)
+    
+    total_fixed = 0
+    iteration = 0
+    
+    try:
+        while iteration < 10:  # Safety limit
+            iteration += 1
+            
+            # Find issues in this iteration
+            with engine.connect() as conn:
+                result = conn.execute(find_query)
+                uids_to_fix = [row[0] for row in result.fetchall()]
+            
+            if not uids_to_fix:
+                break
+            
+            # Fix the issues in batch
+            with engine.begin() as conn:
+                uid_list = ','.join(map(str, uids_to_fix))
+                batch_update_query = text(f"UPDATE TGVMAX SET dispo = 1 WHERE UID IN ({uid_list})")
+                result = conn.execute(batch_update_query)
+                fixed_count = result.rowcount
+                total_fixed += fixed_count
+            
+            logger.info(f"🔧 Iteration {iteration}: Fixed {fixed_count} soudure non autorisée issues")
+        
+        overall_elapsed = time.perf_counter() - overall_start_time
+        
+        if total_fixed > 0:
+            logger.info(f"✅ Completed soudure fixes: {total_fixed} total issues fixed in {iteration} iterations ({overall_elapsed:.3f}s)")
+        else:
+            logger.info(f"✅ No soudure non autorisée issues found ({overall_elapsed:.3f}s)")
+        
+        return {
+            'total_iterations': iteration,
+            'total_fixed': total_fixed,
+            'elapsed': overall_elapsed
+        }
+        
+    except Exception as e:
+        elapsed = time.perf_counter() - overall_start_time
+        logger.error(f"❌ Error fixing soudure non autorisée: {e} ({elapsed:.3f}s)")
+        raise
+
+
+class FareRulesEquivalenceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.ingested = os.path.join(cls.directory.name, 'ingested.db')
+        engine = db.create_engine(cls.ingested)
+        ingest.ingest_export(engine, FIXTURE)
+        engine.dispose()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def copy(self, name, scope=None):
+        """A fresh engine on a copy of the ingested export, with `scope` as the trains table."""
+        path = os.path.join(self.directory.name, f'{name}.db')
+        shutil.copyfile(self.ingested, path)
+        engine = db.create_engine(path)
+        if scope is not None:
+            with engine.begin() as conn:
+                conn.execute(text(f"CREATE TABLE {SCOPE_TABLE} (day INTEGER, train_no INTEGER)"))
+                conn.execute(text(f"INSERT INTO {SCOPE_TABLE} VALUES (:day, :train_no)"),
+                             [{'day': day, 'train_no': train_no} for day, train_no in scope])
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def dispo(self, engine):
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT UID, dispo FROM TGVMAX ORDER BY UID")).fetchall()
+
+    def assertSameNormalization(self, scope=None):
+        trains_table = SCOPE_TABLE if scope is not None else None
+        original = self.copy('original', scope)
+        coupure = fix_coupure_non_autorisee(original, trains_table)
+        soudure = fix_soudure_non_autorisee_iterative(original, trains_table)
+        normalized = self.copy('normalized', scope)
+        result = utils.normalize_fare_rules(normalized, trains_table)
+
+        self.assertEqual(result['coupure_fixed'], coupure['fixed'])
+        self.assertEqual(result['soudure_fixed'], soudure['total_fixed'])
+        self.assertEqual(self.dispo(normalized), self.dispo(original))
+        return result
+
+    def test_fixture_has_fixes(self):
+        with sqlite3.connect(self.ingested) as conn:
+            unavailable = conn.execute("SELECT COUNT(*) FROM TGVMAX WHERE dispo = 0").fetchone()[0]
+        self.assertGreater(unavailable, 0)
+        result = utils.normalize_fare_rules(self.copy('counts'))
+        self.assertGreater(result['coupure_fixed'], 0)
+        self.assertGreater(result['soudure_fixed'], 0)
+
+    def test_whole_export_matches_original(self):
+        self.assertSameNormalization()
+
+    def test_scoped_trains_match_original(self):
+        with sqlite3.connect(self.ingested) as conn:
+            trains = conn.execute("SELECT DISTINCT day, train_no FROM TGVMAX ORDER BY day, train_no").fetchall()
+        result = self.assertSameNormalization(scope=trains[::3])
+        self.assertEqual(result['trains'], len(trains[::3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Router searches on a hand-built timetable: the departure window and the
+transfer bound apply to every search mode.
+"""
+
+import os
+import sys
+import unittest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from src import router, timetable
+
+DAY = 100
+
+# (origin, destination, departure, arrival), all on DAY
+TRAINS = [
+    ('A', 'B', '11:00', '15:00'),
+    ('A', 'B', '13:00', '14:00'),
+    ('A', 'C', '08:00', '12:00'),
+    ('A', 'D', '09:00', '10:00'),
+    ('D', 'C', '10:30', '11:30'),
+]
+
+
+def minutes(hhmm):
+    hours, mins = hhmm.split(':')
+    return int(hours) * 60 + int(mins)
+
+
+def build_router():
+    stations = sorted({station for train in TRAINS for station in train[:2]})
+    index = {name: i for i, name in enumerate(stations)}
+    tt = timetable.Timetable(
+        stations, ['TGV'],
+        uid=range(len(TRAINS)),
+        origin=[index[train[0]] for train in TRAINS],
+        destination=[index[train[1]] for train in TRAINS],
+        day=[DAY] * len(TRAINS),
+        dep=[minutes(train[2]) for train in TRAINS],
+        arr=[minutes(train[3]) for train in TRAINS],
+        train_no=range(len(TRAINS)),
+        axe=[0] * len(TRAINS),
+    )
+    return router.RaptorRouter(tt)
+
+
+class RouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = build_router()
+        self.tt = self.router.tt
+
+    def describe(self, legs):
+        tt = self.tt
+        return [(tt.stations[tt.origin[row]], tt.stations[tt.destination[row]], int(tt.dep[row]))
+                for row in legs]
+
+    def test_pareto_journeys_first_train_leaves_in_window(self):
+        journeys = self.router.pareto_journeys(DAY, ['A'], ['B'], depart_before=minutes('12:00'))
+        self.assertEqual([self.describe(legs) for legs in journeys], [[('A', 'B', minutes('11:00'))]])
+
+        journeys = self.router.pareto_journeys(DAY, ['A'], ['B'])
+        self.assertEqual([self.describe(legs) for legs in journeys], [[('A', 'B', minutes('13:00'))]])
+
+    def test_latest_departure_window(self):
+        legs = self.router.latest_departure(DAY, ['A'], ['B'], depart_before=minutes('12:00'))
+        self.assertEqual(self.describe(legs), [('A', 'B', minutes('11:00'))])
+
+        legs = self.router.latest_departure(DAY, ['A'], ['B'], depart_after=minutes('13:30'))
+        self.assertIsNone(legs)
+
+    def test_latest_departure_transfer_bound(self):
+        legs = self.router.latest_departure(DAY, ['A'], ['C'])
+        self.assertEqual(self.describe(legs), [('A', 'D', minutes('09:00')), ('D', 'C', minutes('10:30'))])
+
+        # A later journey with too many changes must not hide a direct train
+        legs = self.router.latest_departure(DAY, ['A'], ['C'], max_transfers=0)
+        self.assertEqual(self.describe(legs), [('A', 'C', minutes('08:00'))])
+
+
+if __name__ == '__main__':
+    unittest.main()